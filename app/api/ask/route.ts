@@ -34,6 +34,16 @@ export async function POST(request: NextRequest) {
       throw new Error(`Backend responded with status: ${response.status}`);
     }
 
+    // Streaming asks (NDJSON: sources, tokens, done) are passed through unbuffered
+    if (body.stream && response.body) {
+      return new Response(response.body, {
+        headers: {
+          'Content-Type': 'application/x-ndjson',
+          'Cache-Control': 'no-cache',
+        },
+      });
+    }
+
     const data = await response.json();
     return NextResponse.json(data);
   } catch (error) {
@@ -1,6 +1,15 @@
 from http.server import BaseHTTPRequestHandler
 import json
-from shared import get_retriever, get_rag_chain, prioritize_sections, cors_headers, DEFAULT_K
+from shared import (
+    get_pipeline, get_qa_chain, get_packer, get_answer_cache, cors_headers, unreported,
+    metrics, llm_guard, LLMUnavailable, DEFAULT_K,
+)
+from rag_pipeline import Timings, stage
+from answer_cache import source_keys
+from ask_stream import (
+    stream_answer, sources_payload, retrieval_only_text, NDJSON,
+    NO_LLM_PREFIX, EMPTY_PREFIX, FAILED_PREFIX,
+)
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
@@ -11,79 +20,67 @@ class handler(BaseHTTPRequestHandler):
             
             question = body.get('question', '')
             k = body.get('k', DEFAULT_K)
+
+            # Retrieve once: the LLM context, the cited sources and every fallback come from here
+            pipeline = get_pipeline()
+            timings = Timings()
+            docs, qvec = pipeline.retrieve(question, timings)
+            top = pipeline.rank(docs, k, timings)
+
+            if body.get('stream'):
+                return self._stream(question, k, docs, top, qvec, timings)
             
-            def _retrieval_only_answer(prefix: str):
-                retriever = get_retriever()
-                docs = retriever.invoke(question) or []
-                docs = prioritize_sections(docs)[:k]
-                bullets = []
-                for i, d in enumerate(docs, 1):
-                    sec = (d.metadata.get("section") or "fulltext")
-                    text = (d.page_content or "").strip()[:350]
-                    bullets.append(f"[{i}] ({sec}) {text}")
+            def _retrieval_only_answer(prefix: str, reason: str):
+                metrics.fallbacks.inc(reason)
                 return {
                     "query": question,
                     "k": k,
-                    "answer": (
-                        f"{prefix}\n\n" +
-                        ("\n\n".join(bullets) if bullets else "No matching passages found.")
-                    ),
-                    "sources": [
-                        {
-                            "label": f"[{i+1}]",
-                            "title": d.metadata.get("title"), 
-                            "url": d.metadata.get("url"),
-                            "section": d.metadata.get("section", "fulltext"),
-                        }
-                        for i, d in enumerate(docs)
-                    ],
+                    "answer": retrieval_only_text(prefix, top),
+                    "sources": sources_payload(top),
                 }
 
-            # Try LLM path first
-            rag_chain = get_rag_chain()
-            if rag_chain:
+            # Try LLM path first; without an API key the OpenAI stack is never imported
+            qa_chain = get_qa_chain()
+            answer_cache = get_answer_cache()
+            cached, keys = None, source_keys(docs)
+            if qa_chain:
+                # Semantic answer cache: a close paraphrase with overlapping sources skips the LLM
                 try:
-                    result = rag_chain.invoke({"input": question}) or {}
-                    
-                    # Extract answer text
-                    answer_text = (
-                        result.get("answer")
-                        or result.get("output_text")
-                        or result.get("result")
-                        or ""
-                    )
-
-                    # Extract context docs
-                    ctx_docs = result.get("context") or result.get("source_documents") or []
-                    if not isinstance(ctx_docs, list):
-                        ctx_docs = []
-                    
-                    ctx_docs = prioritize_sections(ctx_docs)[:k]
+                    with stage("answer_cache", timings):
+                        cached = answer_cache.lookup(qvec, keys, k)
+                except Exception:
+                    cached = None
+            if cached:
+                response_data = {**cached, "query": question}
+            elif qa_chain:
+                try:
+                    with stage("pack", timings):
+                        context, _ = get_packer().pack(docs)
+                    with llm_guard.guarded(), stage("llm", timings):
+                        answer_text = qa_chain.invoke({"input": question, "context": context})
+                    if not isinstance(answer_text, str):
+                        answer_text = str(answer_text or "")
 
                     if not answer_text.strip():
-                        return _retrieval_only_answer("LLM returned no text. Showing retrieval-only synthesis:")
-
-                    sources = [
-                        {
-                            "label": f"[{i+1}]",
-                            "title": d.metadata.get("title"),
-                            "url": d.metadata.get("url"),
-                            "section": d.metadata.get("section", "fulltext"),
-                        }
-                        for i, d in enumerate(ctx_docs)
-                    ]
-
-                    response_data = {"query": question, "k": k, "answer": answer_text, "sources": sources}
+                        response_data = _retrieval_only_answer(EMPTY_PREFIX, "empty")
+                    else:
+                        sources = sources_payload(top)
+                        response_data = {"query": question, "k": k, "answer": answer_text, "sources": sources}
+                        answer_cache.store(qvec, keys, k, response_data)
                     
+                except LLMUnavailable as e:
+                    response_data = _retrieval_only_answer(FAILED_PREFIX, e.reason)
                 except Exception as e:
-                    response_data = _retrieval_only_answer("LLM unavailable (quota/error). Showing retrieval-only synthesis:")
+                    response_data = _retrieval_only_answer(FAILED_PREFIX, "llm_error")
             else:
-                response_data = _retrieval_only_answer("Preliminary synthesis (retrieval-only; set OPENAI_API_KEY to enable LLM):")
+                response_data = _retrieval_only_answer(NO_LLM_PREFIX, "no_llm")
             
+            timings.update(unreported())  # import / load time, on this instance's first request only
             self.send_response(200)
             for key, value in cors_headers().items():
                 self.send_header(key, value)
             self.send_header('Content-Type', 'application/json')
+            self.send_header('Server-Timing', timings.server_timing())
             self.end_headers()
             self.wfile.write(json.dumps(response_data).encode())
             
@@ -95,6 +92,42 @@ class handler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(json.dumps({"error": "Ask failed"}).encode())
 
+    def _stream(self, question, k, docs, top, qvec, timings):
+        """NDJSON stream: sources once retrieval is done, then LLM tokens (see ask_stream.py)."""
+        qa_chain = get_qa_chain()
+        answer_cache = get_answer_cache()
+        keys = source_keys(docs)
+        cached, context = None, docs
+        if qa_chain:
+            try:
+                with stage("answer_cache", timings):
+                    cached = answer_cache.lookup(qvec, keys, k)
+            except Exception:
+                cached = None
+            if not cached:
+                with stage("pack", timings):
+                    context, _ = get_packer().pack(docs)
+
+        def remember(response):
+            answer_cache.store(qvec, keys, k, response)
+
+        timings.update(unreported())
+        self.send_response(200)
+        for key, value in cors_headers().items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', NDJSON)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Server-Timing', timings.server_timing())
+        self.end_headers()
+        events = stream_answer(
+            question, k, context, top,
+            qa_chain=qa_chain, cached=cached, on_answer=remember,
+            on_fallback=lambda reason: metrics.fallbacks.inc(reason), guard=llm_guard,
+        )
+        for line in events:
+            self.wfile.write(line.encode())
+            self.wfile.flush()
+
     def do_OPTIONS(self):
         self.send_response(200)
         for key, value in cors_headers().items():
@@ -1,7 +1,8 @@
 from http.server import BaseHTTPRequestHandler
 import json
 import os
-from shared import cors_headers
+# shared.py imports nothing heavy at module level, so a /health cold start stays cheap
+from shared import cors_headers, startup_report
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -11,8 +12,10 @@ class handler(BaseHTTPRequestHandler):
                 "index_dir": os.getenv("INDEX_DIR", "backend/index-chroma"), 
                 "collection": os.getenv("COLLECTION_NAME", "spacebio"),
                 "embed_model": os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+                "embed_backend": os.getenv("EMBED_BACKEND", "torch"),
                 "openai_model": os.getenv("OPENAI_MODEL", "gpt-4o-mini") if os.getenv("OPENAI_API_KEY") else None,
                 "llm_enabled": bool(os.getenv("OPENAI_API_KEY")),
+                "startup": startup_report(),
             }
             
             self.send_response(200)
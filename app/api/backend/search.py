@@ -1,6 +1,8 @@
 from http.server import BaseHTTPRequestHandler
 import json
-from shared import get_retriever, prioritize_sections, cors_headers, DEFAULT_K
+from shared import get_pipeline, get_lexical, lexical_search, cors_headers, unreported, DEFAULT_K, FETCH_K
+from rag_pipeline import Timings, stage
+from lexical_index import SEARCH_MODES, fuse
 
 class handler(BaseHTTPRequestHandler):
     def do_POST(self):
@@ -11,10 +13,28 @@ class handler(BaseHTTPRequestHandler):
             
             question = body.get('question', '')
             k = body.get('k', DEFAULT_K)
-            
-            retriever = get_retriever()
-            docs = retriever.invoke(question)
-            docs = prioritize_sections(docs)[:k]
+            mode = body.get('mode', 'dense')
+            if mode not in SEARCH_MODES:
+                return self.send_error_json(400, f"mode must be one of {', '.join(SEARCH_MODES)}")
+            if mode != 'dense' and get_lexical() is None:
+                return self.send_error_json(503, "No lexical index; rebuild it with embed_local.py (LEXICAL=1)")
+
+            timings = Timings()
+            if mode == 'lexical':
+                # BM25 only: no embedding model is loaded for this
+                docs = lexical_search(question, k, timings)
+            else:
+                pipeline = get_pipeline()
+                # hybrid: dense and BM25 lists equally deep, fused, then cut to k
+                depth = max(k, FETCH_K) if mode == 'hybrid' else None
+                docs, _ = pipeline.retrieve(question, timings, need_vector=False, k=depth)
+                if mode == 'hybrid':
+                    dense = pipeline.rank(docs, depth, timings)
+                    found = lexical_search(question, depth, timings)
+                    with stage("fusion", timings):
+                        docs = fuse([dense, found], k)
+                else:
+                    docs = pipeline.rank(docs, k, timings)
 
             response_data = {
                 "query": question,
@@ -30,20 +50,25 @@ class handler(BaseHTTPRequestHandler):
                 ],
             }
             
+            timings.update(unreported())  # import / load time, on this instance's first request only
             self.send_response(200)
             for key, value in cors_headers().items():
                 self.send_header(key, value)
             self.send_header('Content-Type', 'application/json')
+            self.send_header('Server-Timing', timings.server_timing())
             self.end_headers()
             self.wfile.write(json.dumps(response_data).encode())
             
         except Exception as e:
-            self.send_response(500)
-            for key, value in cors_headers().items():
-                self.send_header(key, value)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"error": "Search failed"}).encode())
+            self.send_error_json(500, "Search failed")
+
+    def send_error_json(self, status, message):
+        self.send_response(status)
+        for key, value in cors_headers().items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({"error": message}).encode())
 
     def do_OPTIONS(self):
         self.send_response(200)
@@ -0,0 +1,68 @@
+from http.server import BaseHTTPRequestHandler
+import json
+from shared import get_pipeline, cors_headers, DEFAULT_K
+from batch_search import search_batch, BATCH_MAX_QUESTIONS
+
+class handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        try:
+            content_length = int(self.headers['Content-Length'])
+            post_data = self.rfile.read(content_length)
+            body = json.loads(post_data.decode('utf-8'))
+            
+            questions = body.get('questions') or []
+            k = body.get('k', DEFAULT_K)
+
+            if len(questions) > BATCH_MAX_QUESTIONS:
+                self.send_response(413)
+                for key, value in cors_headers().items():
+                    self.send_header(key, value)
+                self.send_header('Content-Type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}).encode())
+                return
+
+            # one batched encoder call and one vector query for all questions
+            pipeline = get_pipeline()
+            found = search_batch(pipeline.retriever, pipeline.vs, pipeline.emb, questions, pipeline.engine)
+
+            response_data = {
+                "k": k,
+                "results": [
+                    {
+                        "query": question,
+                        "k": k,
+                        "results": [
+                            {
+                                "title": d.metadata.get("title"),
+                                "url": d.metadata.get("url"),
+                                "section": d.metadata.get("section", "fulltext"),
+                                "snippet": d.page_content[:500],
+                            }
+                            for d in pipeline.rank(docs, k)
+                        ],
+                    }
+                    for question, docs in zip(questions, found)
+                ],
+            }
+            
+            self.send_response(200)
+            for key, value in cors_headers().items():
+                self.send_header(key, value)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(response_data).encode())
+            
+        except Exception as e:
+            self.send_response(500)
+            for key, value in cors_headers().items():
+                self.send_header(key, value)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps({"error": "Batch search failed"}).encode())
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        for key, value in cors_headers().items():
+            self.send_header(key, value)
+        self.end_headers()
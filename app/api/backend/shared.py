@@ -1,64 +1,146 @@
 import os
+import sys
 import json
+from pathlib import Path
 from typing import List, Optional, Dict, Any
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain
+
+# Helpers shared with the FastAPI service (backend/rag_service.py) live in backend/
+sys.path.append(str(Path(__file__).resolve().parents[3] / "backend"))
+# Only light modules at import time: every function imports this file, but /health needs none of
+# the retrieval or LLM stack. Each getter below imports what it needs on first use, timed by phase().
+from cold_start import phase, unreported, report as startup_report, snapshot_model
+from metrics import metrics
+from llm_guard import LLMGuard, LLMUnavailable, LLM_DEADLINE_S, LLM_MAX_RETRIES
 
 # Configuration
 INDEX_DIR = os.getenv("INDEX_DIR", "backend/index-chroma")
 MODEL_NAME = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 COLLECTION = os.getenv("COLLECTION_NAME", "spacebio")
 DEFAULT_K = int(os.getenv("DEFAULT_K", "4"))
-FETCH_K = int(os.getenv("FETCH_K", "16"))
+# "chroma" by default here: "numpy" loads the whole index on every cold start. "mmap" / "faiss" only map
+# the files export_index.py wrote (deploy MMAP_DIR alongside the code), so a cold start reads just what it
+# touches and never imports chromadb
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+MMAP_DIR = os.getenv("MMAP_DIR", "backend/index-mmap")
+USES_MMAP = VECTOR_BACKEND in ("mmap", "faiss")
+# EMBED_BACKEND=onnx: encode queries with onnxruntime, leaving PyTorch out of the bundle and the cold start
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "backend/onnx-model")
+# model saved by build_snapshot.py; loaded from the bundle instead of the Hugging Face Hub
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "backend/snapshot")
+FETCH_K = int(os.getenv("FETCH_K", "16" if VECTOR_BACKEND == "chroma" else "64"))
 PREFERRED_SECTIONS = {"results", "discussion", "conclusion", "abstract"}
+SECTION_FILTER = os.getenv("SECTION_FILTER", "1") != "0"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "/tmp/embed-cache.sqlite")  # only /tmp is writable
+# an instance serves one request at a time, so by default only batch what is already queued
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "0"))
 
 # Global variables for caching
 _emb = None
 _vs = None
 _retriever = None
-_rag_chain = None
+_pipeline = None
+_engine = None
+_qa_chain = None
+_query_cache = None
+_answer_cache = None
+_packer = None
+_lexical = None
+# breaker state also outlives a request; while open, /ask skips the LLM entirely
+llm_guard = LLMGuard()
+
+def get_query_cache():
+    """Lives as long as the warm function instance; cleared when the index changes."""
+    global _query_cache
+    if _query_cache is None:
+        with phase("import_retrieval"):
+            from query_cache import QueryCache
+        if USES_MMAP:
+            from mmap_index import MmapIndex
+            _query_cache = QueryCache(MMAP_DIR, files=MmapIndex.FILES)
+        else:
+            _query_cache = QueryCache(INDEX_DIR)
+    return _query_cache
+
+def get_answer_cache():
+    global _answer_cache
+    if _answer_cache is None:
+        from answer_cache import SemanticAnswerCache
+        _answer_cache = SemanticAnswerCache(version=get_query_cache().current_version)
+    return _answer_cache
+
+def get_packer():
+    global _packer
+    if _packer is None:
+        with phase("import_packer"):
+            from context_packer import ContextPacker
+        with phase("load_tokenizer"):
+            _packer = ContextPacker(OPENAI_MODEL).warm_up()
+    return _packer
 
 def get_embeddings():
     global _emb
     if _emb is None:
-        _emb = HuggingFaceEmbeddings(model_name=MODEL_NAME)
+        with phase("import_retrieval"):
+            from embedding_cache import CachedEmbeddings, open_cache
+            from query_cache import MemoEmbeddings
+            from embed_batcher import BatchedEmbeddings
+            from onnx_embeddings import load_encoder
+        embed_store = open_cache(MODEL_NAME, EMBED_CACHE_PATH)
+        with phase("load_model"):
+            encoder = load_encoder(
+                MODEL_NAME, model_dir=ONNX_MODEL_DIR, model_path=snapshot_model(MODEL_NAME, SNAPSHOT_DIR),
+            )
+        batched = BatchedEmbeddings(encoder, max_wait_ms=EMBED_BATCH_WAIT_MS)
+        _emb = MemoEmbeddings(
+            CachedEmbeddings(batched, embed_store),
+            get_query_cache().embeddings,
+        )
     return _emb
 
 def get_vector_store():
     global _vs
     if _vs is None:
         emb = get_embeddings()
-        _vs = Chroma(
-            persist_directory=INDEX_DIR,
-            embedding_function=emb,
-            collection_name=COLLECTION,
-        )
+        with phase("import_chroma"):
+            from index_versions import VersionedChroma
+        with phase("open_chroma"):
+            # the version INDEX_DIR/CURRENT names, or INDEX_DIR itself for an unversioned index
+            _vs = VersionedChroma(INDEX_DIR, emb, COLLECTION, version=get_query_cache().version.current)
+        if VECTOR_BACKEND == "chroma":
+            get_query_cache().track(_vs.served_version)
     return _vs
 
 def get_retriever():
     global _retriever
     if _retriever is None:
-        vs = get_vector_store()
-        _retriever = vs.as_retriever(
-            search_type="mmr",
-            search_kwargs={
-                "k": DEFAULT_K,
-                "fetch_k": FETCH_K,
-                "filter": {"section": {"$in": list(PREFERRED_SECTIONS)}},  
-            },
-        )
+        from query_cache import CachedRetriever
+        from rag_pipeline import EngineRetriever
+        search_kwargs = {
+            "k": DEFAULT_K,
+            "fetch_k": FETCH_K,
+            "filter": {"section": {"$in": list(PREFERRED_SECTIONS)}} if SECTION_FILTER else None,
+        }
+        if VECTOR_BACKEND != "chroma":
+            inner = EngineRetriever(engine=get_engine(), embeddings=get_embeddings(), search_kwargs=search_kwargs)
+        else:
+            inner = get_vector_store().as_retriever(search_type="mmr", search_kwargs=search_kwargs)
+        _retriever = CachedRetriever(retriever=inner, cache=get_query_cache())
     return _retriever
 
-def get_rag_chain():
-    global _rag_chain
-    if _rag_chain is None and OPENAI_API_KEY:
-        llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+def get_qa_chain():
+    """None without OPENAI_API_KEY, in which case the OpenAI / LangChain chain stack is never imported."""
+    global _qa_chain
+    if _qa_chain is None and OPENAI_API_KEY:
+        with phase("import_llm"):
+            from langchain_openai import ChatOpenAI
+            from langchain.prompts import ChatPromptTemplate
+            from langchain.chains.combine_documents import create_stuff_documents_chain
+        llm = ChatOpenAI(
+            model=OPENAI_MODEL, temperature=0.2, api_key=OPENAI_API_KEY,
+            timeout=LLM_DEADLINE_S, max_retries=LLM_MAX_RETRIES,
+        )
         prompt = ChatPromptTemplate.from_messages([
             ("system",
              "You are a concise NASA bioscience research assistant. "
@@ -69,10 +151,8 @@ def get_rag_chain():
              "Question: {input}\n\n"
              "Context (citations included below):\n{context}")
         ])
-        qa_chain = create_stuff_documents_chain(llm, prompt)
-        retriever = get_retriever()
-        _rag_chain = create_retrieval_chain(retriever, qa_chain)
-    return _rag_chain
+        _qa_chain = create_stuff_documents_chain(llm, prompt)
+    return _qa_chain
 
 def prioritize_sections(docs):
     def score(d):
@@ -80,9 +160,56 @@ def prioritize_sections(docs):
         return 1 if sec in PREFERRED_SECTIONS else 0
     return sorted(docs, key=score, reverse=True)
 
+def get_engine():
+    """The vector engine, following the shard layout of the served index version (backend/sharded_index.py):
+    SectionIndex / MmapIndex for VECTOR_BACKEND=numpy|mmap|faiss, ShardedIndex for a sharded version, or
+    none (`current()` is None) to search Chroma."""
+    global _engine
+    if _engine is None:
+        from sharded_index import open_engine
+        vs = None if USES_MMAP else get_vector_store()
+        with phase("load_index"):
+            _engine = open_engine(
+                VECTOR_BACKEND, vs=vs, index_dir=INDEX_DIR, collection=COLLECTION, mmap_dir=MMAP_DIR,
+                preferred=PREFERRED_SECTIONS, version=get_query_cache().version.current,
+            )
+            _engine.refresh()  # load / map now rather than inside the first search; shards load at once
+        get_query_cache().track(_engine.served_version)
+    return _engine
+
+def get_lexical():
+    """BM25 index for /search mode=lexical|hybrid (backend/lexical_index.py), or None if none was built.
+
+    Serving it loads no embedding model: a lexical-only instance never imports PyTorch.
+    """
+    global _lexical
+    if _lexical is None:
+        with phase("load_lexical"):
+            from lexical_index import LexicalIndex
+            _lexical = LexicalIndex(INDEX_DIR)
+            if _lexical.available():
+                _lexical.refresh()
+    return _lexical if _lexical.available() else None
+
+def lexical_search(question, k, timings):
+    from rag_pipeline import stage
+    with stage("lexical", timings):
+        return get_lexical().search(question, k, PREFERRED_SECTIONS if SECTION_FILTER else None)
+
+def get_pipeline():
+    """Timed retrieve-once pipeline shared by /search and /ask (see backend/rag_pipeline.py)."""
+    global _pipeline
+    if _pipeline is None:
+        from rag_pipeline import RagPipeline
+        # the mmap engines serve without Chroma; numpy / chroma need the store
+        vs = None if USES_MMAP else get_vector_store()
+        _pipeline = RagPipeline(get_retriever(), vs, get_embeddings(), prioritize_sections, get_engine())
+    return _pipeline
+
 def cors_headers():
     return {
         'Access-Control-Allow-Origin': '*',
         'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
         'Access-Control-Allow-Headers': 'Content-Type',
+        'Access-Control-Expose-Headers': 'Server-Timing',
     }
@@ -0,0 +1,46 @@
+import { NextRequest, NextResponse } from 'next/server';
+
+export async function POST(request: NextRequest) {
+  try {
+    const body = await request.json();
+    const isProduction = process.env.NODE_ENV === 'production';
+    
+    let response;
+    if (isProduction) {
+      // Use the serverless function
+      const baseUrl = process.env.VERCEL_URL 
+        ? `https://${process.env.VERCEL_URL}` 
+        : 'http://localhost:3000';
+      response = await fetch(`${baseUrl}/api/backend/search_batch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body),
+      });
+    } else {
+      // In development, use the external backend
+      const BACKEND_URL = process.env.BACKEND_URL || 'http://localhost:8000';
+      response = await fetch(`${BACKEND_URL}/search/batch`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(body),
+      });
+    }
+
+    if (!response.ok) {
+      throw new Error(`Backend responded with status: ${response.status}`);
+    }
+
+    const data = await response.json();
+    return NextResponse.json(data);
+  } catch (error) {
+    console.error('Batch search API error:', error);
+    return NextResponse.json(
+      { error: 'Failed to run batch search' },
+      { status: 500 }
+    );
+  }
+}
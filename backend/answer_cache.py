@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.9"))    # min cosine similarity
+ANSWER_CACHE_MIN_OVERLAP = float(os.getenv("ANSWER_CACHE_MIN_OVERLAP", "0.5"))  # min Jaccard of sources
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))  # seconds
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+
+
+def source_keys(docs: Sequence[Document]) -> FrozenSet:
+    return frozenset((d.metadata.get("url"), d.metadata.get("section", "fulltext")) for d in docs)
+
+
+def jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SemanticAnswerCache:
+    """LLM answers looked up by query-embedding similarity.
+
+    A cached answer is reused when the new question's embedding is within
+    `threshold` cosine similarity of the cached question, it was asked with the
+    same k, and the retriever returned a similar enough set of (url, section)
+    sources this time. Entries expire after their own TTL, and all of them are
+    dropped when `version()` (e.g. QueryCache.current_version) changes, since a
+    rebuilt index can change what the right answer is.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD,
+                 min_overlap: float = ANSWER_CACHE_MIN_OVERLAP,
+                 ttl: float = ANSWER_CACHE_TTL, maxsize: int = ANSWER_CACHE_SIZE,
+                 version: Optional[Callable[[], Any]] = None):
+        self.threshold = threshold
+        self.min_overlap = min_overlap
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.version = version
+        self._seen_version: Any = None
+        self._vecs: Optional[np.ndarray] = None  # unit-norm question vectors, one row per entry
+        self._entries: List[Dict] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vec: Sequence[float]) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def _drop(self, keep: np.ndarray):
+        self._entries = [e for e, k in zip(self._entries, keep) if k]
+        self._vecs = self._vecs[keep] if self._entries else None
+
+    def _check_version(self):
+        """Drop every entry when the index version moved. Call with the lock held."""
+        if self.version is None:
+            return
+        v = self.version()
+        if v != self._seen_version:
+            if self._entries:
+                self._entries = []
+                self._vecs = None
+                self.invalidations += 1
+            self._seen_version = v
+
+    def lookup(self, qvec: Sequence[float], sources: FrozenSet, k: int) -> Optional[Dict]:
+        q = self._unit(qvec)
+        with self._lock:
+            self._check_version()
+            if self._vecs is not None:
+                now = time.time()
+                alive = np.array([e["expires"] > now for e in self._entries])
+                if not alive.all():
+                    self._drop(alive)
+            if self._vecs is not None:
+                sims = self._vecs @ q
+                for i in np.argsort(-sims):
+                    if sims[i] < self.threshold:
+                        break
+                    e = self._entries[i]
+                    if e["k"] == k and jaccard(e["sources"], sources) >= self.min_overlap:
+                        self.hits += 1
+                        return e["response"]
+            self.misses += 1
+            return None
+
+    def store(self, qvec: Sequence[float], sources: FrozenSet, k: int, response: Dict,
+              ttl: Optional[float] = None):
+        q = self._unit(qvec)[None, :]
+        entry = {
+            "k": k,
+            "sources": sources,
+            "response": response,
+            "expires": time.time() + (self.ttl if ttl is None else ttl),
+        }
+        with self._lock:
+            self._check_version()
+            self._entries.append(entry)
+            self._vecs = q if self._vecs is None else np.vstack([self._vecs, q])
+            if len(self._entries) > self.maxsize:
+                keep = np.ones(len(self._entries), dtype=bool)
+                keep[: len(self._entries) - self.maxsize] = False  # oldest first
+                self._drop(keep)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "invalidations": self.invalidations}
@@ -0,0 +1,102 @@
+import json
+import logging
+from typing import Callable, Dict, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+from rag_pipeline import stage
+from llm_guard import LLMUnavailable
+
+logger = logging.getLogger("uvicorn.error")
+
+NDJSON = "application/x-ndjson"
+NO_LLM_PREFIX = "Preliminary synthesis (retrieval-only; set OPENAI_API_KEY to enable LLM):"
+EMPTY_PREFIX = "LLM returned no text. Showing retrieval-only synthesis:"
+FAILED_PREFIX = "LLM unavailable (quota/error). Showing retrieval-only synthesis:"
+
+
+def sources_payload(docs: List[Document]) -> List[Dict]:
+    return [
+        {
+            "label":   f"[{i+1}]",
+            "title":   d.metadata.get("title"),
+            "url":     d.metadata.get("url"),
+            "section": d.metadata.get("section", "fulltext"),
+        }
+        for i, d in enumerate(docs)
+    ]
+
+
+def retrieval_only_text(prefix: str, docs: List[Document]) -> str:
+    bullets = []
+    for i, d in enumerate(docs, 1):
+        sec = (d.metadata.get("section") or "fulltext")
+        text = (d.page_content or "").strip()[:350]
+        bullets.append(f"[{i}] ({sec}) {text}")
+    return f"{prefix}\n\n" + ("\n\n".join(bullets) if bullets else "No matching passages found.")
+
+
+def _line(event: Dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+def stream_answer(question: str, k: int, context: List[Document], sources: List[Document],
+                  qa_chain=None, cached: Optional[Dict] = None,
+                  on_answer: Optional[Callable[[Dict], None]] = None,
+                  on_fallback: Optional[Callable[[str], None]] = None,
+                  guard=None) -> Iterator[str]:
+    """NDJSON events for a streamed /ask, sources first.
+
+      {"type": "sources", "query", "k", "sources"}   as soon as retrieval is done
+      {"type": "token", "text"}                      LLM output as it arrives
+      {"type": "fallback", "answer"}                 retrieval-only answer; replaces any tokens sent
+      {"type": "done", "answer"}                     always last; the full answer text
+
+    `context` is what the LLM sees (the retriever output), `sources` what gets cited.
+    `on_answer` receives the final /ask-shaped response of a successful LLM answer,
+    `on_fallback` the reason ("no_llm", "llm_error", "empty", ...) for a retrieval-only one.
+    `guard` is an LLMGuard; an open breaker or full concurrency limit falls back at once,
+    and a stream still running at the guard's deadline is cut off and falls back.
+    """
+    if cached:
+        yield _line({"type": "sources", "query": question, "k": k, "sources": cached["sources"]})
+        yield _line({"type": "done", "answer": cached["answer"]})
+        return
+
+    yield _line({"type": "sources", "query": question, "k": k, "sources": sources_payload(sources)})
+
+    def fallback(prefix: str, reason: str):
+        if on_fallback:
+            on_fallback(reason)
+        answer = retrieval_only_text(prefix, sources)
+        yield _line({"type": "fallback", "answer": answer})
+        yield _line({"type": "done", "answer": answer})
+
+    if qa_chain is None:
+        yield from fallback(NO_LLM_PREFIX, "no_llm")
+        return
+
+    parts = []
+    try:
+        with stage("llm"):
+            chunks = qa_chain.stream({"input": question, "context": context})
+            for chunk in guard.stream(chunks) if guard else chunks:
+                if chunk:
+                    parts.append(chunk)
+                    yield _line({"type": "token", "text": chunk})
+    except LLMUnavailable as e:
+        logger.warning("/ask stream: LLM skipped (%s); falling back.", e.reason)
+        yield from fallback(FAILED_PREFIX, e.reason)
+        return
+    except Exception as e:
+        logger.exception("/ask stream: LLM failed mid-stream; falling back. %s", e)
+        yield from fallback(FAILED_PREFIX, "llm_error")
+        return
+
+    answer = "".join(parts)
+    if not answer.strip():
+        yield from fallback(EMPTY_PREFIX, "empty")
+        return
+    yield _line({"type": "done", "answer": answer})
+    if on_answer:
+        on_answer({"query": question, "k": k, "answer": answer, "sources": sources_payload(sources)})
@@ -0,0 +1,92 @@
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from section_index import section_scope
+
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "64"))
+
+
+def embed_queries(emb, questions: Sequence[str]) -> List[List[float]]:
+    """One batched model call for all questions (cached ones are not re-encoded)."""
+    if hasattr(emb, "embed_queries"):
+        return emb.embed_queries(list(questions))
+    return emb.embed_documents(list(questions))
+
+
+def query_candidates(vs, vectors: Sequence[Sequence[float]], fetch_k: int,
+                     filter=None) -> List[Tuple[List[Document], List]]:
+    """The `fetch_k` nearest chunks (and their embeddings) for every vector, in one collection query."""
+    if not vectors:
+        return []
+    res = vs._collection.query(
+        query_embeddings=[list(v) for v in vectors],
+        n_results=fetch_k,
+        where=filter,
+        include=["metadatas", "documents", "embeddings"],
+    )
+    out = []
+    for i in range(len(vectors)):
+        docs, embs = [], []
+        for doc, meta, doc_id, e in zip(res["documents"][i], res["metadatas"][i], res["ids"][i], res["embeddings"][i]):
+            if doc is not None:
+                docs.append(Document(page_content=doc, metadata=meta or {}, id=doc_id))
+                embs.append(e)
+        out.append((docs, embs))
+    return out
+
+
+def mmr_select(vec: Sequence[float], candidates: Tuple[List[Document], List], k: int,
+               lambda_mult: float = 0.5) -> List[Document]:
+    docs, embs = candidates
+    if not docs:
+        return []
+    # Chroma path only; importing langchain_chroma pulls in chromadb, which the engines never need
+    from langchain_chroma.vectorstores import maximal_marginal_relevance
+    picked = set(maximal_marginal_relevance(
+        np.array(vec, dtype=np.float32), embs, k=k, lambda_mult=lambda_mult,
+    ))
+    # same output as LangChain: the selected candidates, in candidate order
+    return [d for j, d in enumerate(docs) if j in picked]
+
+
+def mmr_search_many(vs, vectors: Sequence[Sequence[float]], k: int, fetch_k: int,
+                    filter=None, lambda_mult: float = 0.5) -> List[List[Document]]:
+    """Chroma.max_marginal_relevance_search_by_vector for many vectors in one collection query."""
+    found = query_candidates(vs, vectors, fetch_k, filter)
+    return [mmr_select(vec, cands, k, lambda_mult) for vec, cands in zip(vectors, found)]
+
+
+def search_batch(retriever, vs, emb, questions: Sequence[str], engine=None) -> List[List[Document]]:
+    """Retrieve for every question like `retriever.invoke` would, but batched.
+
+    `retriever` is the serving CachedRetriever: questions already in its result
+    cache are answered from it, and fresh results are stored back in it.
+    With an `engine` (SectionIndex) the search runs there instead of in Chroma.
+    """
+    inner = retriever.retriever
+    if getattr(inner, "search_type", "") != "mmr":
+        return [retriever.invoke(q) for q in questions]
+    kwargs = dict(getattr(inner, "search_kwargs", {}) or {})
+    results: List = [None] * len(questions)
+    todo = []
+    for i, q in enumerate(questions):
+        docs = retriever.cached(q)
+        if docs is None:
+            todo.append(i)
+        else:
+            results[i] = docs
+    if todo:
+        vectors = embed_queries(emb, [questions[i] for i in todo])
+        k, fetch_k = kwargs.get("k", 4), kwargs.get("fetch_k", 20)
+        lambda_mult = kwargs.get("lambda_mult", 0.5)
+        if engine is not None:
+            found = engine.search_many(vectors, k, fetch_k, lambda_mult, section_scope(kwargs.get("filter")))
+        else:
+            found = mmr_search_many(vs, vectors, k, fetch_k, kwargs.get("filter"), lambda_mult)
+        for i, docs in zip(todo, found):
+            retriever.store(questions[i], docs)
+            results[i] = list(docs)
+    return results
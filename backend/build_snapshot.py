@@ -0,0 +1,65 @@
+from pathlib import Path
+import json
+import os
+import shutil
+import time
+
+from sentence_transformers import SentenceTransformer
+
+from cold_start import SNAPSHOT_DIR, SNAPSHOT_MANIFEST
+from context_packer import TokenCounter
+from mmap_index import MMAP_DIR
+from index_versions import resolve
+from onnx_embeddings import ONNX_MODEL_DIR, MANIFEST as ONNX_MANIFEST
+
+MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+INDEX_DIR = os.getenv("INDEX_DIR", "index-chroma")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+
+def dir_mb(path: Path) -> float:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / 1e6 if path.exists() else 0.0
+
+
+def main():
+    out = Path(SNAPSHOT_DIR)
+    model_dir = out / "model"
+    t0 = time.perf_counter()
+    if model_dir.exists():
+        shutil.rmtree(model_dir)
+    SentenceTransformer(MODEL, device="cpu").save(str(model_dir))
+    print(f"📦 Saved {MODEL} to {model_dir} ({dir_mb(model_dir):.1f} MB) in {time.perf_counter() - t0:.1f}s")
+
+    # the context packer's token counter; context_packer.py reads it from here (TIKTOKEN_CACHE_DIR)
+    tiktoken_dir = out / "tiktoken"
+    tiktoken_dir.mkdir(parents=True, exist_ok=True)
+    os.environ["TIKTOKEN_CACHE_DIR"] = str(tiktoken_dir)
+    if TokenCounter(OPENAI_MODEL).approximate:
+        print(f"⚠️ Could not fetch the tiktoken encoding for {OPENAI_MODEL}; the functions will approximate token counts")
+
+    # what else the functions can load from the bundle; each is built by its own script
+    mmap_manifest = resolve(MMAP_DIR) / "manifest.json"
+    onnx_manifest = Path(ONNX_MODEL_DIR) / ONNX_MANIFEST
+    manifest = {
+        "model": MODEL,
+        "model_dir": "model",
+        "built_at": int(time.time()),
+        "index": {
+            "chroma": INDEX_DIR if Path(INDEX_DIR).exists() else None,
+            "mmap": json.loads(mmap_manifest.read_text(encoding="utf-8")).get("count") if mmap_manifest.exists() else None,
+            "onnx": onnx_manifest.exists(),
+        },
+    }
+    (out / SNAPSHOT_MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    for name, path in (("model", model_dir), ("tiktoken", tiktoken_dir), ("chroma", Path(INDEX_DIR)),
+                       ("mmap", Path(MMAP_DIR)), ("onnx", Path(ONNX_MODEL_DIR))):
+        status = f"{dir_mb(path):.1f} MB" if path.exists() else "missing"
+        print(f"   {name}: {path} ({status})")
+    if not mmap_manifest.exists():
+        print("💡 Run export_index.py too: VECTOR_BACKEND=mmap serves from the mapped files without importing chromadb")
+    print(f"✅ Snapshot written to {out}; deploy it with the functions (SNAPSHOT_DIR)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+
+# written by build_snapshot.py: the embedding model saved to disk, so a cold start loads it
+# from the deployment bundle instead of resolving and downloading it from the Hugging Face Hub
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshot")
+SNAPSHOT_MANIFEST = "snapshot.json"
+
+_started = time.perf_counter()
+_phases: Dict[str, float] = {}
+_reported = set()
+
+
+@contextmanager
+def phase(name: str):
+    """Time one import or load step of this process's startup (first occurrence only)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.setdefault(name, time.perf_counter() - t0)
+
+
+def report() -> dict:
+    """Startup phases so far, slowest first, plus the time since this module was imported."""
+    phases = sorted(_phases.items(), key=lambda kv: kv[1], reverse=True)
+    return {
+        "phases_ms": {name: round(sec * 1000, 1) for name, sec in phases},
+        "uptime_s": round(time.perf_counter() - _started, 3),
+    }
+
+
+def unreported() -> Dict[str, float]:
+    """Phases not yet returned here, as Server-Timing entries; the first request of an instance carries them."""
+    fresh = {f"cold_{name}": sec for name, sec in _phases.items() if name not in _reported}
+    _reported.update(_phases)
+    return fresh
+
+
+def snapshot_model(model_name: str, snapshot_dir: str = SNAPSHOT_DIR) -> Optional[str]:
+    """Path of the bundled copy of `model_name`, or None when there is no matching snapshot."""
+    root = Path(snapshot_dir)
+    try:
+        manifest = json.loads((root / SNAPSHOT_MANIFEST).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if manifest.get("model") != model_name:
+        print(f"⚠️ Ignoring snapshot in {root}: built for {manifest.get('model')!r}, not {model_name!r}")
+        return None
+    return str(root / manifest.get("model_dir", "model"))
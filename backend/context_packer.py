@@ -0,0 +1,183 @@
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+
+from metrics import metrics
+from cold_start import SNAPSHOT_DIR
+
+logger = logging.getLogger("uvicorn.error")
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # prompt tokens for retrieved text
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))  # shingle Jaccard
+CONTEXT_MIN_TAIL_TOKENS = int(os.getenv("CONTEXT_MIN_TAIL_TOKENS", "64"))  # smallest truncated passage worth sending
+MAX_OVERLAP_CHARS = int(os.getenv("CHUNK_OVERLAP", "120")) * 2  # splitter overlap (embed_local.py), with slack
+
+# build_snapshot.py bundles the BPE file here, so loading the encoding never needs the network
+# or a writable cache (tiktoken's default is a download into the temp dir)
+TIKTOKEN_BUNDLE = os.path.join(SNAPSHOT_DIR, "tiktoken")
+if "TIKTOKEN_CACHE_DIR" not in os.environ and os.path.isdir(TIKTOKEN_BUNDLE):
+    os.environ["TIKTOKEN_CACHE_DIR"] = TIKTOKEN_BUNDLE
+
+_WORD = re.compile(r"\w+")
+
+
+class TokenCounter:
+    """tiktoken for the serving model; ~4 chars/token if the encoding can't be loaded (offline)."""
+
+    def __init__(self, model: str):
+        self.enc = None
+        try:
+            try:
+                self.enc = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.enc = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            logger.warning("tiktoken encoding for %s unavailable (%s); context budgets use ~4 chars/token. "
+                           "Bundle it with build_snapshot.py or set TIKTOKEN_CACHE_DIR.", model, e)
+
+    @property
+    def approximate(self) -> bool:
+        return self.enc is None
+
+    def count(self, text: str) -> int:
+        if self.enc is None:
+            return (len(text) + 3) // 4
+        return len(self.enc.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, tokens: int) -> str:
+        if self.enc is None:
+            return text[: tokens * 4]
+        return self.enc.decode(self.enc.encode(text, disallowed_special=())[:tokens])
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of `a` that is also a prefix of `b` (bounded by the splitter overlap)."""
+    for n in range(min(len(a), len(b), MAX_OVERLAP_CHARS), 0, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = _WORD.findall(text.lower())
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+
+def merge_adjacent(docs: List[Document]) -> List[Tuple[int, Document]]:
+    """Stitch chunks that were neighbours in the same url/section back together, minus the overlap.
+
+    Returns (best relevance rank among the merged chunks, passage), most relevant first.
+    """
+    groups: Dict[Tuple, List[Tuple[int, Document]]] = {}
+    loose = []
+    for rank, d in enumerate(docs):
+        start = d.metadata.get("start")
+        if start is None:
+            loose.append((rank, d))
+        else:
+            groups.setdefault((d.metadata.get("url"), d.metadata.get("section")), []).append((rank, d))
+
+    passages = list(loose)
+    for members in groups.values():
+        members.sort(key=lambda rd: rd[1].metadata["start"])
+        rank, first = members[0]
+        text, end = first.page_content, first.metadata["start"] + len(first.page_content)
+        for r, d in members[1:]:
+            start = d.metadata["start"]
+            if start > end:  # a gap: not neighbours
+                passages.append((rank, Document(page_content=text, metadata=first.metadata)))
+                rank, first, text = r, d, d.page_content
+            else:
+                if start + len(d.page_content) > end:  # chunks fully inside the passage add nothing
+                    text += d.page_content[_overlap(text, d.page_content):]
+                rank = min(rank, r)
+            end = max(end, start + len(d.page_content))
+        passages.append((rank, Document(page_content=text, metadata=first.metadata)))
+    passages.sort(key=lambda rp: rp[0])
+    return passages
+
+
+class ContextPacker:
+    """Turns retrieved chunks into the prompt context under a token budget.
+
+    Adjacent chunks are merged without their overlap, near-duplicate passages are
+    dropped, and passages are added in relevance order until the budget is spent.
+    """
+
+    def __init__(self, model: str, budget: int = CONTEXT_TOKEN_BUDGET,
+                 dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD):
+        self.budget = budget
+        self.dedup_threshold = dedup_threshold
+        self.model = model
+        self._counter: Optional[TokenCounter] = None
+        self.requests = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    @property
+    def counter(self) -> TokenCounter:
+        if self._counter is None:
+            self._counter = TokenCounter(self.model)
+        return self._counter
+
+    def warm_up(self) -> "ContextPacker":
+        """Load the encoding now (at startup, before any fork) rather than inside the first request."""
+        self.counter
+        return self
+
+    def pack(self, docs: List[Document]) -> Tuple[List[Document], Dict]:
+        """(context docs, report) where report has tokens_in/tokens_out/tokens_saved and what was dropped."""
+        count = self.counter.count
+        chunks = [d for d in docs if (d.page_content or "").strip()]
+        tokens_in = sum(count(d.page_content) for d in chunks)
+        passages = merge_adjacent(chunks)
+
+        kept, seen, duplicates, truncated, over_budget, used = [], [], 0, 0, 0, 0
+        for _, p in passages:
+            sh = _shingles(p.page_content)
+            if any(len(sh & s) / len(sh | s) >= self.dedup_threshold for s in seen):
+                duplicates += 1
+                continue
+            seen.append(sh)
+            n = count(p.page_content)
+            remaining = self.budget - used
+            if n > remaining:
+                if remaining < CONTEXT_MIN_TAIL_TOKENS:
+                    over_budget += 1
+                    continue
+                p = Document(page_content=self.counter.truncate(p.page_content, remaining), metadata=p.metadata)
+                n = remaining
+                truncated += 1
+            kept.append(p)
+            used += n
+
+        self.requests += 1
+        self.tokens_in += tokens_in
+        self.tokens_out += used
+        metrics.context_tokens.inc("in", amount=tokens_in)
+        metrics.context_tokens.inc("out", amount=used)
+        return kept, {
+            "chunks": len(chunks),
+            "passages": len(kept),
+            "merged": len(chunks) - len(passages),
+            "duplicates": duplicates,
+            "truncated": truncated,
+            "over_budget": over_budget,
+            "tokens_in": tokens_in,
+            "tokens_out": used,
+            "tokens_saved": tokens_in - used,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "budget": self.budget,
+            "token_counts": None if self._counter is None else "approx" if self._counter.approximate else "tiktoken",
+            "requests": self.requests,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": self.tokens_in - self.tokens_out,
+        }
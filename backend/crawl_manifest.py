@@ -0,0 +1,128 @@
+import sqlite3, time
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_key      TEXT PRIMARY KEY,   -- url_key(url, "")
+    url           TEXT NOT NULL,
+    title         TEXT,
+    status        TEXT NOT NULL,      -- fetched | ok | not_modified | failed
+    http_status   INTEGER,
+    error         TEXT,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    content_hash  TEXT,               -- sha256 of the raw HTML (see html_cache.py)
+    first_seen    TEXT NOT NULL,
+    last_attempt  TEXT NOT NULL,
+    last_success  TEXT
+);
+CREATE INDEX IF NOT EXISTS pages_status ON pages(status);
+CREATE TABLE IF NOT EXISTS records (
+    record_key    TEXT PRIMARY KEY,   -- url_key(url, section), one per JSONL line
+    page_key      TEXT NOT NULL,
+    section       TEXT NOT NULL,
+    written_at    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_page ON records(page_key);
+CREATE TABLE IF NOT EXISTS meta (
+    key           TEXT PRIMARY KEY,
+    value         TEXT
+);
+"""
+
+
+def _now() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class CrawlManifest:
+    """SQLite index of the crawl: per-page fetch status and per-section JSONL records.
+
+    Supports `key in manifest` / `manifest.add(key)` so it can stand in for the old
+    in-memory `seen` set. Only the harvester's main thread should use an instance.
+    Nothing is durable until `checkpoint()`.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(self.path))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    # ---- records (the dedupe set) ----
+    def __contains__(self, record_key: str) -> bool:
+        row = self.db.execute("SELECT 1 FROM records WHERE record_key = ?", (record_key,)).fetchone()
+        return row is not None
+
+    def add(self, record_key: str, page_key: str = "", section: str = ""):
+        self.db.execute(
+            "INSERT OR IGNORE INTO records(record_key, page_key, section, written_at) VALUES (?, ?, ?, ?)",
+            (record_key, page_key, section, _now()),
+        )
+
+    def reset_records(self):
+        self.db.execute("DELETE FROM records")
+        self.set_meta("jsonl_size", "0")
+
+    def sections(self, page_key: str):
+        return [r[0] for r in self.db.execute("SELECT section FROM records WHERE page_key = ?", (page_key,))]
+
+    # ---- pages ----
+    def mark_page(self, page_key: str, url: str, title: str, status: str,
+                  http_status: Optional[int] = None, error: Optional[str] = None,
+                  content_hash: Optional[str] = None):
+        now = _now()
+        success = now if status in ("ok", "not_modified") else None
+        self.db.execute(
+            """
+            INSERT INTO pages(page_key, url, title, status, http_status, error, attempts,
+                              content_hash, first_seen, last_attempt, last_success)
+            VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?, ?, ?)
+            ON CONFLICT(page_key) DO UPDATE SET
+                url = excluded.url,
+                title = excluded.title,
+                status = excluded.status,
+                http_status = excluded.http_status,
+                error = excluded.error,
+                attempts = pages.attempts + 1,
+                content_hash = COALESCE(excluded.content_hash, pages.content_hash),
+                last_attempt = excluded.last_attempt,
+                last_success = COALESCE(excluded.last_success, pages.last_success)
+            """,
+            (page_key, url, title, status, http_status, error, content_hash, now, now, success),
+        )
+
+    def page_status(self, page_key: str) -> Optional[str]:
+        row = self.db.execute("SELECT status FROM pages WHERE page_key = ?", (page_key,)).fetchone()
+        return row[0] if row else None
+
+    def retry_pages(self) -> Iterator[Tuple[str, str]]:
+        """(title, url) of pages that failed, or were fetched but never written out."""
+        rows = self.db.execute(
+            "SELECT title, url FROM pages WHERE status IN ('failed', 'fetched') ORDER BY last_attempt"
+        )
+        return iter(rows.fetchall())
+
+    def counts(self) -> dict:
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM pages GROUP BY status").fetchall())
+
+    # ---- meta / checkpoints ----
+    def get_meta(self, key: str, default: Optional[str] = None) -> Optional[str]:
+        row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key: str, value: str):
+        self.db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, value))
+
+    def checkpoint(self, jsonl_size: Optional[int] = None):
+        """Commit; `jsonl_size` is the flushed output size these records are known to cover."""
+        if jsonl_size is not None:
+            self.set_meta("jsonl_size", str(jsonl_size))
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Callable, List
+
+from langchain_core.embeddings import Embeddings
+
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "3"))
+
+
+class MicroBatcher:
+    """Cross-request micro-batching for query encoding.
+
+    Callers on any thread `submit()` a text and block on the returned future.
+    One scheduler thread takes the first waiting text, keeps collecting for up
+    to `max_wait_ms` (or until `max_batch` texts), then encodes them all in a
+    single `encode_batch` call. A lone request waits at most `max_wait_ms`.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], List[List[float]]],
+                 max_batch: int = EMBED_BATCH_MAX, max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.encode_batch = encode_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batches = 0
+        self.items = 0
+        self.largest = 0
+        self._start()
+        if hasattr(os, "register_at_fork"):
+            # threads do not survive fork(): a preforked worker (serve.py) needs its own scheduler
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._start())
+
+    def _start(self):
+        self._q: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        self._q.put((text, fut))
+        return fut
+
+    def embed(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def _collect(self):
+        batch = [self._q.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [t for t, _ in batch]
+            try:
+                vecs = self.encode_batch(texts)
+            except BaseException as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            for (_, fut), v in zip(batch, vecs):
+                fut.set_result(list(v))
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "queries": self.items,
+            "mean_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "largest_batch": self.largest,
+        }
+
+
+class BatchedEmbeddings(Embeddings):
+    """Embeddings whose embed_query calls are micro-batched across concurrent requests."""
+
+    def __init__(self, inner: Embeddings, max_batch: int = EMBED_BATCH_MAX,
+                 max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.inner = inner
+        # embed_documents == embed_query per text for symmetric models like MiniLM
+        self.batcher = MicroBatcher(inner.embed_documents, max_batch, max_wait_ms)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.embed(text)
@@ -1,11 +1,19 @@
 from pathlib import Path
 import json
+import hashlib
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from typing import Iterator, List, Dict
+from sentence_transformers import SentenceTransformer
+from embedding_cache import open_cache, embed_with_cache
+from typing import Iterator, List, Dict, Optional, Set
 import chromadb
 import os
+from index_versions import INDEX_VERSIONS, collect_garbage, new_version, publish, resolve
+from sharded_index import SHARD_BY, layout_keys, read_layout, shard_collection, shard_key, write_layout
+from lexical_index import LEXICAL_DIR, write_lexical
 
 
 IN = Path("data/harvested.jsonl")
@@ -22,7 +30,16 @@ KEEP_SECTIONS = set(
 )
 
 MAX_RECORDS = int(os.getenv("MAX_RECORDS", "0"))  # 0 = no limit
-BATCH_SIZE = int(os.getenv("BATCH_SIZE", "3000"))
+BATCH_SIZE = int(os.getenv("BATCH_SIZE", "0"))  # chunks per pipeline batch; 0 = size from free memory
+MIN_BATCH, MAX_BATCH = 256, 20000
+MEM_FRACTION = float(os.getenv("MEM_FRACTION", "0.25"))  # share of free RAM in-flight batches may use
+QUEUE_DEPTH = int(os.getenv("QUEUE_DEPTH", "2"))  # batches buffered between stages
+ENCODE_PROCS = int(os.getenv("ENCODE_PROCS", str(os.cpu_count() or 1)))
+ENCODE_BATCH = int(os.getenv("ENCODE_BATCH", "64"))  # sentence-transformers mini-batch
+PRUNE = os.getenv("PRUNE", "1") == "1"  # delete vectors whose chunk no longer exists
+LEXICAL = os.getenv("LEXICAL", "1") == "1"  # also build the BM25 index for /search mode=lexical|hybrid
+
+DONE = object()  # end-of-stream marker passed down the pipeline
 
 def load_jsonl(path: Path) -> Iterator[Dict]:
     with open(path, encoding="utf-8") as f:
@@ -37,51 +54,282 @@ def load_jsonl(path: Path) -> Iterator[Dict]:
             if MAX_RECORDS and i >= MAX_RECORDS:
                 break
 
-def main():
-    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+def chunk_id(url: str, section: str, start: int, text: str) -> str:
+    # deterministic: same chunk text at the same place in the same record -> same id
+    content_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return hashlib.sha1(f"{url}::{section}::{start}::{content_hash}".encode("utf-8")).hexdigest()
+
+def existing_ids(coll, page: int = 10000) -> Set[str]:
+    ids: Set[str] = set()
+    offset = 0
+    while True:
+        got = coll.get(include=[], limit=page, offset=offset)["ids"]
+        ids.update(got)
+        if len(got) < page:
+            return ids
+        offset += page
+
+def all_chunks(coll, page: int = 5000):
+    """(ids, texts, metadatas) of every chunk in the collection."""
+    ids, texts, metas = [], [], []
+    offset = 0
+    while True:
+        got = coll.get(include=["documents", "metadatas"], limit=page, offset=offset)
+        for cid, text, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+            if text is not None:
+                ids.append(cid)
+                texts.append(text)
+                metas.append(meta or {})
+        if len(got["ids"]) < page:
+            return ids, texts, metas
+        offset += page
+
+def mem_available() -> int:
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+def target_batch_size(dim: int) -> int:
+    """Chunks per batch so that every batch alive in the pipeline fits in MEM_FRACTION of free RAM."""
+    if BATCH_SIZE:
+        return BATCH_SIZE
+    avail = mem_available()
+    if not avail:
+        return 3000
+    per_chunk = CHUNK_SIZE * 4 + dim * 4 + 1024  # str payload (worst case) + float32 vector + metadata
+    in_flight = 3 * QUEUE_DEPTH + 3               # queued batches + one being worked on per stage
+    return max(MIN_BATCH, min(MAX_BATCH, int(avail * MEM_FRACTION / (in_flight * per_chunk))))
+
+
+class Stage:
+    """Item count and busy time (excluding queue waits) for one pipeline stage."""
 
-    emb = HuggingFaceEmbeddings(model_name=MODEL)
-    client = chromadb.PersistentClient(path=INDEX_DIR)
+    def __init__(self, name: str, unit: str = "chunks"):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
 
-    # create or get the collection once
-    db = Chroma(
-        client=client,
-        collection_name=COLL,
-        embedding_function=emb,
+    @contextmanager
+    def timed(self):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.busy += time.perf_counter() - t0
+
+    def rate(self) -> float:
+        return self.items / self.busy if self.busy else 0.0
+
+    def __str__(self):
+        return f"{self.name} {self.rate():,.0f} {self.unit}/s"
+
+
+def start_stage(fn, out_q: queue.Queue, errors: List[BaseException]) -> threading.Thread:
+    """Run `fn` on a thread; whatever happens, `out_q` receives DONE so the consumer never hangs."""
+    def target():
+        try:
+            fn()
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            out_q.put(DONE)
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    return t
+
+
+def main():
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, add_start_index=True
     )
 
-    texts: List[str] = []
-    metas: List[Dict] = []
+    model = SentenceTransformer(MODEL)
+    dim = model.get_sentence_embedding_dimension()
+    # build next to the live version (a copy of it, so the build stays incremental); servers keep
+    # reading the old one until publish() below moves the pointer
+    # (without INDEX_VERSIONS: update in place, in the live version if the index was ever versioned)
+    out = new_version(INDEX_DIR, seed=resolve(INDEX_DIR)) if INDEX_VERSIONS else resolve(INDEX_DIR)
+    client = chromadb.PersistentClient(path=str(out))
+
+    # one collection per shard with SHARDS / SHARD_BY, else just COLL; keyed by shard (None: unsharded)
+    keys = layout_keys(sections=KEEP_SECTIONS)
+    names = {key: shard_collection(COLL, key) for key in keys} or {None: COLL}
+    # create or get the collections once; vectors are computed here, not by Chroma
+    colls = {key: client.get_or_create_collection(name=name, embedding_function=None) for key, name in names.items()}
+    write_slice = getattr(client, "get_max_batch_size", lambda: 5000)()
+
+    # chunk id -> shard it is stored in; a chunk whose shard changed is written again
+    indexed: Dict[str, Optional[str]] = {cid: key for key, c in colls.items() for cid in existing_ids(c)}
+    print(f"📚 Collection '{COLL}' holds {len(indexed)} chunks"
+          + (f" in {len(keys)} shards by {SHARD_BY}" if keys else ""))
+
+    reader, split, encode, write = Stage("read", "records"), Stage("split"), Stage("encode"), Stage("write")
+    q_recs: queue.Queue = queue.Queue(maxsize=BATCH_SIZE or MAX_BATCH)
+    q_split: queue.Queue = queue.Queue(maxsize=QUEUE_DEPTH)
+    q_enc: queue.Queue = queue.Queue(maxsize=QUEUE_DEPTH)
+    errors: List[BaseException] = []
+    wanted: Dict[str, Optional[str]] = {}  # chunk id -> shard, for this corpus
+
+    def read_stage():
+        seen_ids = set()  # harvested.jsonl may hold the same record more than once
+        records = load_jsonl(IN)
+        while True:
+            with reader.timed():
+                rec = next(records, None)
+                if rec is None:
+                    return
+                uid = f"{rec['url']}::{rec.get('section', 'fulltext')}"
+                if uid in seen_ids:
+                    continue
+                seen_ids.add(uid)
+                reader.items += 1
+            q_recs.put(rec)
+
+    def split_stage():
+        ids, texts, metas, shards = [], [], [], []
+        limit = target_batch_size(dim)
+        while True:
+            rec = q_recs.get()
+            if rec is DONE:
+                break
+            with split.timed():
+                section = rec.get("section", "fulltext")
+                shard = shard_key(rec["url"], section) if keys else None
+                for doc in splitter.create_documents([rec["text"]]):
+                    split.items += 1
+                    start = doc.metadata["start_index"]
+                    cid = chunk_id(rec["url"], section, start, doc.page_content)
+                    if cid in wanted:
+                        continue
+                    wanted[cid] = shard
+                    if cid in indexed and indexed[cid] == shard:
+                        continue  # unchanged since the last build
+                    ids.append(cid)
+                    texts.append(doc.page_content)
+                    metas.append({"title": rec["title"], "url": rec["url"], "section": section, "start": start})
+                    shards.append(shard)
+            if len(ids) >= limit:
+                q_split.put((ids, texts, metas, shards))
+                ids, texts, metas, shards = [], [], [], []
+                limit = target_batch_size(dim)
+        if ids:
+            q_split.put((ids, texts, metas, shards))
+
+    pool = model.start_multi_process_pool(target_devices=["cpu"] * ENCODE_PROCS) if ENCODE_PROCS > 1 else None
+    cache = open_cache(MODEL)
+
+    def run_model(texts: List[str]):
+        # same preprocessing as HuggingFaceEmbeddings.embed_documents
+        clean = [t.replace("\n", " ") for t in texts]
+        if pool is not None:
+            return model.encode_multi_process(clean, pool, batch_size=ENCODE_BATCH)
+        return model.encode(clean, batch_size=ENCODE_BATCH)
+
+    def encode_stage():
+        while True:
+            batch = q_split.get()
+            if batch is DONE:
+                return
+            ids, texts, metas, shards = batch
+            with encode.timed():
+                # texts embedded before (any chunking, any collection) come from the cache
+                vecs = embed_with_cache(cache, texts, run_model)
+                encode.items += len(ids)
+            q_enc.put((ids, texts, metas, shards, vecs))
+
+    threads = [
+        start_stage(read_stage, q_recs, errors),
+        start_stage(split_stage, q_split, errors),
+        start_stage(encode_stage, q_enc, errors),
+    ]
     total_chunks = 0
+    try:
+        # writer runs on the main thread: Chroma sees a single writer
+        while True:
+            batch = q_enc.get()
+            if batch is DONE or errors:
+                break
+            ids, texts, metas, shards, vecs = batch
+            with write.timed():
+                rows_by_shard: Dict[Optional[str], List[int]] = {}
+                for row, shard in enumerate(shards):
+                    rows_by_shard.setdefault(shard, []).append(row)
+                for shard, rows in rows_by_shard.items():
+                    for i in range(0, len(rows), write_slice):
+                        part = rows[i:i + write_slice]
+                        colls[shard].add(
+                            ids=[ids[r] for r in part], embeddings=[vecs[r] for r in part],
+                            documents=[texts[r] for r in part], metadatas=[metas[r] for r in part],
+                        )
+                write.items += len(ids)
+            total_chunks += len(ids)
+            print(f"✅ Added batch of {len(ids)} chunks (total={total_chunks}) | "
+                  + " | ".join(str(s) for s in (reader, split, encode, write)))
+        if not errors:
+            for t in threads:
+                t.join()
+    finally:
+        if pool is not None:
+            model.stop_multi_process_pool(pool)
+    if errors:
+        raise errors[0]
+
+    # Chunks that were indexed before but no longer come out of the corpus (or now live in another shard)
+    stale = [(cid, shard) for cid, shard in indexed.items() if cid not in wanted or wanted[cid] != shard]
+    removed = 0
+    if stale and PRUNE and not MAX_RECORDS:
+        for shard, coll in colls.items():
+            gone = [cid for cid, s in stale if s == shard]
+            for i in range(0, len(gone), write_slice):
+                coll.delete(ids=gone[i:i + write_slice])
+        removed = len(stale)
+        print(f"🧹 Removed {removed} stale chunks")
+    elif stale:
+        print(f"ℹ️ Kept {len(stale)} chunks not seen this run (PRUNE=0 or MAX_RECORDS set)")
+
+    # collections of a previous shard layout; COLL itself stays (empty when sharded), the services open it
+    previous = read_layout(out)
+    old_names = [shard_collection(COLL, key) for key in previous["shards"]] if previous else [COLL]
+    retired = [name for name in old_names if name not in names.values()]
+    if retired and PRUNE and not MAX_RECORDS:
+        for name in retired:
+            client.delete_collection(name)
+        print(f"🧹 Dropped {len(retired)} collections of the previous shard layout")
+    client.get_or_create_collection(name=COLL, embedding_function=None)
+    write_layout(out, SHARD_BY, keys)
+
+    if LEXICAL:
+        # rebuilt in full from what the collections now hold: BM25 statistics are corpus-wide
+        t0 = time.perf_counter()
+        ids, texts, metas = [], [], []
+        for coll in colls.values():
+            for acc, part in zip((ids, texts, metas), all_chunks(coll)):
+                acc.extend(part)
+        lexical = write_lexical(out / LEXICAL_DIR, ids, texts, metas)
+        print(f"🔤 Lexical index: {lexical['terms']} terms, {lexical['postings']} postings over "
+              f"{lexical['count']} chunks in {time.perf_counter() - t0:.1f}s")
 
-    def flush():
-        nonlocal texts, metas, total_chunks
-        if not texts:
-            return
-        db.add_texts(texts=texts, metadatas=metas)
-        total_chunks += len(texts)
-        print(f"✅ Added batch of {len(texts)} chunks (total={total_chunks})")
-        texts, metas = [], []
-
-    seen_ids = set()  # avoid duplicates across reruns if your JSONL accumulates
-    for rec in load_jsonl(IN):
-        uid = f"{rec['url']}::{rec.get('section','fulltext')}"
-        if uid in seen_ids:
-            continue
-        seen_ids.add(uid)
-
-        for ch in splitter.split_text(rec["text"]):
-            texts.append(ch)
-            metas.append({
-                "title": rec["title"],
-                "url": rec["url"],
-                "section": rec.get("section", "fulltext"),
-            })
-            if len(texts) >= BATCH_SIZE:
-                flush()
-
-    flush()
-    print(f"🎯 Finished building index '{COLL}' at {INDEX_DIR}")
+    print(f"🎯 Finished building index '{COLL}' at {out}: "
+          f"{total_chunks} new, {len(wanted) - total_chunks} unchanged, {removed} removed")
+    if INDEX_VERSIONS:
+        publish(INDEX_DIR, out)
+        removed_versions = collect_garbage(INDEX_DIR)
+        print(f"🔀 {INDEX_DIR}/CURRENT -> {out.name}; running servers switch without a restart"
+              + (f" (removed {len(removed_versions)} old versions)" if removed_versions else ""))
+    if cache is not None:
+        print(f"🧠 Embedding cache: {cache.hits} reused, {cache.misses} encoded")
+    slowest = min((s for s in (split, encode, write) if s.items), key=Stage.rate, default=None)
+    print("⏱️ Stage throughput: " + " | ".join(str(s) for s in (reader, split, encode, write))
+          + (f" — bottleneck: {slowest.name}" if slowest else ""))
 
 if __name__ == "__main__":
     main()
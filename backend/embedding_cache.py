@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+import weakref
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "data/embed-cache.sqlite")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "1024"))
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") == "1"
+# hits only note their key in memory; last_used is written in batches (and before any eviction)
+EMBED_CACHE_TOUCH_BATCH = int(os.getenv("EMBED_CACHE_TOUCH_BATCH", "512"))
+EMBED_CACHE_TOUCH_EVERY_S = float(os.getenv("EMBED_CACHE_TOUCH_EVERY_S", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model      TEXT NOT NULL,
+    text_hash  TEXT NOT NULL,
+    dim        INTEGER NOT NULL,
+    vec        BLOB NOT NULL,      -- float16, little-endian
+    last_used  REAL NOT NULL,
+    PRIMARY KEY (model, text_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings(last_used);
+"""
+
+
+def normalize(text: str) -> str:
+    # Whitespace never changes MiniLM's tokens (HuggingFaceEmbeddings already maps \n -> " ")
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(normalize(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Disk-backed embedding store keyed by (model name, normalized text hash).
+
+    Vectors are kept as float16; the table is trimmed least-recently-used-first
+    once it grows past `max_mb`. Recency from hits is buffered in memory and
+    flushed every EMBED_CACHE_TOUCH_BATCH keys or EMBED_CACHE_TOUCH_EVERY_S
+    seconds, so a hit does not cost a write. Safe to share between threads.
+    """
+
+    def __init__(self, path: str = EMBED_CACHE_PATH, model: str = "", max_mb: int = EMBED_CACHE_MAX_MB):
+        self.model = model
+        self.max_bytes = max_mb * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._rows = None  # row count, loaded lazily
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect()
+        if hasattr(os, "register_at_fork"):
+            # an SQLite connection must not be used across fork(); each preforked worker opens its own
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._connect())
+
+    def _connect(self):
+        self._lock = threading.Lock()
+        self._touched = {}  # text_hash -> last hit time, not yet written
+        self._flushed_at = time.monotonic()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        keys = [text_hash(t) for t in texts]
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self.db.execute(
+                    f"SELECT text_hash, vec FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                    [self.model, *part],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if (len(self._touched) >= EMBED_CACHE_TOUCH_BATCH
+                        or time.monotonic() - self._flushed_at >= EMBED_CACHE_TOUCH_EVERY_S):
+                    self._flush_touches()
+                    self.db.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return [
+            np.frombuffer(found[k], dtype="<f2").astype(np.float32) if k in found else None
+            for k in keys
+        ]
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        if not texts:
+            return
+        now = time.time()
+        rows = []
+        for t, v in zip(texts, vectors):
+            v16 = np.asarray(v, dtype="<f2")
+            rows.append((self.model, text_hash(t), v16.shape[0], v16.tobytes(), now))
+        with self._lock:
+            if self._rows is None:
+                self._rows = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            # a row that is already there (another worker embedded the same text) holds the same vector
+            inserted = self.db.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", rows)
+            self._rows += max(0, inserted.rowcount)
+            self._flush_touches()  # eviction must see recent hits
+            self._evict(row_bytes=len(rows[0][3]) + 80)
+            self.db.commit()
+
+    def _flush_touches(self):
+        if self._touched:
+            self.db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(t, self.model, k) for k, t in self._touched.items()],
+            )
+            self._touched = {}
+        self._flushed_at = time.monotonic()
+
+    def _evict(self, row_bytes: int):
+        max_rows = max(1, self.max_bytes // row_bytes)
+        if self._rows <= max_rows:
+            return
+        # trim 5% below the cap so eviction does not run on every insert
+        excess = self._rows - int(max_rows * 0.95)
+        self.db.execute(
+            "DELETE FROM embeddings WHERE (model, text_hash) IN "
+            "(SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._rows = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def embed_with_cache(cache: Optional[EmbeddingCache], texts: Sequence[str], encode) -> List[List[float]]:
+    """Vectors for `texts`, calling `encode(list_of_texts)` only for cache misses."""
+    if cache is None:
+        return [list(map(float, v)) for v in encode(list(texts))]
+    cached = cache.get_many(texts)
+    missing = [i for i, v in enumerate(cached) if v is None]
+    if missing:
+        fresh = encode([texts[i] for i in missing])
+        cache.put_many([texts[i] for i in missing], fresh)
+        for i, v in zip(missing, fresh):
+            # round-trip through float16 so a hit and a miss return the same vector
+            cached[i] = np.asarray(v, dtype="<f2").astype(np.float32)
+    return [v.tolist() for v in cached]
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain Embeddings wrapper that consults an EmbeddingCache before the model."""
+
+    def __init__(self, inner: Embeddings, cache: Optional[EmbeddingCache]):
+        self.inner = inner
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return embed_with_cache(self.cache, texts, self.inner.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embed_with_cache(self.cache, [text], lambda ts: [self.inner.embed_query(ts[0])])[0]
+
+
+def open_cache(model: str, path: str = EMBED_CACHE_PATH) -> Optional[EmbeddingCache]:
+    """The shared cache for `model`, or None when EMBED_CACHE=0 or the path is unusable."""
+    if not EMBED_CACHE_ENABLED:
+        return None
+    try:
+        return EmbeddingCache(path, model)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ Embedding cache disabled ({path}: {e})")
+        return None
@@ -0,0 +1,114 @@
+from pathlib import Path
+import os
+import time
+
+import chromadb
+import numpy as np
+
+from quantize import CODE_FILES
+from mmap_index import write_index, update_manifest, MmapIndex, MMAP_DIR
+from index_versions import INDEX_VERSIONS, collect_garbage, new_version, publish, resolve
+from sharded_index import read_layout, shard_collection, write_layout
+
+INDEX_DIR = os.getenv("INDEX_DIR", "index-chroma")
+COLL = os.getenv("COLLECTION_NAME", "spacebio")
+MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+FAISS_INDEX = os.getenv("FAISS_INDEX", "").lower()  # "", "ivf" or "hnsw"
+QUANTIZE = [m for m in os.getenv("QUANTIZE", "").lower().split(",") if m]  # "int8", "binary" or "int8,binary"
+RECALL_QUERIES = int(os.getenv("RECALL_QUERIES", "200"))
+RECALL_K = int(os.getenv("RECALL_K", "10"))
+PAGE = 5000
+
+
+def read_collection(coll):
+    ids, vecs, texts, metas = [], [], [], []
+    offset = 0
+    while True:
+        got = coll.get(include=["embeddings", "documents", "metadatas"], limit=PAGE, offset=offset)
+        for cid, vec, text, meta in zip(got["ids"], got["embeddings"], got["documents"], got["metadatas"]):
+            if text is None:
+                continue
+            ids.append(cid)
+            vecs.append(vec)
+            texts.append(text)
+            metas.append(meta or {})
+        if len(got["ids"]) < PAGE:
+            return ids, np.asarray(vecs, dtype=np.float32), texts, metas
+        offset += PAGE
+
+
+def sample_queries(vecs: np.ndarray, n: int) -> np.ndarray:
+    """Query-like probes: midpoints of random chunk pairs, so no probe is itself an indexed vector."""
+    rng = np.random.default_rng(0)
+    a, b = rng.integers(0, len(vecs), size=(2, n))
+    return vecs[a] + vecs[b]
+
+
+def report_recall(out: Path, vecs: np.ndarray) -> dict:
+    """recall@k of every exported first-pass mode against exact float32 search."""
+    if not len(vecs) or not RECALL_QUERIES:
+        return {}
+    queries = sample_queries(vecs, RECALL_QUERIES)
+    modes = [("faiss", dict(use_faiss=True, quantization=None))] if FAISS_INDEX else []
+    modes += [(m, dict(quantization=m)) for m in QUANTIZE]
+    recall = {}
+    for name, kwargs in modes:
+        recall[f"{name}@{RECALL_K}"] = round(MmapIndex(str(out), **kwargs).recall(queries, RECALL_K), 4)
+    return recall
+
+
+def export(coll, name: str, out: Path):
+    """One collection (the whole index, or one shard) to the mapped layout in `out`."""
+    t0 = time.perf_counter()
+    ids, vecs, texts, metas = read_collection(coll)
+    print(f"📥 Read {len(ids)} chunks from '{name}'")
+
+    manifest = write_index(
+        out, ids, vecs, texts, metas, faiss_kind=FAISS_INDEX or None, quantize=QUANTIZE,
+        extra={"collection": name, "embed_model": MODEL, "exported_at": int(time.time())},
+    )
+    size = sum(f.stat().st_size for f in out.iterdir() if f.is_file())
+    print(f"🗺️ Wrote {manifest['count']} x {manifest['dim']} vectors to {out} "
+          f"({size / 1e6:.1f} MB{', FAISS ' + FAISS_INDEX if FAISS_INDEX else ''}) "
+          f"in {time.perf_counter() - t0:.1f}s")
+    for section, (start, end) in sorted(manifest["sections"].items()):
+        print(f"   {section}: {end - start}")
+
+    float_bytes = manifest["count"] * manifest["dim"] * 4
+    for mode in QUANTIZE:
+        code_bytes = (out / CODE_FILES[mode]).stat().st_size
+        print(f"🗜️ {mode} codes: {code_bytes / 1e6:.1f} MB scanned per query instead of {float_bytes / 1e6:.1f} MB "
+              f"({float_bytes / max(1, code_bytes):.0f}x smaller); float32 rows are read only to rescore")
+    recall = report_recall(out, vecs)
+    if recall:
+        update_manifest(out, recall=recall)
+        print(f"🎯 recall vs exact float32 ({RECALL_QUERIES} probes): "
+              + ", ".join(f"{k}={v:.3f}" for k, v in recall.items()))
+
+
+def main():
+    source = resolve(INDEX_DIR)
+    client = chromadb.PersistentClient(path=str(source))
+    print(f"📂 Exporting {source}")
+
+    # a fresh version directory: servers mapping the live files never see them change under them
+    out = new_version(MMAP_DIR) if INDEX_VERSIONS else resolve(MMAP_DIR)
+    layout = read_layout(source)
+    if layout:
+        # a sharded index (embed_local.py with SHARDS / SHARD_BY): one mapped directory per shard
+        for key in layout["shards"]:
+            name = shard_collection(COLL, key)
+            export(client.get_collection(name=name), name, out / key)
+        write_layout(out, layout["by"], layout["shards"])
+    else:
+        export(client.get_collection(name=COLL), COLL, out)
+        write_layout(out, "", [])
+    if INDEX_VERSIONS:
+        publish(MMAP_DIR, out)
+        removed = collect_garbage(MMAP_DIR)
+        print(f"🔀 {MMAP_DIR}/CURRENT -> {out.name}"
+              + (f" (removed {len(removed)} old versions)" if removed else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+from pathlib import Path
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.models import Normalize, Pooling
+from onnxruntime.quantization import quantize_dynamic, QuantType
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from onnx_embeddings import OnnxEmbeddings, ONNX_MODEL_DIR, MANIFEST
+
+MODEL = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+IN = Path("data/harvested.jsonl")  # parity texts; falls back to SAMPLE_TEXTS
+PARITY_TEXTS = int(os.getenv("PARITY_TEXTS", "256"))
+PARITY_MIN_COSINE = float(os.getenv("PARITY_MIN_COSINE", "0.98"))  # worst text, int8 vs PyTorch fp32
+OPSET = int(os.getenv("ONNX_OPSET", "14"))
+
+SAMPLE_TEXTS = [
+    "How does spaceflight affect bone density?",
+    "What are the main effects of microgravity on cardiovascular remodeling?",
+    "How does spaceflight impact immune response in astronauts?",
+    "Arabidopsis root growth under simulated microgravity",
+    "Muscle atrophy in mice after 30 days aboard the ISS",
+]
+
+
+def parity_texts() -> list:
+    texts = []
+    if IN.exists():
+        with open(IN, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    texts.append(json.loads(line).get("text", "")[:1600])
+                if len(texts) >= PARITY_TEXTS:
+                    break
+    return [t for t in texts if t.strip()] + SAMPLE_TEXTS
+
+
+def export(out: Path) -> dict:
+    st = SentenceTransformer(MODEL, device="cpu")
+    transformer = st[0]
+    pooling = next((m for m in st if isinstance(m, Pooling)), None)
+    if pooling is None or not pooling.pooling_mode_mean_tokens:
+        sys.exit(f"❌ {MODEL} does not use mean pooling; OnnxEmbeddings only implements mean pooling")
+
+    out.mkdir(parents=True, exist_ok=True)
+    tok = transformer.tokenizer
+    tok.save_pretrained(str(out))  # tokenizer.json for the tokenizers library
+
+    model = transformer.auto_model.eval()
+    model.config.return_dict = False
+    sample = tok(["hello world"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+    axes = {n: {0: "batch", 1: "seq"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+    fp32 = out / "model-fp32.onnx"
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[n] for n in names), str(fp32),
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes=axes, opset_version=OPSET,
+        )
+    quantize_dynamic(str(fp32), str(out / "model-int8.onnx"), weight_type=QuantType.QInt8)
+
+    manifest = {
+        "model": MODEL,
+        "max_seq_length": st.max_seq_length,
+        "normalize": any(isinstance(m, Normalize) for m in st),
+        "pad_id": tok.pad_token_id,
+        "pad_token": tok.pad_token,
+        "exported_at": int(time.time()),
+    }
+    (out / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def time_queries(emb, texts, rounds: int = 3) -> float:
+    emb.embed_query(texts[0])  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for t in texts:
+            emb.embed_query(t)
+    return (time.perf_counter() - t0) / (rounds * len(texts)) * 1000
+
+
+def main():
+    out = Path(ONNX_MODEL_DIR)
+    t0 = time.perf_counter()
+    manifest = export(out)
+    print(f"📦 Exported {MODEL} to {out} (fp32 + int8) in {time.perf_counter() - t0:.1f}s")
+
+    texts = parity_texts()
+    t0 = time.perf_counter()
+    torch_emb = HuggingFaceEmbeddings(model_name=MODEL)
+    torch_load = time.perf_counter() - t0
+    ref = np.asarray(torch_emb.embed_documents(texts), dtype=np.float32)
+
+    parity = {}
+    for name in ("model-fp32.onnx", "model-int8.onnx"):
+        t0 = time.perf_counter()
+        onnx_emb = OnnxEmbeddings(str(out), model_file=name)
+        load = time.perf_counter() - t0
+        got = np.asarray(onnx_emb.embed_documents(texts), dtype=np.float32)
+        cos = (got * ref).sum(1) / (np.linalg.norm(got, axis=1) * np.linalg.norm(ref, axis=1))
+        parity[name] = {
+            "min_cosine": round(float(cos.min()), 5),
+            "mean_cosine": round(float(cos.mean()), 5),
+            "query_ms": round(time_queries(onnx_emb, SAMPLE_TEXTS), 2),
+            "load_s": round(load, 2),
+        }
+        print(f"🔍 {name}: cosine vs PyTorch min={cos.min():.4f} mean={cos.mean():.4f} over {len(texts)} texts | "
+              f"{parity[name]['query_ms']:.1f} ms/query | loaded in {load:.2f}s")
+    torch_ms = time_queries(torch_emb, SAMPLE_TEXTS)
+    print(f"⏱️ PyTorch: {torch_ms:.1f} ms/query | loaded in {torch_load:.2f}s")
+
+    manifest["parity"] = {**parity, "torch_query_ms": round(torch_ms, 2), "texts": len(texts)}
+    (out / MANIFEST).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    if parity["model-int8.onnx"]["min_cosine"] < PARITY_MIN_COSINE:
+        sys.exit(f"❌ int8 parity below {PARITY_MIN_COSINE}; serve model-fp32.onnx (ONNX_MODEL_FILE) instead")
+    print("✅ Parity check passed; serve with EMBED_BACKEND=onnx")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,74 @@
-import os, csv, json, time, re, glob, hashlib
+import os, csv, json, time, re, glob, hashlib, threading, argparse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
 from pathlib import Path
+from typing import NamedTuple, Optional
+from email.utils import parsedate_to_datetime
 from urllib.parse import urlparse
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+from bs4.element import Tag, NavigableString, CData
+from html_cache import HtmlCache
+from crawl_manifest import CrawlManifest
 
 DATA_DIR = Path("data")
 OUT_PATH = DATA_DIR / "harvested.jsonl"
 CSV_GLOB = "data/*.csv"  # put all NASA CSVs here
+CACHE_DIR = Path(os.getenv("HTML_CACHE_DIR", str(DATA_DIR / "html-cache")))
+MANIFEST_PATH = Path(os.getenv("CRAWL_MANIFEST", str(DATA_DIR / "manifest.sqlite")))
+CHECKPOINT_EVERY = int(os.getenv("CHECKPOINT_EVERY", "50"))  # pages between manifest commits
 
 HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; SpaceBioHarvester/1.0)"}
 SECTION_KEYS = ["abstract", "introduction", "methods", "results", "discussion", "conclusion"]
+HEADING_TAGS = {"h1", "h2", "h3"}
+BLOCK_TAGS = {"p", "div", "section"}
+TEXT_TYPES = (NavigableString, CData)  # what get_text() counts as text (no comments/doctype)
+
+# Fetch engine: total worker threads, plus a per-host politeness budget
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", "16"))
+PER_HOST_CONCURRENCY = int(os.getenv("PER_HOST_CONCURRENCY", "4"))
+PER_HOST_RPS = float(os.getenv("PER_HOST_RPS", "2.5"))  # 2.5 req/s == the old 0.4s sleep
+PER_HOST_BURST = int(os.getenv("PER_HOST_BURST", "4"))
+FETCH_RETRIES = int(os.getenv("FETCH_RETRIES", "3"))
+FETCH_BACKOFF = float(os.getenv("FETCH_BACKOFF", "1.0"))
+FETCH_MAX_BACKOFF = float(os.getenv("FETCH_MAX_BACKOFF", "60"))  # cap, also on a server's Retry-After
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+HARVESTED = ("ok", "not_modified")  # page statuses whose records are in OUT_PATH
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+
+def iter_blocks(root):
+    """Yield ("heading", text) / ("block", text) in document order, in one pass.
+
+    A text node belongs to its innermost p/div/section; nested blocks split the
+    parent's text instead of repeating it. Text outside any block is ignored.
+    """
+    parts = []
+    depth = 0
+    stack = [(root, False)]
+    while stack:
+        node, closing = stack.pop()
+        if closing or (isinstance(node, Tag) and (node.name in HEADING_TAGS or node.name in BLOCK_TAGS)):
+            if parts:
+                yield "block", " ".join(parts)
+                parts = []
+        if closing:
+            depth -= 1
+            continue
+        if not isinstance(node, Tag):
+            if depth and type(node) in TEXT_TYPES:
+                t = node.strip()
+                if t:
+                    parts.append(t)
+            continue
+        if node.name in HEADING_TAGS:
+            yield "heading", node.get_text(" ", strip=True)
+            continue
+        if node.name in BLOCK_TAGS:
+            depth += 1
+            stack.append((node, True))
+        stack.extend((child, False) for child in reversed(node.contents))
 
 
 def clean_text(html: str) -> dict:
@@ -28,19 +87,16 @@ def clean_text(html: str) -> dict:
             sections.setdefault(current, "")
             sections[current] += ("\n\n" + txt if sections[current] else txt)
 
-    # Walk headings/paragraphs and group under nearest heading
-    for node in soup.find_all(["h1","h2","h3","p","div","section"]):
-        t = node.name.lower()
-        if t in ["h1","h2","h3"]:
+    # Group block text under the nearest heading, visiting each text node once
+    for kind, text in iter_blocks(soup):
+        if kind == "heading":
             flush()
-            title = re.sub(r"\s+", " ", node.get_text(" ", strip=True)).lower()
+            title = re.sub(r"\s+", " ", text).lower()
             mapped = next((k for k in SECTION_KEYS if k in title), None)
             current = mapped or title or "section"
             buf = []
-        else:
-            text = node.get_text(" ", strip=True)
-            if text and len(text) > 1:
-                buf.append(text)
+        elif len(text) > 1:
+            buf.append(text)
     flush()
 
     # Keep canonical sections first, then any substantial leftovers
@@ -60,14 +116,185 @@ def clean_text(html: str) -> dict:
     txt = re.sub(r"[ \t]{2,}", " ", txt)
     return {"fulltext": txt.strip()}
 
-def fetch(url: str, timeout=25):
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens/sec, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+
+class HostLimiter:
+    """Per-host concurrency cap and request rate, created lazily per netloc."""
+
+    def __init__(self, concurrency=PER_HOST_CONCURRENCY, rps=PER_HOST_RPS, burst=PER_HOST_BURST):
+        self.concurrency = concurrency
+        self.rps = rps
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def _limits(self, host: str):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = (threading.BoundedSemaphore(self.concurrency),
+                                    TokenBucket(self.rps, self.burst))
+            return self.hosts[host]
+
+    @contextmanager
+    def slot(self, url: str):
+        sem, bucket = self._limits(urlparse(url).netloc.lower())
+        with sem:
+            bucket.acquire()
+            yield
+
+
+def make_session() -> requests.Session:
+    """Shared keep-alive session. It does not retry itself: get_with_retries does, through the limiter."""
+    adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS)
+    s = requests.Session()
+    s.headers.update(HEADERS)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+def retry_delay(attempt: int, r: Optional[requests.Response]) -> float:
+    """Seconds before retry `attempt` + 1: the server's Retry-After if it sent one, else exponential backoff."""
+    after = r.headers.get("Retry-After") if r is not None else None
+    if after:
+        try:
+            return min(FETCH_MAX_BACKOFF, max(0.0, float(after)))
+        except ValueError:
+            try:
+                return min(FETCH_MAX_BACKOFF, max(0.0, parsedate_to_datetime(after).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return min(FETCH_MAX_BACKOFF, FETCH_BACKOFF * 2 ** attempt)
+
+
+def get_with_retries(url: str, session: requests.Session, limiter: HostLimiter, headers: dict,
+                     timeout) -> requests.Response:
+    """GET, retrying connection errors and 429/5xx up to FETCH_RETRIES times.
+
+    Every attempt takes its own limiter slot and token, so retries count against
+    the host's rate; the backoff sleep happens outside the slot.
+    """
+    for attempt in range(FETCH_RETRIES + 1):
+        last = attempt == FETCH_RETRIES
+        r = None
+        try:
+            with limiter.slot(url):
+                r = session.get(url, headers=headers, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if last:
+                raise
+        else:
+            if r.status_code not in RETRY_STATUSES or last:
+                return r
+        time.sleep(retry_delay(attempt, r))
+
+
+class Fetched(NamedTuple):
+    status: str                  # fetched | not_modified | failed
+    html: Optional[str] = None
+    http_status: Optional[int] = None
+    error: Optional[str] = None
+    content_hash: Optional[str] = None
+
+
+def fetch(url: str, session: requests.Session, limiter: HostLimiter, cache: HtmlCache,
+          title: str = "", timeout=25, revalidate: bool = False) -> Fetched:
+    """GET `url` and store the raw body in `cache`.
+
+    Only a `revalidate` fetch (page already written out) is conditional: a 304 for
+    a page whose records were never written would otherwise leave it with no body
+    to parse. Should a server answer 304 anyway, the cached body is used.
+    """
+    r = None
     try:
-        r = requests.get(url, headers=HEADERS, timeout=timeout)
+        r = get_with_retries(url, session, limiter, cache.conditional_headers(url) if revalidate else {}, timeout)
+        if r.status_code == 304:
+            if revalidate:
+                return Fetched("not_modified", http_status=304)
+            entry = cache.get_entry(url)
+            html = cache.read_blob(entry["sha256"]) if entry else None
+            if html is None:
+                raise ValueError("304 Not Modified but no cached body")
+            return Fetched("fetched", html, 304, content_hash=entry["sha256"])
         r.raise_for_status()
-        return r.text
+        html = r.text
+        digest = cache.put(url, title, html, r.headers.get("ETag"), r.headers.get("Last-Modified"))
+        return Fetched("fetched", html, r.status_code, content_hash=digest)
     except Exception as e:
         print(f"❌ {url} -> {e}")
-        return None
+        return Fetched("failed", http_status=r.status_code if r is not None else None, error=str(e)[:500])
+
+
+def fetch_all(rows, session: requests.Session, limiter: HostLimiter, cache: HtmlCache,
+              manifest: CrawlManifest):
+    """Yield (title, url, Fetched) as fetches complete, keeping a bounded window in flight.
+
+    Pages whose records are written (HARVESTED) are revalidated with a conditional GET.
+    """
+    rows = iter(rows)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as pool:
+        def refill():
+            while len(pending) < FETCH_WORKERS * 2:
+                nxt = next(rows, None)
+                if nxt is None:
+                    return
+                title, url = nxt
+                revalidate = manifest.page_status(url_key(url, "")) in HARVESTED
+                pending[pool.submit(fetch, url, session, limiter, cache, title, revalidate=revalidate)] = (title, url)
+
+        refill()
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                title, url = pending.pop(fut)
+                yield title, url, fut.result()
+            refill()
+
+def parse_all(fetched):
+    """Run clean_text for each fetched page on a process pool, yielding (title, url, secmap)."""
+    pending = {}
+
+    def drain(block: bool):
+        done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for fut in done:
+            title, url = pending.pop(fut)
+            try:
+                secmap = fut.result()
+            except Exception as e:
+                print(f"❌ parse {url} -> {e}")
+                continue
+            yield title, url, secmap
+
+    with ProcessPoolExecutor(max_workers=PARSE_WORKERS) as pool:
+        for title, url, html in fetched:
+            if not html:
+                continue
+            pending[pool.submit(clean_text, html)] = (title, url)
+            yield from drain(block=len(pending) >= PARSE_WORKERS * 2)
+        while pending:
+            yield from drain(block=True)
 
 def read_rows(csv_path: Path):
     with open(csv_path, newline="", encoding="utf-8") as f:
@@ -87,62 +314,157 @@ def url_key(u: str, section: str) -> str:
     base = f"{p.netloc}{p.path}".lower()
     return hashlib.sha1(f"{base}::{section.lower()}".encode("utf-8")).hexdigest()
 
+def iter_csv_rows(manifest: CrawlManifest, refresh: bool = False):
+    """All (title, url) rows across the CSVs, skipping URLs already queued this run
+    and, unless `refresh`, URLs the manifest says were fully harvested."""
+    queued = set()
+    for csv_file in glob.glob(CSV_GLOB):
+        print(f"📄 Reading {csv_file}")
+        for title, url in read_rows(Path(csv_file)):
+            k = url_key(url, "")
+            if k in queued:
+                continue
+            queued.add(k)
+            if not refresh and manifest.page_status(k) in HARVESTED:
+                continue
+            yield title, url
+
+def track_fetches(fetched, manifest: CrawlManifest):
+    """Record each fetch outcome in the manifest; pass on (title, url, html) for new bodies.
+
+    Successful pages stay "fetched" until write_records has written their sections,
+    so a crash in between gets them re-fetched on resume.
+    """
+    for title, url, res in fetched:
+        manifest.mark_page(url_key(url, ""), url, title, res.status,
+                           res.http_status, res.error, res.content_hash)
+        if res.html:
+            yield title, url, res.html
+
+def sync_manifest(manifest: CrawlManifest):
+    """Index JSONL lines appended since the last checkpoint (the whole file on first run)."""
+    size = OUT_PATH.stat().st_size if OUT_PATH.exists() else 0
+    done = int(manifest.get_meta("jsonl_size", "0"))
+    if size < done:  # file was replaced or truncated outside the harvester
+        manifest.reset_records()
+        done = 0
+    if size == done:
+        return
+    with open(OUT_PATH, "rb") as f:
+        f.seek(done)
+        for line in f:
+            if not line.strip(): continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            url, section = rec.get("url", ""), rec.get("section", "fulltext")
+            page = url_key(url, "")
+            manifest.add(url_key(url, section), page, section)
+            if manifest.page_status(page) is None:
+                manifest.mark_page(page, url, rec.get("title", ""), "ok")
+    manifest.checkpoint(size)
+    print(f"🗂️ Indexed {size - done} bytes of {OUT_PATH} into {MANIFEST_PATH}")
+
+def write_records(out, parsed, manifest: CrawlManifest, checkpoint: bool = True) -> int:
+    """Append one JSONL record per substantial, unseen section; returns the count written.
+
+    Commits the manifest every CHECKPOINT_EVERY pages, right after flushing `out`,
+    so the manifest never claims records that are not on disk. With `checkpoint`
+    off (`out` is not OUT_PATH yet) nothing is committed; the caller does that.
+    """
+    total_new = 0
+    pages = 0
+    for title, url, secmap in parsed:
+        wrote_any = False
+
+        for section, text in secmap.items():
+            if len(text) < 500:
+                continue
+
+            k = url_key(url, section)
+            if k in manifest:
+                continue
+
+            rec = {
+                "id": f"{url}::{section}",
+                "title": title,
+                "url": url,
+                "section": section,
+                "source_type": "web",
+                "text": text
+            }
+            out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            manifest.add(k, url_key(url, ""), section)
+            total_new += 1
+            wrote_any = True
+
+        if wrote_any:
+            print(f"✅ {title[:70]}… (+{len(secmap)})")
+        else:
+            print(f"⚠️ No substantial sections kept: {title[:70]}…")
+
+        manifest.mark_page(url_key(url, ""), url, title, "ok")
+        pages += 1
+        if checkpoint and pages % CHECKPOINT_EVERY == 0:
+            out.flush()
+            manifest.checkpoint(out.tell())
+    out.flush()
+    if checkpoint:
+        manifest.checkpoint(out.tell())
+    return total_new
+
+def reparse_only(cache: HtmlCache, manifest: CrawlManifest):
+    """Rebuild OUT_PATH from the raw HTML cache with the current section rules; no network I/O."""
+    pages = (
+        (e.get("title", ""), e["url"], cache.read_blob(e["sha256"]))
+        for e in cache.iter_entries()
+    )
+    tmp = OUT_PATH.with_suffix(".jsonl.tmp")
+    # one transaction: a crash before os.replace leaves the manifest matching the old file
+    manifest.reset_records()
+    with open(tmp, "w", encoding="utf-8") as out:
+        total = write_records(out, parse_all(pages), manifest, checkpoint=False)
+    os.replace(tmp, OUT_PATH)
+    manifest.checkpoint(OUT_PATH.stat().st_size)
+    print(f"\nDone. Rebuilt {total} records from {CACHE_DIR} → {OUT_PATH}")
+
 def main():
+    ap = argparse.ArgumentParser(description="Harvest NASA bioscience articles into JSONL.")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--reparse-only", action="store_true",
+                      help="rebuild harvested.jsonl from the raw HTML cache without fetching")
+    mode.add_argument("--retry-failed", action="store_true",
+                      help="only re-fetch URLs the manifest records as failed or unfinished")
+    mode.add_argument("--refresh", action="store_true",
+                      help="re-check every CSV URL (conditional GET), not just unfinished ones")
+    args = ap.parse_args()
+
     os.makedirs(DATA_DIR, exist_ok=True)
+    cache = HtmlCache(CACHE_DIR)
+    manifest = CrawlManifest(MANIFEST_PATH)
+    try:
+        if args.reparse_only:
+            reparse_only(cache, manifest)
+            return
 
-    # Load existing to avoid duplicates on reruns
-    seen = set()
-    if OUT_PATH.exists():
-        with open(OUT_PATH, encoding="utf-8") as f:
-            for line in f:
-                if not line.strip(): continue
-                try:
-                    rec = json.loads(line)
-                    seen.add(url_key(rec.get("url",""), rec.get("section", "fulltext")))
-                except: 
-                    pass
+        sync_manifest(manifest)
+        if args.retry_failed:
+            rows = manifest.retry_pages()
+        else:
+            rows = iter_csv_rows(manifest, refresh=args.refresh)
 
-    total_new = 0
-    with open(OUT_PATH, "a", encoding="utf-8") as out:
-        for csv_file in glob.glob(CSV_GLOB):
-            print(f"📄 Reading {csv_file}")
-            for title, url in read_rows(Path(csv_file)):
-                html = fetch(url)
-                if not html:
-                    continue
-                secmap = clean_text(html)
-
-                wrote_any = False
-
-                for section, text in secmap.items():
-                    if len(text) < 500:
-                        continue
-                    
-                    k = url_key(url, section)
-                    if k in seen:
-                        continue
-                    
-                    rec = {
-                        "id": f"{url}::{section}",
-                        "title": title,
-                        "url": url,
-                        "section": section,
-                        "source_type": "web",
-                        "text": text
-                    }
-                    out.write(json.dumps(rec, ensure_ascii=False) + "\n")
-                    seen.add(k)
-                    total_new += 1
-                    wrote_any = True
-
-                if wrote_any:
-                    print(f"✅ {title[:70]}… (+{len(secmap)})")
-                else:
-                    print(f"⚠️ No substantial sections kept: {title[:70]}…")
-
-
-                time.sleep(0.4)  
-    print(f"\nDone. Added {total_new} new records → {OUT_PATH}")
+        session = make_session()
+        limiter = HostLimiter()
+        # Fetch threads feed the parse processes; only this thread touches `out` and the manifest.
+        # Pages answering 304 Not Modified are dropped before parsing: their records already exist.
+        with open(OUT_PATH, "a", encoding="utf-8") as out:
+            fetched = track_fetches(fetch_all(rows, session, limiter, cache, manifest), manifest)
+            total_new = write_records(out, parse_all(fetched), manifest)
+        print(f"\nDone. Added {total_new} new records → {OUT_PATH}")
+        print(f"Pages by status: {manifest.counts()}")
+    finally:
+        manifest.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,96 @@
+import os, json, gzip, time, hashlib
+from pathlib import Path
+from typing import Iterator, Dict, Optional
+from urllib.parse import urlparse
+
+
+def normalize_url(u: str) -> str:
+    # same normalization as harvest.url_key: host + path, lowercased, no query
+    p = urlparse(u.strip())
+    return f"{p.netloc}{p.path}".lower()
+
+
+class HtmlCache:
+    """Compressed raw-HTML store for the harvester.
+
+    Layout under `root`:
+      blobs/<sha256>.html.gz      page bodies, content-addressed (identical pages stored once)
+      urls/<xx>/<sha1>.json       per-URL entry: url, title, etag, last_modified, sha256, fetched_at
+    Files are written via tmp + os.replace, so concurrent fetch threads never see partial writes.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self.blobs = self.root / "blobs"
+        self.urls = self.root / "urls"
+        self.blobs.mkdir(parents=True, exist_ok=True)
+        self.urls.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, url: str) -> Path:
+        h = hashlib.sha1(normalize_url(url).encode("utf-8")).hexdigest()
+        return self.urls / h[:2] / f"{h}.json"
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.blobs / f"{digest}.html.gz"
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{time.monotonic_ns()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get_entry(self, url: str) -> Optional[Dict]:
+        path = self._entry_path(url)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # an entry is only usable if its body is still on disk
+        return entry if self._blob_path(entry.get("sha256", "")).exists() else None
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        entry = self.get_entry(url)
+        if not entry:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read_blob(self, digest: str) -> Optional[str]:
+        try:
+            with gzip.open(self._blob_path(digest), "rb") as f:
+                return f.read().decode("utf-8")
+        except OSError:
+            return None
+
+    def put(self, url: str, title: str, html: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None) -> str:
+        raw = html.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        blob = self._blob_path(digest)
+        if not blob.exists():
+            self._atomic_write(blob, gzip.compress(raw, compresslevel=6))
+        entry = {
+            "url": url,
+            "title": title,
+            "etag": etag,
+            "last_modified": last_modified,
+            "sha256": digest,
+            "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        }
+        self._atomic_write(self._entry_path(url), json.dumps(entry, ensure_ascii=False).encode("utf-8"))
+        return digest
+
+    def iter_entries(self) -> Iterator[Dict]:
+        for path in sorted(self.urls.glob("*/*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
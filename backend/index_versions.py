@@ -0,0 +1,342 @@
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+logger = logging.getLogger("uvicorn.error")
+
+# Versioned index layout, shared by the Chroma index (embed_local.py) and the mmap export (export_index.py):
+#   <root>/v-20250101T120000-1234/...   one complete, never-modified build per directory
+#   <root>/CURRENT                      name of the version readers should use, replaced atomically
+# A build writes a new version next to the live one and then swaps the pointer; serving processes
+# notice the pointer move (IndexVersion), load the new version in the background and switch to it.
+# Requests already running keep the objects of the old version until they finish.
+POINTER = "CURRENT"
+PUBLISHED = "PUBLISHED"  # written into a version when it goes live
+VERSION_PREFIX = "v-"
+# 1: every build is a new version, hot-swapped by running services; off by default, since each build
+# then copies the live index and every kept version ends up in a deployment bundle
+INDEX_VERSIONS = os.getenv("INDEX_VERSIONS", "0") == "1"
+INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", "2"))  # live one + one to roll back to
+# a retired version stays on disk at least this long, so workers that have not switched yet can finish
+INDEX_GC_GRACE_S = float(os.getenv("INDEX_GC_GRACE_S", "600"))
+# requests still reading a retired Chroma version get this long before its client is stopped
+INDEX_DRAIN_S = float(os.getenv("INDEX_DRAIN_S", "60"))
+
+
+def current_version(root) -> Optional[str]:
+    try:
+        name = (Path(root) / POINTER).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    return name or None
+
+
+def resolve(root) -> Path:
+    """Directory of the live version, or `root` itself for an unversioned (flat) index."""
+    name = current_version(root)
+    return Path(root) / name if name else Path(root)
+
+
+def versions(root) -> List[str]:
+    """Version directory names, oldest first (names sort by build time)."""
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    return sorted(p.name for p in root.iterdir() if p.is_dir() and p.name.startswith(VERSION_PREFIX))
+
+
+FICLONE = 0x40049409  # Linux ioctl: share the source's extents copy-on-write (btrfs, XFS, bcachefs)
+
+
+def _clone(src, dst):
+    """copytree's copy_function: a reflink where the filesystem has them, else a full copy.
+
+    Not a hardlink: Chroma rewrites chroma.sqlite3 and the HNSW files in place, which
+    would change the live version under its readers.
+    """
+    try:
+        import fcntl
+        with open(src, "rb") as s, open(dst, "wb") as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        shutil.copystat(src, dst)
+        return dst
+    except (ImportError, OSError):
+        return shutil.copy2(src, dst)
+
+
+def new_version(root, seed: Optional[Path] = None) -> Path:
+    """An empty version directory, or a (reflinked where possible) copy of `seed` to update incrementally."""
+    name = f"{VERSION_PREFIX}{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+    path = Path(root) / name
+    if seed is not None and seed.is_dir():
+        # a flat index being migrated: copy its files, not the versions next to them
+        ignore = shutil.ignore_patterns(f"{VERSION_PREFIX}*", POINTER) if seed == Path(root) else None
+        shutil.copytree(seed, path, ignore=ignore, copy_function=_clone)
+        (path / PUBLISHED).unlink(missing_ok=True)
+    else:
+        path.mkdir(parents=True)
+    return path
+
+
+def publish(root, version_dir: Path):
+    """Atomically point readers at `version_dir`."""
+    root = Path(root)
+    (version_dir / PUBLISHED).write_text(str(time.time()), encoding="utf-8")
+    tmp = root / f".{POINTER}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(version_dir.name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, root / POINTER)
+
+
+def _published_at(path: Path) -> Optional[float]:
+    try:
+        return float((path / PUBLISHED).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def collect_garbage(root, keep: int = INDEX_KEEP_VERSIONS, grace_s: float = INDEX_GC_GRACE_S) -> List[str]:
+    """Delete versions that are neither live, among the newest `keep`, nor retired less than `grace_s` ago.
+
+    A version is retired when the next one is published. Builds that never went
+    live (crashed or still running) are only removed once they are `grace_s` old.
+    """
+    root = Path(root)
+    live = current_version(root)
+    names = versions(root)
+    published = [n for n in names if _published_at(root / n) is not None]
+    protected = set(published[-max(1, keep):]) | {live}
+    now = time.time()
+    removed = []
+    for name in names:
+        if name in protected:
+            continue
+        path = root / name
+        if name in published:
+            later = [_published_at(root / n) for n in published if n > name]
+            retired_at = min(later) if later else now
+        else:
+            retired_at = path.stat().st_mtime
+        if now - retired_at < grace_s:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        removed.append(name)
+    return removed
+
+
+def _release(stores, delay_s: float = 0.0):
+    """Stop the chromadb systems (sqlite handles, threads) behind `stores`, after `delay_s`.
+
+    They leave chromadb's per-path client cache at once, which would otherwise keep
+    them for the life of the process; other paths' clients are left alone.
+    """
+    try:
+        from chromadb.api.client import SharedSystemClient
+    except ImportError:
+        return
+    systems = {}
+    for store in stores:
+        ident = getattr(getattr(store, "_client", None), "_identifier", None)
+        system = SharedSystemClient._identifier_to_system.pop(ident, None)
+        if system is not None:
+            systems[ident] = system
+
+    def stop():
+        for ident, system in systems.items():
+            try:
+                system.stop()
+            except Exception as e:
+                logger.warning("Could not stop Chroma client for %s: %s", ident, e)
+
+    if delay_s > 0 and systems:
+        timer = threading.Timer(delay_s, stop)
+        timer.daemon = True
+        timer.start()
+    else:
+        stop()
+
+
+READ_ONLY = "VersionedChroma is read-only; build versions with embed_local.py"
+
+
+class VersionedChroma(VectorStore):
+    """Chroma over the version `<root>/CURRENT` points at, switching when the pointer moves.
+
+    The new version is opened on a background thread while the old one keeps
+    serving; a flat `root` (no pointer) is opened directly, as before.
+    `close()` drops the client until the next use reopens it. Read-only: it is a
+    VectorStore so that as_retriever() works, and every write raises TypeError.
+    """
+
+    def __init__(self, root: str, embedding_function, collection_name: str,
+                 version: Optional[Callable[[], Any]] = None):
+        from query_cache import IndexVersion
+
+        self.root = root
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        # e.g. QueryCache.version.current, so the result cache and the store move together
+        self.version = version or IndexVersion(root).current
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._opening = False
+        self._shards = {}  # collection name -> store, for the version in _path
+        self._store_version = self.version()
+        self._path = resolve(root)
+        self._store = self._open(self._path)
+
+    def _open(self, path: Path, collection_name: Optional[str] = None):
+        from langchain_chroma import Chroma
+
+        # a shard collection must exist in the version (shards.json lists it); only the main one is created
+        store = Chroma(persist_directory=str(path), embedding_function=self.embedding_function,
+                       collection_name=collection_name or self.collection_name,
+                       create_collection_if_not_exists=collection_name is None)
+        store._collection.count()  # fail here, not in a request, if the version is unreadable
+        return store
+
+    def _adopt(self, path: Path):
+        """Open `path` and make it the store requests use; a no-op if it already is."""
+        with self._open_lock:
+            return self._adopt_locked(path)
+
+    def _adopt_locked(self, path: Path):
+        # a flat index is written in place and needs no reopen
+        if path != self._path or self._store is None:
+            store = self._open(path)
+            logger.info("%s Chroma index %s", "Opened" if self._path is None else "Switched to", path)
+            retired = [s for s in (self._store, *self._shards.values()) if s is not None]
+            self._path = path
+            self._store = store  # requests read _store once: they get the old store or the new one
+            self._shards = {}
+            _release(retired, INDEX_DRAIN_S)  # only the old version's client, once requests on it finish
+        return self._store
+
+    def _switch(self, v):
+        try:
+            self._adopt(resolve(self.root))
+        except Exception as e:
+            # keep serving the old version; retried on the next pointer move
+            logger.error("Could not open index version %s: %s", resolve(self.root), e)
+        finally:
+            self._store_version = v
+            self._opening = False
+
+    def current(self):
+        """The store to serve from now; a moved pointer is followed in the background."""
+        v = self.version()
+        if v != self._store_version:
+            with self._lock:
+                if v != self._store_version and not self._opening:
+                    self._opening = True
+                    threading.Thread(target=self._switch, args=(v,), name="index-open", daemon=True).start()
+        store = self._store
+        return store if store is not None else self.latest()  # reopens after close()
+
+    def close(self):
+        """Close the Chroma client, e.g. once an in-memory engine has loaded and before serve.py forks:
+        a chromadb client must not be inherited by a child. Nothing may be using it meanwhile."""
+        with self._open_lock:
+            stores = [self._store, *self._shards.values()]
+            self._path, self._store, self._shards = None, None, {}
+        _release([s for s in stores if s is not None])
+
+    def served_version(self):
+        """Directory requests are served from (QueryCache.track)."""
+        return self._path
+
+    def latest(self):
+        """The store for the version the pointer names right now, opened on this thread if needed.
+
+        For loaders that already run in the background (SectionIndex reloads).
+        """
+        return self._adopt(resolve(self.root))
+
+    def collection(self, name: str, latest: bool = False):
+        """Store for another collection (a shard, see sharded_index.py) of the version being served;
+        raises if that version has no such collection."""
+        if not latest:
+            self.current()  # follows a moved pointer in the background
+        # under the lock a switch or close() cannot swap _path and _shards between the lookup and the open
+        with self._open_lock:
+            if latest or self._store is None:
+                self._adopt_locked(resolve(self.root))
+            store = self._shards.get(name)
+            if store is None:
+                store = self._shards[name] = self._open(self._path, name)
+            return store
+
+    # what the serving code uses of Chroma
+    @property
+    def _collection(self):
+        return self.current()._collection
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def get(self, *args, **kwargs):
+        return self.current().get(*args, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> List[Document]:
+        return self.current().similarity_search(query, k=k, **kwargs)
+
+    def similarity_search_with_score(self, *args, **kwargs):
+        return self.current().similarity_search_with_score(*args, **kwargs)
+
+    def max_marginal_relevance_search(self, *args, **kwargs) -> List[Document]:
+        return self.current().max_marginal_relevance_search(*args, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        return self.current()._select_relevance_score_fn()
+
+    def add_texts(self, *args, **kwargs):
+        raise TypeError(READ_ONLY)
+
+    def add_documents(self, *args, **kwargs):
+        raise TypeError(READ_ONLY)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError(READ_ONLY)
+
+    @classmethod
+    def from_texts(cls, *args, **kwargs):
+        raise TypeError(READ_ONLY)
+
+
+def main():
+    # python index_versions.py <root> [list|gc|rollback]
+    root = Path(sys.argv[1] if len(sys.argv) > 1 else os.getenv("INDEX_DIR", "index-chroma"))
+    cmd = sys.argv[2] if len(sys.argv) > 2 else "list"
+    live = current_version(root)
+    if cmd == "gc":
+        removed = collect_garbage(root)
+        print(f"🧹 Removed {len(removed)} old versions" + (f": {', '.join(removed)}" if removed else ""))
+    elif cmd == "rollback":
+        older = [n for n in versions(root) if _published_at(root / n) is not None and (live is None or n < live)]
+        if not older:
+            sys.exit(f"❌ No earlier published version under {root}")
+        publish(root, root / older[-1])
+        print(f"↩️ {root} now serves {older[-1]} (was {live})")
+    else:
+        for name in versions(root):
+            at = _published_at(root / name)
+            state = "live" if name == live else ("published" if at else "unpublished")
+            print(f"{'→' if name == live else ' '} {name}  {state}"
+                  + (f"  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(at))}" if at else ""))
+        if live is None:
+            print(f"ℹ️ {root} has no {POINTER} pointer (flat layout)")
+
+
+if __name__ == "__main__":
+    main()
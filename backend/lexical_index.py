@@ -0,0 +1,194 @@
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from index_versions import POINTER, resolve
+from mmap_index import CHUNKS, OFFSETS, MANIFEST, _replace_write
+from section_index import Reloading
+
+INDEX_DIR = os.getenv("INDEX_DIR", "index-chroma")
+LEXICAL_DIR = "lexical"  # inside the index version embed_local.py writes
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))  # reciprocal-rank fusion damping for mode=hybrid
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+
+# On-disk layout in <index version>/lexical/ (read-only once written):
+#   terms.json     term -> [start, end) into the posting arrays, terms sorted
+#   postings.u32   chunk rows, grouped by term
+#   impacts.f32    BM25 weight of the term in that row (idf and length norm folded in at build time)
+#   sections.u8    section number per row (manifest "sections")
+#   chunks.jsonl / offsets.i64   same format as the mmap index
+#   manifest.json  count, k1, b, avgdl, sections; written last
+TERMS, POSTINGS, IMPACTS, ROW_SECTIONS = "terms.json", "postings.u32", "impacts.f32", "sections.u8"
+
+# identifiers such as "RR-1", "p53" or "16S" stay whole; their parts are indexed too
+TOKEN = re.compile(r"[a-z0-9]+(?:[-_.][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were which with "
+    "we our these those than then there their been into not no can may also such".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for tok in TOKEN.findall((text or "").lower()):
+        parts = re.split(r"[-_.]", tok)
+        for t in ([tok] + parts if len(parts) > 1 else [tok]):
+            if t not in STOPWORDS and (len(t) > 1 or t.isdigit()):
+                tokens.append(t)
+    return tokens
+
+
+def write_lexical(out_dir: Path, ids: Sequence[str], texts: Sequence[str], metas: Sequence[dict],
+                  k1: float = BM25_K1, b: float = BM25_B) -> dict:
+    """Build the BM25 inverted index over the chunks; returns the manifest."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    n = len(ids)
+    vocab: Dict[str, int] = {}
+    term_ids: List[int] = []
+    rows: List[int] = []
+    tfs: List[int] = []
+    lengths = np.zeros(n, dtype=np.float32)
+    for row, text in enumerate(texts):
+        counts = Counter(tokenize(text))
+        lengths[row] = sum(counts.values())
+        term_ids.extend(vocab.setdefault(term, len(vocab)) for term in counts)
+        rows.extend([row] * len(counts))
+        tfs.extend(counts.values())
+    avgdl = float(lengths.mean()) if n else 0.0
+    norm = k1 * (1 - b + b * lengths / (avgdl or 1.0))
+
+    # group the (term, row, tf) triples by term, terms in sorted order, rows ascending within a term
+    sorted_terms = sorted(vocab)
+    rank = np.empty(len(vocab), dtype=np.int64)
+    rank[[vocab[t] for t in sorted_terms]] = np.arange(len(vocab))
+    term_of = rank[np.asarray(term_ids, dtype=np.int64)]
+    order = np.argsort(term_of, kind="stable")
+    term_of = term_of[order]
+    row_of = np.asarray(rows, dtype=np.uint32)[order]
+    tf = np.asarray(tfs, dtype=np.float32)[order]
+    df = np.bincount(term_of, minlength=len(vocab))
+    bounds = np.concatenate([[0], np.cumsum(df)]).tolist()
+    idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+    impacts = (idf[term_of] * tf * (k1 + 1) / (tf + norm[row_of])).astype(np.float32)
+    terms = {term: [bounds[i], bounds[i + 1]] for i, term in enumerate(sorted_terms)}
+
+    names = sorted({(m or {}).get("section") or "fulltext" for m in metas})
+    number = {name: i for i, name in enumerate(names)}
+    row_sections = np.asarray([number[(m or {}).get("section") or "fulltext"] for m in metas], dtype=np.uint8)
+    offsets = [0]
+
+    def write_chunks(f):
+        for cid, text, meta in zip(ids, texts, metas):
+            line = json.dumps({"id": cid, "text": text, "meta": meta or {}}, ensure_ascii=False)
+            f.write(line.encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+
+    _replace_write(out_dir / POSTINGS, lambda f: f.write(row_of.tobytes()))
+    _replace_write(out_dir / IMPACTS, lambda f: f.write(impacts.tobytes()))
+    _replace_write(out_dir / ROW_SECTIONS, lambda f: f.write(row_sections.tobytes()))
+    _replace_write(out_dir / CHUNKS, write_chunks)
+    _replace_write(out_dir / OFFSETS, lambda f: f.write(np.asarray(offsets, dtype=np.int64).tobytes()))
+    _replace_write(out_dir / TERMS, lambda f: f.write(json.dumps(terms, ensure_ascii=False).encode("utf-8")))
+    manifest = {
+        "count": n, "terms": len(terms), "postings": len(row_of), "k1": k1, "b": b, "avgdl": avgdl,
+        "sections": names, "built_at": int(time.time()),
+    }
+    _replace_write(out_dir / MANIFEST, lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+    return manifest
+
+
+class LexicalIndex(Reloading):
+    """BM25 over the lexical/ files of the live index version, with the postings memory-mapped.
+
+    A query needs no embedding: it sums the precomputed impacts of its terms'
+    postings into one score per chunk. Follows a moving CURRENT pointer like
+    the vector engines (see Reloading).
+    """
+
+    def __init__(self, root: str = INDEX_DIR, version=None):
+        from query_cache import IndexVersion
+
+        self.root = Path(root)
+        self.version = version or IndexVersion(root, files=(POINTER, f"{LEXICAL_DIR}/{MANIFEST}")).current
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return self._loaded or (resolve(self.root) / LEXICAL_DIR / MANIFEST).exists()
+
+    def _load(self):
+        root = resolve(self.root) / LEXICAL_DIR
+        try:
+            manifest = json.loads((root / MANIFEST).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            raise FileNotFoundError(f"no lexical index in {root}; run embed_local.py with LEXICAL=1") from None
+        count = manifest["count"]
+        with open(root / CHUNKS, "rb") as f:
+            chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count else b""
+        empty = manifest["postings"] == 0
+        self.__dict__.update(
+            dir=root,
+            manifest=manifest,
+            terms=json.loads((root / TERMS).read_text(encoding="utf-8")),
+            postings=np.zeros(0, np.uint32) if empty else np.memmap(root / POSTINGS, dtype=np.uint32, mode="r"),
+            impacts=np.zeros(0, np.float32) if empty else np.memmap(root / IMPACTS, dtype=np.float32, mode="r"),
+            row_sections=np.fromfile(root / ROW_SECTIONS, dtype=np.uint8),
+            offsets=np.fromfile(root / OFFSETS, dtype=np.int64),
+            chunks=chunks,
+        )
+
+    def search(self, query: str, k: int, sections: Optional[Iterable[str]] = None) -> List[Document]:
+        """The k best BM25 matches, best first."""
+        self.refresh()
+        # one version's arrays throughout, even if a reload swaps them meanwhile
+        manifest, terms, postings, impacts = self.manifest, self.terms, self.postings, self.impacts
+        row_sections, offsets, chunks = self.row_sections, self.offsets, self.chunks
+        scores = np.zeros(manifest["count"], dtype=np.float32)
+        for term in set(tokenize(query)):
+            span = terms.get(term)
+            if span:
+                rows = postings[span[0]:span[1]]
+                scores[rows] += impacts[span[0]:span[1]]  # a term lists each row once
+        hits = np.flatnonzero(scores)
+        if sections is not None:
+            wanted = {s.lower() for s in sections}
+            allowed = [i for i, name in enumerate(manifest["sections"]) if name.lower() in wanted]
+            hits = hits[np.isin(row_sections[hits], allowed)]
+        if not len(hits) or k <= 0:
+            return []
+        if len(hits) > k:
+            hits = hits[np.argpartition(-scores[hits], k - 1)[:k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        docs = []
+        for row in hits.tolist():
+            chunk = json.loads(chunks[int(offsets[row]):int(offsets[row + 1])])
+            docs.append(Document(page_content=chunk["text"], metadata=chunk["meta"], id=chunk["id"]))
+        return docs
+
+    def stats(self) -> dict:
+        if not self._loaded:
+            return {"root": str(self.root), "loaded": False}
+        m = self.manifest
+        return {"root": str(self.dir), "chunks": m["count"], "terms": m["terms"], "postings": m["postings"]}
+
+
+def fuse(rankings: Sequence[Sequence[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """Reciprocal-rank fusion: sum of 1 / (rrf_k + rank) over the lists a chunk appears in."""
+    scores: Dict[str, float] = {}
+    first: Dict[str, Document] = {}
+    for docs in rankings:
+        for rank, d in enumerate(docs, 1):
+            key = d.id or d.page_content
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank)
+            first.setdefault(key, d)
+    return [first[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Iterable, Iterator, Optional
+
+LLM_DEADLINE_S = float(os.getenv("LLM_DEADLINE_S", "15"))  # per call; also the client timeout
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "0"))  # client retries eat the deadline; fall back instead
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))  # consecutive failures/timeouts to trip
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))  # open -> half-open
+
+
+class LLMUnavailable(Exception):
+    """The LLM call was not made or did not finish; serve the retrieval-only answer."""
+
+    reason = "llm_error"
+
+
+class CircuitOpen(LLMUnavailable):
+    reason = "breaker_open"
+
+
+class LLMBusy(LLMUnavailable):
+    reason = "llm_busy"
+
+
+class LLMTimeout(LLMUnavailable):
+    reason = "llm_timeout"
+
+
+class CircuitBreaker:
+    """closed -> open after `failures` consecutive failures; open -> half-open after `cooldown`.
+
+    Half-open lets exactly one probe call through: success closes the breaker,
+    failure re-opens it for another cooldown.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, cooldown: float = LLM_BREAKER_COOLDOWN_S):
+        self.failures = max(1, failures)
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive = 0
+        self.trips = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._probing:
+                    return False
+                self._probing = True
+            return self.state != "open"
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.consecutive = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            self._probing = False
+            if self.state == "half_open" or self.consecutive >= self.failures:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def abandon(self):
+        """The allowed call never reached the provider; let the next request probe instead."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            retry_in = self.cooldown - (time.monotonic() - self._opened_at) if self.state == "open" else 0.0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive,
+                "trips": self.trips,
+                "retry_in_s": round(max(0.0, retry_in), 1),
+            }
+
+
+class LLMGuard:
+    """Circuit breaker + in-flight limit + deadline around LLM calls.
+
+    Calls over the concurrency limit are rejected at once rather than queued, so a
+    slow provider turns into fast retrieval-only answers instead of hung workers.
+    """
+
+    def __init__(self, deadline: float = LLM_DEADLINE_S, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.deadline = deadline
+        self.max_concurrency = max(1, max_concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.in_flight = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            raise CircuitOpen()
+        with self._lock:
+            if self.in_flight >= self.max_concurrency:
+                self.rejected += 1
+                busy = True
+            else:
+                self.in_flight += 1
+                busy = False
+        if busy:
+            self.breaker.abandon()
+            raise LLMBusy()
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `fn()` under the guard; the deadline is enforced by cancelling the call."""
+        self._admit()
+        try:
+            result = await asyncio.wait_for(fn(), timeout=self.deadline)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.breaker.failure()
+            raise LLMTimeout()
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        except Exception:
+            self.breaker.failure()
+            raise
+        else:
+            self.breaker.success()
+            return result
+        finally:
+            self._release()
+
+    @contextmanager
+    def guarded(self):
+        """Sync variant (Vercel). The deadline is the client's own `timeout`; see stream() for streaming."""
+        self._admit()
+        ok = False
+        try:
+            yield
+            ok = True
+        except Exception:
+            self.breaker.failure()
+            raise
+        finally:
+            if ok:
+                self.breaker.success()
+            elif self.breaker.state == "half_open":
+                self.breaker.abandon()  # e.g. the client disconnected mid-stream
+            self._release()
+
+    def stream(self, chunks: Iterable[Any]) -> Iterator[Any]:
+        """Yield `chunks` under the guard, with the deadline covering the whole stream.
+
+        The client timeout only bounds each read, so a provider trickling tokens
+        could hold a worker for minutes. Chunks are pulled on a helper thread and
+        the caller waits at most until the deadline; then LLMTimeout is raised and
+        the breaker records a failure. The helper stops at its next chunk.
+        """
+        with self.guarded():
+            deadline = time.monotonic() + self.deadline
+            out: queue.Queue = queue.Queue()
+            stop = threading.Event()
+
+            def pump():
+                try:
+                    for chunk in chunks:
+                        if stop.is_set():
+                            return
+                        out.put((True, chunk))
+                    out.put((False, None))
+                except BaseException as e:
+                    out.put((False, e))
+
+            threading.Thread(target=pump, name="llm-stream", daemon=True).start()
+            try:
+                while True:
+                    try:
+                        more, item = out.get(timeout=max(0.0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        with self._lock:
+                            self.timeouts += 1
+                        raise LLMTimeout() from None
+                    if not more:
+                        if item is not None:
+                            raise item
+                        return
+                    yield item
+            finally:
+                stop.set()
+
+    def stats(self) -> dict:
+        return {
+            **self.breaker.stats(),
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "deadline_s": self.deadline,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
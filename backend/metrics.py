@@ -0,0 +1,88 @@
+import threading
+from typing import Dict, Sequence, Tuple
+
+# seconds; spans a cache hit (~µs) up to a slow LLM completion
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            s = self._series.setdefault(label_values, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for lv, s in sorted(self._series.items()):
+                for b, c in zip(self.buckets, s):
+                    le = 'le="%s"' % b
+                    lines.append(f"{self.name}_bucket{_labels(self.labels, lv, le)} {c}")
+                inf = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, lv, inf)} {s[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labels, lv)} {s[-2]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labels, lv)} {s[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for lv, v in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, lv)} {v:g}")
+        return "\n".join(lines)
+
+
+class Registry:
+    """The handful of metrics the RAG service exports, rendered in Prometheus text format."""
+
+    def __init__(self):
+        self.stage_seconds = Histogram(
+            "rag_stage_seconds", "Latency of one pipeline stage.", ["stage"])
+        self.request_seconds = Histogram(
+            "rag_request_seconds", "End-to-end handler latency.", ["endpoint"])
+        self.stage_errors = Counter(
+            "rag_stage_errors_total", "Exceptions raised inside a pipeline stage.", ["stage"])
+        self.fallbacks = Counter(
+            "rag_fallbacks_total", "/ask answers served retrieval-only, by reason.", ["reason"])
+        self.context_tokens = Counter(
+            "rag_context_tokens_total", "Retrieved-context tokens before (in) and after (out) packing.", ["kind"])
+
+    def render(self) -> str:
+        parts = [self.stage_seconds, self.request_seconds, self.stage_errors, self.fallbacks, self.context_tokens]
+        return "\n".join(p.render() for p in parts) + "\n"
+
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+metrics = Registry()  # one per process
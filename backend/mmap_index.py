@@ -0,0 +1,290 @@
+import json
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from section_index import Candidates, Reloading, mmr_rank, _normalize, MMR_SECTION_BONUS
+from index_versions import POINTER, resolve
+from quantize import (
+    CODE_FILES, SCALE_FILE, RESCORE_FACTOR, encode_all, scan_top, rescore, recall_at_k,
+    float_scorer, int8_scorer, binary_scorer,
+)
+
+MMAP_DIR = os.getenv("MMAP_DIR", "index-mmap")  # written by export_index.py
+FAISS_NPROBE = int(os.getenv("FAISS_NPROBE", "16"))  # IVF lists probed per query
+FAISS_EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "128"))  # HNSW search breadth
+FAISS_OVERSAMPLE = int(os.getenv("FAISS_OVERSAMPLE", "4"))  # fetch_k multiplier, to survive the section filter
+# "int8" / "binary": first pass over quantized codes, exact rescoring of the best rows from vectors.f32
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "").lower() or None
+
+# On-disk layout (all read-only once written; rows sorted so every section is one contiguous range):
+#   vectors.f32    count x dim float32, unit length
+#   chunks.jsonl   one {"id", "text", "meta"} per row
+#   offsets.i64    count + 1 byte offsets into chunks.jsonl
+#   faiss.index    optional IVF / HNSW index over vectors.f32 (inner product)
+#   codes.i8       optional count x dim int8 codes (+ scale.f32, dim per-dimension scales)
+#   codes.b1       optional count x dim/8 packed sign bits
+#   manifest.json  dim, count, sections -> [start, end), faiss kind; written last
+VECTORS, CHUNKS, OFFSETS, FAISS_FILE, MANIFEST = (
+    "vectors.f32", "chunks.jsonl", "offsets.i64", "faiss.index", "manifest.json",
+)
+
+
+def _replace_write(path: Path, write):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)  # readers that mapped the old file keep the old inode
+
+
+def build_faiss(vectors: np.ndarray, kind: str):
+    import faiss  # only needed when a FAISS index is requested
+
+    n, dim = vectors.shape
+    if kind == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 200
+    elif kind == "ivf":
+        nlist = max(1, min(int(4 * np.sqrt(n)), n // 39 or 1))  # faiss wants ~39 training points per list
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+    else:
+        raise ValueError(f"unknown FAISS index kind {kind!r} (use ivf or hnsw)")
+    index.add(vectors)
+    return index
+
+
+def write_index(out_dir: Path, ids: Sequence[str], vectors: np.ndarray, texts: Sequence[str],
+                metas: Sequence[dict], faiss_kind: Optional[str] = None, quantize: Sequence[str] = (),
+                extra: Optional[dict] = None) -> dict:
+    """Write the read-only layout above; returns the manifest."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    sections = [(m or {}).get("section") or "fulltext" for m in metas]
+    order = sorted(range(len(ids)), key=lambda i: sections[i])  # stable: keeps collection order per section
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32)[order]) if order else np.zeros((0, 0), np.float32)
+
+    ranges: Dict[str, List[int]] = {}
+    offsets = [0]
+
+    def write_chunks(f):
+        for row, i in enumerate(order):
+            ranges.setdefault(sections[i], [row, row])[1] = row + 1
+            line = json.dumps({"id": ids[i], "text": texts[i], "meta": metas[i] or {}}, ensure_ascii=False)
+            f.write(line.encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+
+    _replace_write(out_dir / VECTORS, lambda f: f.write(np.ascontiguousarray(vectors).tobytes()))
+    _replace_write(out_dir / CHUNKS, write_chunks)
+    _replace_write(out_dir / OFFSETS, lambda f: f.write(np.asarray(offsets, dtype=np.int64).tobytes()))
+    if faiss_kind:
+        import faiss
+
+        index = build_faiss(vectors, faiss_kind)
+        tmp = out_dir / (FAISS_FILE + ".tmp")
+        faiss.write_index(index, str(tmp))
+        os.replace(tmp, out_dir / FAISS_FILE)
+    elif (out_dir / FAISS_FILE).exists():
+        (out_dir / FAISS_FILE).unlink()
+    for mode, arrays in encode_all(vectors, quantize).items():
+        _replace_write(out_dir / CODE_FILES[mode], lambda f, a=arrays[0]: f.write(np.ascontiguousarray(a).tobytes()))
+        if mode == "int8":
+            _replace_write(out_dir / SCALE_FILE, lambda f, a=arrays[1]: f.write(a.tobytes()))
+
+    manifest = {
+        "count": len(order),
+        "dim": int(vectors.shape[1]) if len(order) else 0,
+        "sections": ranges,
+        "faiss": faiss_kind or None,
+        "quantized": list(quantize),
+        **(extra or {}),
+    }
+    _replace_write(out_dir / MANIFEST, lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+    return manifest
+
+
+def update_manifest(out_dir: Path, **fields) -> dict:
+    manifest = {**json.loads((out_dir / MANIFEST).read_text(encoding="utf-8")), **fields}
+    _replace_write(out_dir / MANIFEST, lambda f: f.write(json.dumps(manifest, indent=2).encode("utf-8")))
+    return manifest
+
+
+class MmapIndex(Reloading):
+    """Read-only vector index over the export_index.py files, shared by every process through the page cache.
+
+    Same interface as SectionIndex (candidates_many / select / search_many). Without
+    a FAISS index, a section filter narrows the scan to that section's row range
+    (a flat inner product over the mapped rows); with one, FAISS proposes
+    `FAISS_OVERSAMPLE * fetch_k` rows and the filter is applied to those. With
+    `quantization`, the scan runs over int8 / binary codes and only the best
+    rows' float32 vectors are read back for exact rescoring.
+    """
+
+    # what IndexVersion should watch: the version pointer, or the manifest of a flat (unversioned) export
+    FILES = (POINTER, MANIFEST)
+
+    def __init__(self, root: str = MMAP_DIR, preferred: Sequence[str] = (), bonus: float = MMR_SECTION_BONUS,
+                 use_faiss: bool = False, quantization: Optional[str] = VECTOR_QUANTIZATION, version=None,
+                 shard: Optional[str] = None):
+        self.root = Path(root)
+        self.shard = shard  # subdirectory of one shard of a sharded export (sharded_index.py)
+        self.quantization = quantization
+        self.preferred = {s.lower() for s in preferred}
+        self.bonus = bonus
+        self.use_faiss = use_faiss
+        self.version = version
+        self._lock = threading.Lock()
+
+    def _load(self):
+        root = resolve(self.root)  # the live version directory
+        if self.shard:
+            root = root / self.shard
+        manifest = json.loads((root / MANIFEST).read_text(encoding="utf-8"))
+        count, dim = manifest["count"], manifest["dim"]
+        if self.use_faiss and not manifest.get("faiss"):
+            raise RuntimeError(f"{root} has no FAISS index; re-run export_index.py with FAISS_INDEX=ivf|hnsw")
+        if self.quantization and self.quantization not in manifest.get("quantized", []):
+            raise RuntimeError(f"{root} has no {self.quantization} codes; re-run export_index.py "
+                               f"with QUANTIZE={self.quantization}")
+        sections = {name: (start, end) for name, (start, end) in manifest["sections"].items()}
+        vectors = np.memmap(root / VECTORS, dtype=np.float32, mode="r", shape=(count, dim)) \
+            if count else np.zeros((0, dim), dtype=np.float32)
+        with open(root / CHUNKS, "rb") as f:
+            chunks = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count else b""
+        # build everything first, then swap it in together; in-flight queries keep the old maps
+        self.__dict__.update(
+            dir=root,
+            manifest=manifest,
+            vectors=vectors,
+            _exact=float_scorer(vectors),
+            _first_pass=self._load_codes(root, count, dim) if self.quantization else None,
+            offsets=np.memmap(root / OFFSETS, dtype=np.int64, mode="r"),
+            chunks=chunks,
+            sections=sections,
+            _starts=sorted((start, end, name) for name, (start, end) in sections.items()),
+            faiss=self._read_faiss(root, manifest["faiss"]) if self.use_faiss else None,
+        )
+
+    def _load_codes(self, root: Path, count: int, dim: int):
+        path = root / CODE_FILES[self.quantization]
+        if self.quantization == "int8":
+            codes = np.memmap(path, dtype=np.int8, mode="r", shape=(count, dim)) if count \
+                else np.zeros((0, dim), dtype=np.int8)
+            return int8_scorer(codes, np.fromfile(root / SCALE_FILE, dtype=np.float32))
+        codes = np.memmap(path, dtype=np.uint8, mode="r", shape=(count, (dim + 7) // 8)) if count \
+            else np.zeros((0, (dim + 7) // 8), dtype=np.uint8)
+        return binary_scorer(codes)
+
+    def _read_faiss(self, root: Path, kind: str):
+        import faiss
+
+        path = str(root / FAISS_FILE)
+        try:
+            index = faiss.read_index(path, faiss.IO_FLAG_MMAP)
+        except RuntimeError:  # not every index type can be mapped
+            index = faiss.read_index(path, faiss.IO_FLAG_READ_ONLY)
+        if kind == "ivf":
+            index.nprobe = FAISS_NPROBE
+        elif kind == "hnsw":
+            index.hnsw.efSearch = FAISS_EF_SEARCH
+        return index
+
+    def _section_of(self, row: int) -> str:
+        for start, end, name in self._starts:
+            if start <= row < end:
+                return name
+        return "fulltext"
+
+    def _chunk(self, row: int) -> dict:
+        return json.loads(self.chunks[int(self.offsets[row]):int(self.offsets[row + 1])])
+
+    def _ranges(self, sections: Optional[Sequence[str]]):
+        names = self.sections if sections is None else [s for s in sections if s in self.sections]
+        return [self.sections[n] for n in names]
+
+    def _candidates(self, q: np.ndarray, rows: np.ndarray) -> Candidates:
+        rows = np.asarray(rows, dtype=np.int64)
+        bonus = np.asarray([
+            self.bonus if self._section_of(r).lower() in self.preferred else 0.0 for r in rows.tolist()
+        ], dtype=np.float32)
+        return Candidates(rows.tolist(), np.asarray(self.vectors[rows]), bonus)
+
+    def candidates_many(self, qvecs: Sequence[Sequence[float]], fetch_k: int,
+                        sections: Optional[Sequence[str]] = None) -> List[Candidates]:
+        self.refresh()
+        if len(qvecs) == 0:
+            return []
+        queries = _normalize(np.asarray(qvecs, dtype=np.float32))
+        ranges = self._ranges(sections)
+        if not ranges or fetch_k <= 0:
+            return [self._candidates(q, []) for q in queries]
+        if self.faiss is not None:
+            return self._faiss_candidates(queries, fetch_k, ranges)
+
+        return [self._candidates(q, rows) for q, rows in zip(queries, self._nearest(queries, fetch_k, ranges))]
+
+    def _nearest(self, queries: np.ndarray, n: int, ranges) -> List[np.ndarray]:
+        """Top-n rows per query by exact score; with quantization, via a first pass over the codes."""
+        if self._first_pass is None:
+            return scan_top(queries, ranges, n, self._exact)
+        found = scan_top(queries, ranges, n * RESCORE_FACTOR[self.quantization], self._first_pass)
+        return rescore(queries, found, self.vectors, n)
+
+    def recall(self, queries: Sequence[Sequence[float]], k: int = 10) -> float:
+        """recall@k of the configured search path against an exact float32 scan."""
+        self.refresh()
+        queries = _normalize(np.asarray(queries, dtype=np.float32))
+        ranges = self._ranges(None)
+        if self.faiss is not None:
+            approx = [np.asarray(c.refs, dtype=np.int64) for c in self._faiss_candidates(queries, k, ranges)]
+        else:
+            approx = self._nearest(queries, k, ranges)
+        return recall_at_k(scan_top(queries, ranges, k, self._exact), approx, k)
+
+    def _faiss_candidates(self, queries: np.ndarray, fetch_k: int, ranges) -> List[Candidates]:
+        wanted = fetch_k * (1 if len(ranges) == len(self.sections) else FAISS_OVERSAMPLE)
+        _, found = self.faiss.search(queries, min(wanted, self.vectors.shape[0]))
+        out = []
+        for q, rows in zip(queries, found):
+            keep = [r for r in rows.tolist() if r >= 0 and any(s <= r < e for s, e in ranges)][:fetch_k]
+            out.append(self._candidates(q, keep))
+        return out
+
+    def select(self, qvec: Sequence[float], cands: Candidates, k: int, lambda_mult: float = 0.5) -> List[Document]:
+        if not cands.refs:
+            return []
+        q = _normalize(np.asarray(qvec, dtype=np.float32))
+        return self.documents([cands.refs[j] for j in mmr_rank(q, cands.vectors, k, lambda_mult, cands.bonus)])
+
+    def documents(self, refs) -> List[Document]:
+        docs = []
+        for row in refs:
+            chunk = self._chunk(row)
+            docs.append(Document(page_content=chunk["text"], metadata=chunk["meta"], id=chunk["id"]))
+        return docs
+
+    def search(self, qvec: Sequence[float], k: int, fetch_k: int, lambda_mult: float = 0.5,
+               sections: Optional[Sequence[str]] = None) -> List[Document]:
+        return self.search_many([qvec], k, fetch_k, lambda_mult, sections)[0]
+
+    def search_many(self, qvecs: Sequence[Sequence[float]], k: int, fetch_k: int, lambda_mult: float = 0.5,
+                    sections: Optional[Sequence[str]] = None) -> List[List[Document]]:
+        found = self.candidates_many(qvecs, fetch_k, sections)
+        return [self.select(q, c, k, lambda_mult) for q, c in zip(qvecs, found)]
+
+    def stats(self) -> dict:
+        if not self._loaded:
+            return {"root": str(self.root), "loaded": False}
+        return {
+            "root": str(self.dir),
+            "chunks": self.manifest["count"],
+            "dim": self.manifest["dim"],
+            "faiss": self.manifest.get("faiss") if self.faiss is not None else None,
+            "quantization": self.quantization,
+            "recall": self.manifest.get("recall"),
+            "sections": {name: end - start for name, (start, end) in self.sections.items()},
+        }
@@ -0,0 +1,96 @@
+import json
+import os
+import weakref
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "onnx-model")  # written by export_onnx.py
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "model-int8.onnx")
+ONNX_THREADS = int(os.getenv("ONNX_THREADS", "0"))  # 0 = onnxruntime default (all cores)
+ONNX_BATCH = int(os.getenv("ONNX_BATCH", "32"))
+MANIFEST = "onnx_manifest.json"
+# "torch": sentence-transformers via langchain_huggingface; "onnx": OnnxEmbeddings, no PyTorch import at all
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+
+
+class OnnxEmbeddings(Embeddings):
+    """sentence-transformers encoding (tokenize -> transformer -> mean pool -> normalize) on onnxruntime.
+
+    Needs only onnxruntime, tokenizers and numpy, no PyTorch. export_onnx.py writes
+    the model, tokenizer and pooling settings and checks parity with the PyTorch
+    embeddings, so vectors stay compatible with an index built by embed_local.py.
+    """
+
+    def __init__(self, model_dir: str = ONNX_MODEL_DIR, model_file: str = ONNX_MODEL_FILE,
+                 threads: int = ONNX_THREADS, batch_size: int = ONNX_BATCH):
+        from tokenizers import Tokenizer
+
+        root = Path(model_dir)
+        self.manifest = json.loads((root / MANIFEST).read_text(encoding="utf-8"))
+        self.tokenizer = Tokenizer.from_file(str(root / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.manifest["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.manifest["pad_id"], pad_token=self.manifest["pad_token"])
+        self.model_path = str(root / model_file)
+        self.threads = threads
+        self._open()
+        self.inputs = {i.name for i in self.session.get_inputs()}
+        self.batch_size = max(1, batch_size)
+        if hasattr(os, "register_at_fork"):
+            # onnxruntime's thread pool does not survive fork(); preforked workers open their own session
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._open())
+
+    def _open(self):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            opts.intra_op_num_threads = self.threads
+        self.session = ort.InferenceSession(self.model_path, opts, providers=["CPUExecutionProvider"])
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        enc = self.tokenizer.encode_batch(texts)
+        mask = np.asarray([e.attention_mask for e in enc], dtype=np.int64)
+        feed = {"input_ids": np.asarray([e.ids for e in enc], dtype=np.int64), "attention_mask": mask}
+        if "token_type_ids" in self.inputs:
+            feed["token_type_ids"] = np.asarray([e.type_ids for e in enc], dtype=np.int64)
+        hidden = self.session.run(["last_hidden_state"], feed)[0]
+        m = mask[..., None].astype(np.float32)
+        pooled = (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)  # mean pooling
+        if self.manifest.get("normalize", True):
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # same preprocessing as HuggingFaceEmbeddings
+        texts = [t.replace("\n", " ") for t in texts]
+        out = []
+        for i in range(0, len(texts), self.batch_size):
+            out.extend(self._encode(texts[i:i + self.batch_size]).tolist())
+        return out
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def load_encoder(model_name: str, backend: str = EMBED_BACKEND, model_dir: str = ONNX_MODEL_DIR,
+                 model_path: Optional[str] = None) -> Embeddings:
+    """Query/document encoder for EMBED_BACKEND; imports only what that backend needs.
+
+    `model_path` is a local copy of `model_name` (see build_snapshot.py) for the torch backend.
+    """
+    if backend == "onnx":
+        enc = OnnxEmbeddings(model_dir)
+        if enc.manifest.get("model") != model_name:
+            # vectors from another model would not match the index
+            raise ValueError(f"{model_dir} was exported from {enc.manifest.get('model')!r}, "
+                             f"not EMBED_MODEL {model_name!r}; rerun export_onnx.py")
+        return enc
+    if backend != "torch":
+        raise ValueError(f"unknown EMBED_BACKEND {backend!r} (use torch or onnx)")
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=model_path or model_name)
@@ -0,0 +1,104 @@
+import os
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# first-pass codes written next to vectors.f32 by export_index.py (QUANTIZE=int8,binary)
+CODE_FILES = {"int8": "codes.i8", "binary": "codes.b1"}
+SCALE_FILE = "scale.f32"  # int8 per-dimension scale
+# first pass keeps fetch_k * factor rows for exact rescoring; sign bits need a wider net than int8
+RESCORE_FACTOR = {
+    "int8": int(os.getenv("RESCORE_FACTOR_INT8", "4")),
+    "binary": int(os.getenv("RESCORE_FACTOR_BINARY", "40")),
+}
+SCAN_BLOCK = int(os.getenv("SCAN_BLOCK", "65536"))  # rows scored at a time; bounds temporary memory
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint16)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-dimension int8 codes and their scales (4x smaller than float32)."""
+    scale = np.abs(vectors).max(axis=0) / 127.0 if len(vectors) else np.ones(vectors.shape[1], np.float32)
+    scale = np.where(scale == 0, 1.0, scale).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+    return codes, scale
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits, 8 dimensions per byte (32x smaller than float32)."""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def int8_scorer(codes: np.ndarray, scale: np.ndarray) -> Callable[[np.ndarray, int, int], np.ndarray]:
+    def score(queries: np.ndarray, start: int, end: int) -> np.ndarray:
+        # dot(code * scale, q) == dot(code, q * scale)
+        return (queries * scale) @ codes[start:end].astype(np.float32).T
+    return score
+
+
+def binary_scorer(codes: np.ndarray) -> Callable[[np.ndarray, int, int], np.ndarray]:
+    def score(queries: np.ndarray, start: int, end: int) -> np.ndarray:
+        qbits = quantize_binary(queries)
+        block = np.asarray(codes[start:end])
+        # negative Hamming distance: higher is closer, like a similarity
+        return np.stack([-_POPCOUNT[np.bitwise_xor(block, qb)].sum(axis=1, dtype=np.int32) for qb in qbits])
+    return score
+
+
+def float_scorer(vectors: np.ndarray) -> Callable[[np.ndarray, int, int], np.ndarray]:
+    def score(queries: np.ndarray, start: int, end: int) -> np.ndarray:
+        return queries @ vectors[start:end].T
+    return score
+
+
+def scan_top(queries: np.ndarray, ranges: Sequence[Tuple[int, int]], m: int,
+             score: Callable[[np.ndarray, int, int], np.ndarray]) -> List[np.ndarray]:
+    """Rows with the m highest scores per query over the given row ranges, best first.
+
+    Scores SCAN_BLOCK rows at a time and keeps a running top-m, so the scan never
+    materializes a (queries x rows) matrix for the whole index.
+    """
+    best_rows = [np.zeros(0, dtype=np.int64) for _ in queries]
+    best_scores = [np.zeros(0, dtype=np.float32) for _ in queries]
+    for start, end in ranges:
+        for s in range(start, end, SCAN_BLOCK):
+            e = min(end, s + SCAN_BLOCK)
+            block = score(queries, s, e)
+            rows = np.arange(s, e, dtype=np.int64)
+            for i in range(len(queries)):
+                r = np.concatenate([best_rows[i], rows])
+                sc = np.concatenate([best_scores[i], block[i].astype(np.float32)])
+                if len(sc) > m:
+                    keep = np.argpartition(-sc, m - 1)[:m]
+                    r, sc = r[keep], sc[keep]
+                best_rows[i], best_scores[i] = r, sc
+    return [r[np.argsort(-sc, kind="stable")] for r, sc in zip(best_rows, best_scores)]
+
+
+def rescore(queries: np.ndarray, found: List[np.ndarray], vectors: np.ndarray, n: int) -> List[np.ndarray]:
+    """Exact float32 re-ranking of first-pass rows; reads only those rows of `vectors` from disk."""
+    out = []
+    for q, rows in zip(queries, found):
+        rows = np.sort(rows)  # ascending offsets: sequential-ish reads from the mapped file
+        exact = np.asarray(vectors[rows]) @ q
+        top = np.argsort(-exact, kind="stable")[:n]
+        out.append(rows[top])
+    return out
+
+
+def recall_at_k(exact: List[np.ndarray], approx: List[np.ndarray], k: int) -> float:
+    """Mean share of the exact top-k rows that the approximate search also returned in its top-k."""
+    hits = [len(set(e[:k].tolist()) & set(a[:k].tolist())) / max(1, min(k, len(e))) for e, a in zip(exact, approx)]
+    return float(np.mean(hits)) if hits else 1.0
+
+
+def encode_all(vectors: np.ndarray, modes: Sequence[str]) -> Dict[str, Tuple[np.ndarray, ...]]:
+    out = {}
+    for mode in modes:
+        if mode == "int8":
+            out[mode] = quantize_int8(vectors)
+        elif mode == "binary":
+            out[mode] = (quantize_binary(vectors),)
+        else:
+            raise ValueError(f"unknown quantization {mode!r} (use int8 or binary)")
+    return out
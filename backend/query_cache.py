@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))  # seconds
+INDEX_CHECK_INTERVAL = float(os.getenv("INDEX_CHECK_INTERVAL", "2"))  # seconds between index stats
+
+
+def normalize_question(q: str) -> str:
+    return " ".join((q or "").split())
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire `ttl` seconds after insertion."""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class IndexVersion:
+    """Cheap change detector for a Chroma persist directory.
+
+    The version is the (mtime, size) of chroma.sqlite3 and its WAL, which every
+    write to any collection touches, and of the CURRENT pointer of a versioned
+    index (index_versions.py), which moves when a new build goes live. The files
+    are stat'ed at most once per `interval` seconds, so checking it on every
+    request costs nothing.
+    """
+
+    FILES = ("CURRENT", "chroma.sqlite3", "chroma.sqlite3-wal")  # CURRENT: index_versions.POINTER
+
+    def __init__(self, index_dir: str, interval: float = INDEX_CHECK_INTERVAL,
+                 files: Optional[Tuple[str, ...]] = None):
+        self.index_dir = index_dir
+        self.interval = interval
+        self.files = files or self.FILES
+        self._checked = 0.0
+        self._version: Tuple = ()
+        self._lock = threading.Lock()
+
+    def _stat(self) -> Tuple:
+        out = []
+        for name in self.files:
+            try:
+                st = os.stat(os.path.join(self.index_dir, name))
+                out.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def current(self) -> Tuple:
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked >= self.interval:
+                self._version = self._stat()
+                self._checked = now
+            return self._version
+
+
+class QueryCache:
+    """Query-embedding and ranked-result caches for the serving layer.
+
+    Result entries are dropped as soon as the index version changes.
+    """
+
+    def __init__(self, index_dir: str, files: Optional[Tuple[str, ...]] = None):
+        self.embeddings = TTLCache()
+        self.results = TTLCache()
+        self.version = IndexVersion(index_dir, files=files)
+        self._seen_version: Optional[Tuple] = None
+        self._served: List[Callable[[], Any]] = []
+        self.invalidations = 0
+
+    def track(self, served_version: Callable[[], Any]):
+        """Also drop results when `served_version()` changes, e.g. when an engine finishes a background reload."""
+        self._served.append(served_version)
+
+    def current_version(self) -> Tuple:
+        """The index files' version plus every tracked served version."""
+        return (self.version.current(), *(f() for f in self._served))
+
+    def _check_version(self):
+        v = self.current_version()
+        if v != self._seen_version:
+            if self._seen_version is not None:
+                self.results.clear()
+                self.invalidations += 1
+            self._seen_version = v
+
+    def get_documents(self, key: Tuple) -> Optional[List[Document]]:
+        self._check_version()
+        docs = self.results.get(key)
+        return None if docs is None else list(docs)
+
+    def put_documents(self, key: Tuple, docs: List[Document]):
+        self.results.set(key, list(docs))
+
+    def documents(self, key: Tuple, compute: Callable[[], List[Document]]) -> List[Document]:
+        docs = self.get_documents(key)
+        if docs is None:
+            docs = compute()
+            self.put_documents(key, docs)
+        return list(docs)
+
+    def stats(self) -> dict:
+        return {
+            "query_embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+            "index_invalidations": self.invalidations,
+        }
+
+
+class MemoEmbeddings(Embeddings):
+    """In-memory LRU+TTL layer for embed_query; documents pass straight through."""
+
+    def __init__(self, inner: Embeddings, cache: TTLCache):
+        self.inner = inner
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = normalize_question(text)
+        vec = self.cache.get(key)
+        if vec is None:
+            vec = self.inner.embed_query(text)
+            self.cache.set(key, vec)
+        return vec
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """embed_query for many texts, encoding all misses in one batched call."""
+        vecs = [self.cache.get(normalize_question(t)) for t in texts]
+        missing = [i for i, v in enumerate(vecs) if v is None]
+        if missing:
+            # embed_documents == embed_query for symmetric models like MiniLM
+            fresh = self.inner.embed_documents([texts[i] for i in missing])
+            for i, v in zip(missing, fresh):
+                self.cache.set(normalize_question(texts[i]), v)
+                vecs[i] = v
+        return vecs
+
+
+class CachedRetriever(BaseRetriever):
+    """Wraps a retriever so identical (question, search kwargs) pairs hit the QueryCache."""
+
+    retriever: Any
+    cache: Any
+
+    def cache_key(self, query: str, **overrides) -> Tuple:
+        """`overrides` replace search kwargs for this search (e.g. a deeper k), and are part of the key."""
+        kwargs = {**(getattr(self.retriever, "search_kwargs", {}) or {}), **overrides}
+        search_type = getattr(self.retriever, "search_type", "")
+        return (normalize_question(query), search_type, repr(sorted(kwargs.items())))
+
+    def cached(self, query: str, **overrides) -> Optional[List[Document]]:
+        return self.cache.get_documents(self.cache_key(query, **overrides))
+
+    def store(self, query: str, docs: List[Document], **overrides):
+        self.cache.put_documents(self.cache_key(query, **overrides), docs)
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.cache.documents(self.cache_key(query), lambda: self.retriever.invoke(query))
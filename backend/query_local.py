@@ -2,6 +2,7 @@
 # from langchain.embeddings import HuggingFaceEmbeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_chroma import Chroma
+from index_versions import resolve
 
 INDEX_DIR = "index-chroma"
 MODEL = "sentence-transformers/all-MiniLM-L6-v2"
@@ -11,7 +12,7 @@ def main():
     # db = Chroma(persist_directory=INDEX_DIR, embedding_function=HuggingFaceEmbeddings(model_name=MODEL))
     emb = HuggingFaceEmbeddings(model_name=MODEL)
     db = Chroma(
-        persist_directory=INDEX_DIR,
+        persist_directory=str(resolve(INDEX_DIR)),
         embedding_function=emb,
         collection_name=COLLECTION,
     )
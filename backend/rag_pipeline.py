@@ -0,0 +1,131 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from batch_search import query_candidates, mmr_select
+from section_index import section_scope
+from metrics import metrics
+
+
+class Timings(dict):
+    """stage name -> seconds spent in it during one request."""
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. `embed;dur=3.1, vector_search;dur=12.0`."""
+        return ", ".join(f"{name};dur={sec * 1000:.1f}" for name, sec in self.items())
+
+
+@contextmanager
+def stage(name: str, timings: Optional[Timings] = None):
+    """Time a block into the stage histogram (and `timings`); count it as a stage error if it raises."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.stage_errors.inc(name)
+        raise
+    finally:
+        dt = time.perf_counter() - t0
+        metrics.stage_seconds.observe(dt, name)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + dt
+
+
+class EngineRetriever(BaseRetriever):
+    """`vs.as_retriever(search_type="mmr", ...)` over a SectionIndex / MmapIndex / ShardedIndex instead of Chroma.
+
+    Same search_type and search_kwargs, so CachedRetriever keys and RagPipeline
+    behave as with Chroma, but serving from mapped files never imports chromadb.
+    """
+
+    engine: Any
+    embeddings: Any
+    search_type: str = "mmr"
+    search_kwargs: Dict[str, Any] = {}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        kw = self.search_kwargs
+        return self.engine.search(
+            self.embeddings.embed_query(query), kw.get("k", 4), kw.get("fetch_k", 20),
+            kw.get("lambda_mult", 0.5), section_scope(kw.get("filter")),
+        )
+
+
+class RagPipeline:
+    """Retrieval as explicit, timed stages: result_cache -> embed -> vector_search -> mmr -> section_sort.
+
+    Produces the same documents as `retriever.invoke`, and fills the same result
+    cache, but each step shows up separately in the metrics. One retrieval serves
+    both the LLM call and any retrieval-only fallback.
+    """
+
+    def __init__(self, retriever, vs, emb, prioritize: Callable[[List[Document]], List[Document]],
+                 engine=None):
+        self.retriever = retriever  # CachedRetriever
+        self.vs = vs  # None when an engine serves without Chroma
+        self.emb = emb
+        self.prioritize = prioritize
+        self._engine = engine  # SectionIndex / MmapIndex / ShardedIndex / LayoutFollower; None searches Chroma
+
+    @property
+    def engine(self):
+        """The engine to search now; a LayoutFollower hands over the one for the served shard layout."""
+        engine = self._engine
+        return engine.current() if hasattr(engine, "current") else engine
+
+    def retrieve(self, question: str, timings: Optional[Timings] = None, need_vector: bool = True,
+                 k: Optional[int] = None) -> Tuple[List[Document], Optional[Sequence[float]]]:
+        """(docs, query vector). The vector is skipped on a result-cache hit unless `need_vector`.
+
+        `k` replaces the retriever's k (fetch_k grows to match), e.g. to fuse a deeper list.
+        """
+        inner = self.retriever.retriever
+        depth = {}
+        if k is not None:
+            fetch_k = (getattr(inner, "search_kwargs", {}) or {}).get("fetch_k", 20)
+            depth = {"k": k, "fetch_k": max(k, fetch_k)}
+        with stage("result_cache", timings):
+            docs = self.retriever.cached(question, **depth)
+        qvec = None
+        if docs is None or need_vector:
+            with stage("embed", timings):
+                qvec = self.emb.embed_query(question)
+        if docs is None:
+            docs = self._search(question, qvec, timings, depth)
+            self.retriever.store(question, docs, **depth)
+        return docs, qvec
+
+    def _search(self, question: str, qvec, timings: Optional[Timings], depth: Optional[dict] = None) -> List[Document]:
+        inner = self.retriever.retriever
+        kwargs = {**(getattr(inner, "search_kwargs", {}) or {}), **(depth or {})}
+        if getattr(inner, "search_type", "") != "mmr":
+            with stage("vector_search", timings):
+                return list(inner.invoke(question) or [])
+        engine = self.engine  # once: candidates and selection must come from the same engine
+        if engine is not None:
+            # a ShardedIndex also times each shard it fans out to
+            fan_out = {"timings": timings} if hasattr(engine, "shards") else {}
+            with stage("vector_search", timings):
+                candidates = engine.candidates_many(
+                    [qvec], kwargs.get("fetch_k", 20), section_scope(kwargs.get("filter")), **fan_out,
+                )[0]
+            with stage("mmr", timings):
+                return engine.select(qvec, candidates, kwargs.get("k", 4), kwargs.get("lambda_mult", 0.5))
+        with stage("vector_search", timings):
+            candidates = query_candidates(
+                self.vs, [qvec], fetch_k=kwargs.get("fetch_k", 20), filter=kwargs.get("filter"),
+            )[0]
+        with stage("mmr", timings):
+            return mmr_select(qvec, candidates, k=kwargs.get("k", 4), lambda_mult=kwargs.get("lambda_mult", 0.5))
+
+    def rank(self, docs: List[Document], k: int, timings: Optional[Timings] = None) -> List[Document]:
+        with stage("section_sort", timings):
+            if self.engine is not None:  # section preference is already part of the MMR score
+                return list(docs[:k])
+            return self.prioritize(docs)[:k]
@@ -1,16 +1,39 @@
 import os
-from fastapi import FastAPI
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, Response
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
+from embedding_cache import CachedEmbeddings, open_cache
+from query_cache import QueryCache, MemoEmbeddings, CachedRetriever, normalize_question
+from answer_cache import SemanticAnswerCache, source_keys
+from batch_search import search_batch, BATCH_MAX_QUESTIONS
+from ask_stream import (
+    stream_answer, sources_payload, retrieval_only_text, NDJSON,
+    NO_LLM_PREFIX, EMPTY_PREFIX, FAILED_PREFIX,
+)
+from singleflight import SingleFlight
+from embed_batcher import BatchedEmbeddings
+from onnx_embeddings import load_encoder, EMBED_BACKEND
+from cold_start import snapshot_model
+from rag_pipeline import RagPipeline, EngineRetriever, Timings, stage
+from section_index import section_scope
+from lexical_index import LexicalIndex, fuse
+from index_versions import VersionedChroma
+from sharded_index import open_engine
+from mmap_index import MmapIndex, MMAP_DIR
+from metrics import metrics, PROMETHEUS_CONTENT_TYPE
+from context_packer import ContextPacker
+from llm_guard import LLMGuard, LLMUnavailable, LLM_DEADLINE_S, LLM_MAX_RETRIES
 
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.chains import create_retrieval_chain
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -24,10 +47,21 @@ INDEX_DIR   = os.getenv("INDEX_DIR", "index-chroma")
 MODEL_NAME  = os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 COLLECTION  = os.getenv("COLLECTION_NAME", "spacebio")  # must match embed_local.py
 DEFAULT_K   = int(os.getenv("DEFAULT_K", "4"))
-FETCH_K     = int(os.getenv("FETCH_K", "16"))
+# "numpy" (default): per-section in-memory index with vectorized MMR (section_index.py), loaded from Chroma
+# once and safe to fork (serve.py); "chroma": Chroma's own search, as on Vercel; "mmap" / "faiss": the
+# read-only files export_index.py writes, shared by all workers via the page cache
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy")
+FETCH_K     = int(os.getenv("FETCH_K", "16" if VECTOR_BACKEND == "chroma" else "64"))
 PREFERRED_SECTIONS = {"results", "discussion", "conclusion", "abstract"}
+# 0: search every section and let preferred ones win through MMR_SECTION_BONUS instead
+SECTION_FILTER = os.getenv("SECTION_FILTER", "1") != "0"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_MODEL   = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# one retrieval before a process reports ready (/ready): starts the encoder's threads and touches the index
+WARMUP_QUESTION = os.getenv("WARMUP_QUESTION", "How does spaceflight affect bone density?")
+# threads for retrieval (vector search + waiting on the embed batcher); keeps the event loop free.
+# More threads than cores lets concurrent queries reach the batcher together.
+RETRIEVE_WORKERS = int(os.getenv("RETRIEVE_WORKERS", "16"))
 
 # -------- APP & CORS --------
 app = FastAPI(title="SpaceBio RAG API", version="0.2")
@@ -37,32 +71,83 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    # for streamed responses this is time to first byte
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    metrics.request_seconds.observe(time.perf_counter() - t0, getattr(route, "path", "unmatched"))
+    return response
+
 # -------- VECTOR STORE / RETRIEVER --------
-emb = HuggingFaceEmbeddings(model_name=MODEL_NAME)
-vs = Chroma(
-    persist_directory=INDEX_DIR,
-    embedding_function=emb,
-    collection_name=COLLECTION,
+# query vectors: in-memory LRU, then the on-disk cache embed_local.py fills, then the model,
+# which encodes queries arriving within a few ms of each other as one batch.
+# EMBED_BACKEND=onnx runs the int8 export from export_onnx.py instead of PyTorch; same vectors, same cache keys
+# results are invalidated when the index being searched changes
+query_cache = QueryCache(MMAP_DIR, files=MmapIndex.FILES) if VECTOR_BACKEND in ("mmap", "faiss") \
+    else QueryCache(INDEX_DIR)
+embed_store = open_cache(MODEL_NAME)
+batched = BatchedEmbeddings(load_encoder(MODEL_NAME, model_path=snapshot_model(MODEL_NAME)))
+emb = MemoEmbeddings(
+    CachedEmbeddings(batched, embed_store),
+    query_cache.embeddings,
+)
+# follows INDEX_DIR/CURRENT: a new build from embed_local.py goes live without a restart.
+# mmap / faiss serve from the exported files and never open Chroma
+vs = None if VECTOR_BACKEND in ("mmap", "faiss") \
+    else VersionedChroma(INDEX_DIR, emb, COLLECTION, version=query_cache.version.current)
+# the section filter picks which per-section matrices to scan; loaded now, reloaded when the index changes.
+# An index built with SHARDS / SHARD_BY is searched shard by shard in parallel, then merged; each new
+# version's shards.json is read again, so a build that changes the layout goes live without a restart too
+engine = open_engine(
+    VECTOR_BACKEND, vs=vs, index_dir=INDEX_DIR, collection=COLLECTION, mmap_dir=MMAP_DIR,
+    preferred=PREFERRED_SECTIONS, version=query_cache.version.current,
 )
-retriever = vs.as_retriever(
-    search_type="mmr",
-    search_kwargs={
-        "k": DEFAULT_K,
-        "fetch_k": FETCH_K,
-        "filter": {"section": {"$in": list(PREFERRED_SECTIONS)}},  
-    },
+engine.refresh()
+# a new index version loads in the background; cached results go when it starts serving
+query_cache.track(engine.served_version)
+if VECTOR_BACKEND == "numpy":
+    # the matrices are in memory now; close Chroma so no client crosses serve.py's fork.
+    # A reload reopens it in the process that needs it
+    vs.close()
+elif vs is not None:
+    query_cache.track(vs.served_version)  # Chroma, sharded or not, switches versions itself
+
+# ranked results are cached per (question, search kwargs) and dropped when the index changes
+search_kwargs = {
+    "k": DEFAULT_K,
+    "fetch_k": FETCH_K,
+    "filter": {"section": {"$in": list(PREFERRED_SECTIONS)}} if SECTION_FILTER else None,
+}
+retriever = CachedRetriever(
+    retriever=EngineRetriever(engine=engine, embeddings=emb, search_kwargs=search_kwargs)
+    if VECTOR_BACKEND != "chroma" else vs.as_retriever(search_type="mmr", search_kwargs=search_kwargs),
+    cache=query_cache,
 )
+# BM25 over the same chunks, built by embed_local.py, for /search mode=lexical|hybrid; needs no encoder
+lexical = LexicalIndex(INDEX_DIR)
+if lexical.available():
+    lexical.refresh()
 
 # --- Schemas ---
 class SearchRequest(BaseModel):
     question: str
     k: Optional[int] = None  
+    # lexical: BM25 only, for exact terms (gene, mission, organism names); hybrid: RRF of dense and BM25
+    mode: Literal["dense", "lexical", "hybrid"] = "dense"
+
+class SearchBatchRequest(BaseModel):
+    questions: List[str]
+    k: Optional[int] = None
 
 class AskRequest(BaseModel):
     question: str
     k: Optional[int] = None  
+    stream: bool = False  # NDJSON: sources first, then tokens (see ask_stream.py)
 
 def prioritize_sections(docs):
     def score(d):
@@ -71,10 +156,21 @@ def prioritize_sections(docs):
 
     return sorted(docs, key=score, reverse=True)
 
-# -------- LLM RAG CHAIN (created on startup if API key present) --------
-rag_chain = None
+# -------- LLM CHAIN (created on startup if API key present) --------
+# Retrieval happens once per request in retrieve(); the chain only stuffs and generates.
+qa_chain = None
+# paraphrased questions with the same sources reuse an answer, until the index changes
+answer_cache = SemanticAnswerCache(version=query_cache.current_version)
+# deadline + in-flight limit + circuit breaker: a struggling provider means fast retrieval-only answers
+llm_guard = LLMGuard()
+# the prompt gets merged, de-overlapped, de-duplicated passages within CONTEXT_TOKEN_BUDGET
+packer = ContextPacker(OPENAI_MODEL)
 if OPENAI_API_KEY:
-    llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0.2, api_key=OPENAI_API_KEY)
+    packer.warm_up()  # at import, so serve.py's workers inherit the loaded encoding
+    llm = ChatOpenAI(
+        model=OPENAI_MODEL, temperature=0.2, api_key=OPENAI_API_KEY,
+        timeout=LLM_DEADLINE_S, max_retries=LLM_MAX_RETRIES,
+    )
     # Prompt tuned for NASA bioscience summarization + citations
     prompt = ChatPromptTemplate.from_messages([
         ("system",
@@ -87,7 +183,60 @@ if OPENAI_API_KEY:
          "Context (citations included below):\n{context}")
     ])
     qa_chain = create_stuff_documents_chain(llm, prompt)
-    rag_chain = create_retrieval_chain(retriever, qa_chain)
+
+# -------- ASYNC EXECUTION + REQUEST COALESCING --------
+# Every request retrieves exactly once; /ask's LLM call and its fallbacks share the result.
+pipeline = RagPipeline(retriever, vs, emb, prioritize_sections, engine)
+executor = ThreadPoolExecutor(max_workers=RETRIEVE_WORKERS, thread_name_prefix="retrieve")
+flights = SingleFlight()
+
+def _retrieve_sync(question: str, k: Optional[int] = None):
+    timings = Timings()
+    docs, qvec = pipeline.retrieve(question, timings, k=k)  # qvec is needed for the answer cache
+    return docs, qvec, timings
+
+async def retrieve(question: str, k: Optional[int] = None):
+    """(docs, query vector, stage timings) from the bounded executor; identical concurrent questions share one run.
+
+    `k` asks for a deeper dense list than the retriever's own k (hybrid search)."""
+    loop = asyncio.get_running_loop()
+    docs, qvec, timings = await flights.do(
+        ("retrieve", normalize_question(question), k),
+        lambda: loop.run_in_executor(executor, _retrieve_sync, question, k),
+    )
+    return docs, qvec, Timings(timings)
+
+# -------- READINESS --------
+# Everything above is built at import, so serve.py can load it once and fork workers that share it.
+# A worker is ready after one real retrieval of its own; the first user request then pays no warm-up.
+_ready = threading.Event()
+
+def warm_up():
+    if _ready.is_set():
+        return
+    with stage("warmup"):
+        pipeline.retrieve(WARMUP_QUESTION)
+    _ready.set()
+
+@app.on_event("startup")
+async def _warm_up_on_start():
+    try:
+        await asyncio.get_running_loop().run_in_executor(executor, warm_up)
+    except Exception as e:
+        # keep serving /health; /ready retries and stays 503 until a retrieval succeeds
+        logger.error("Warm-up retrieval failed: %s", e)
+
+@app.get("/ready")
+def ready(response: Response):
+    """200 once this process has served a warm-up retrieval, 503 before (readiness probe)."""
+    error = None
+    if not _ready.is_set():
+        try:
+            warm_up()
+        except Exception as e:
+            error = str(e)
+            response.status_code = 503
+    return {"ready": _ready.is_set(), "pid": os.getpid(), "error": error}
 
 
 @app.get("/health")
@@ -97,18 +246,32 @@ def health():
         "index_dir": INDEX_DIR, 
         "collection": COLLECTION,
         "embed_model": MODEL_NAME,
+        "embed_backend": EMBED_BACKEND,
+        "vector_backend": VECTOR_BACKEND,
+        "vector_index": engine.stats(),
+        "lexical_index": lexical.stats() if lexical.available() else None,
         "openai_model": OPENAI_MODEL if OPENAI_API_KEY else None,
         "llm_enabled": bool(OPENAI_API_KEY),
+        "cache": {
+            **query_cache.stats(),
+            "embedding_store": embed_store.stats() if embed_store else None,
+            "answers": answer_cache.stats(),
+        },
+        "coalescing": flights.stats(),
+        "embed_batching": batched.batcher.stats(),
+        "llm": llm_guard.stats() if qa_chain is not None else None,
+        "context_packing": packer.stats() if qa_chain is not None else None,
         }
 
-@app.post("/search")
-def search(body: SearchRequest):
-    k = body.k or DEFAULT_K
-    docs = retriever.invoke(body.question)
-    docs = prioritize_sections(docs)[:k]
+@app.get("/metrics")
+def prometheus_metrics():
+    """Per-stage latency histograms, stage error and fallback counters (Prometheus text format)."""
+    return PlainTextResponse(metrics.render(), media_type=PROMETHEUS_CONTENT_TYPE)
 
+def search_response(question: str, k: int, docs):
+    """/search body for already-ranked docs."""
     return {
-        "query": body.question,
+        "query": question,
         "k": k,
         "results": [
             {
@@ -121,89 +284,148 @@ def search(body: SearchRequest):
         ],
     }
 
+def lexical_search(question: str, k: int, timings: Timings):
+    # well under a millisecond, so it runs on the event loop
+    with stage("lexical", timings):
+        return lexical.search(question, k, section_scope(search_kwargs["filter"]))
+
+@app.post("/search")
+async def search(body: SearchRequest, response: Response):
+    k = body.k or DEFAULT_K
+    if body.mode != "dense" and not lexical.available():
+        raise HTTPException(status_code=503, detail="No lexical index; rebuild it with embed_local.py (LEXICAL=1)")
+    if body.mode == "lexical":
+        timings = Timings()
+        docs = lexical_search(body.question, k, timings)
+    elif body.mode == "hybrid":
+        # both lists equally deep, so neither side's tail is missing from the fusion; then cut to k
+        depth = max(k, FETCH_K)
+        dense, _, timings = await retrieve(body.question, k=depth)
+        dense = pipeline.rank(dense, depth, timings)
+        found = lexical_search(body.question, depth, timings)
+        with stage("fusion", timings):
+            docs = fuse([dense, found], k)
+    else:
+        docs, _, timings = await retrieve(body.question)
+        docs = pipeline.rank(docs, k, timings)
+    result = search_response(body.question, k, docs)
+    response.headers["Server-Timing"] = timings.server_timing()
+    return result
+
+@app.post("/search/batch")
+async def search_many(body: SearchBatchRequest):
+    """N questions, one batched encoder call and one vector query; results in request order."""
+    k = body.k or DEFAULT_K
+    if len(body.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUESTIONS} questions per batch")
+    loop = asyncio.get_running_loop()
+    found = await loop.run_in_executor(executor, search_batch, retriever, vs, emb, body.questions, pipeline.engine)
+    return {
+        "k": k,
+        "results": [search_response(q, k, pipeline.rank(docs, k)) for q, docs in zip(body.questions, found)],
+    }
+
+
+
+def _ask_stream(question: str, k: int, docs, top, qvec, timings: Timings):
+    """Stream from already-retrieved docs: the first NDJSON line goes out immediately."""
+    keys = source_keys(docs)
+    cached, context = None, docs
+    if qa_chain is not None:
+        with stage("answer_cache", timings):
+            cached = answer_cache.lookup(qvec, keys, k)
+        if not cached:
+            context = _pack(docs, timings)
 
+    def remember(response):
+        answer_cache.store(qvec, keys, k, response)
+
+    events = stream_answer(
+        question, k, context, top,
+        qa_chain=qa_chain, cached=cached, on_answer=remember,
+        on_fallback=lambda reason: metrics.fallbacks.inc(reason), guard=llm_guard,
+    )
+    # only the stages before the first byte; the LLM stage lands in /metrics
+    return StreamingResponse(events, media_type=NDJSON, headers={"Server-Timing": timings.server_timing()})
+
+def _pack(docs, timings: Timings):
+    with stage("pack", timings):
+        context, report = packer.pack(docs)
+    logger.info("/ask: context %d -> %d tokens (%d saved, %d merged, %d duplicates)",
+                report["tokens_in"], report["tokens_out"], report["tokens_saved"],
+                report["merged"], report["duplicates"])
+    return context
+
+async def _generate(question: str, k: int, context, top):
+    """One guarded LLM call (async client); returns the /ask response, or None for an empty answer."""
+    async def call():
+        with stage("llm"):
+            return await qa_chain.ainvoke({"input": question, "context": context})
+
+    answer_text = await llm_guard.acall(call)
+    if not isinstance(answer_text, str):
+        logger.warning("/ask: unexpected LLM output type=%s", type(answer_text))
+        answer_text = str(answer_text or "")
+    if not answer_text.strip():
+        return None
+    return {"query": question, "k": k, "answer": answer_text, "sources": sources_payload(top)}
 
 @app.post("/ask")
-def ask(body: AskRequest):
+async def ask(body: AskRequest, response: Response):
     k = body.k or DEFAULT_K
+    docs, qvec, timings = await retrieve(body.question)
+    # retrieved once: the LLM context, the cited sources and every fallback below come from here
+    top = pipeline.rank(docs, k, timings)
+
+    if body.stream:
+        return _ask_stream(body.question, k, docs, top, qvec, timings)
 
-    def _retrieval_only_answer(prefix: str):
-        docs = retriever.invoke(body.question) or []
-        docs = prioritize_sections(docs)[:k]
-        bullets = []
-        for i, d in enumerate(docs, 1):
-            sec = (d.metadata.get("section") or "fulltext")
-            text = (d.page_content or "").strip()[:350]
-            bullets.append(f"[{i}] ({sec}) {text}")
+    def _retrieval_only_answer(prefix: str, reason: str):
+        metrics.fallbacks.inc(reason)
         return {
             "query": body.question,
             "k": k,
-            "answer": (
-                f"{prefix}\n\n" +
-                ("\n\n".join(bullets) if bullets else "No matching passages found.")
-            ),
-            "sources": [
-                {
-                    "label":   f"[{i+1}]",
-                    "title":   d.metadata.get("title"), 
-                    "url":     d.metadata.get("url"),
-                    "section": d.metadata.get("section", "fulltext"),
-                }
-                for i, d in enumerate(docs)
-            ],
+            "answer": retrieval_only_text(prefix, top),
+            "sources": sources_payload(top),
         }
 
-    # 1) If no LLM configured, retrieval-only
-    if not rag_chain:
-        logger.info("/ask: rag_chain is None -> retrieval-only")
-        return _retrieval_only_answer("Preliminary synthesis (retrieval-only; set OPENAI_API_KEY to enable LLM):")
-
-    # 2) LLM path with defensive parsing + fallback
     try:
-        result = rag_chain.invoke({"input": body.question}) or {}
-        # Log keys so we can see what came back
-        logger.info("/ask: rag_chain result keys: %s", list(result.keys()))
-
-        # LangChain can return different shapes depending on version/chain:
-        # try several common fields
-        answer_text = (
-            result.get("answer")
-            or result.get("output_text")
-            or result.get("result")
-            or ""
-        )
-
-        # context docs may be under 'context' or 'source_documents'
-        ctx_docs = result.get("context")
-        if ctx_docs is None:
-            ctx_docs = result.get("source_documents")
-        if ctx_docs is None:
-            ctx_docs = []
-
-        # Ensure list
-        if not isinstance(ctx_docs, list):
-            logger.warning("/ask: context is not a list; got type=%s", type(ctx_docs))
-            ctx_docs = []
-
-        ctx_docs = prioritize_sections(ctx_docs)[:k]
+        # 1) If no LLM configured, retrieval-only
+        if qa_chain is None:
+            logger.info("/ask: qa_chain is None -> retrieval-only")
+            return _retrieval_only_answer(NO_LLM_PREFIX, "no_llm")
 
-        # If for some reason there’s no answer, still return snippets
-        if not answer_text.strip():
-            logger.warning("/ask: empty answer_text; falling back to retrieval-only text synthesis")
-            return _retrieval_only_answer("LLM returned no text. Showing retrieval-only synthesis:")
+        # 2) Semantic answer cache: a close paraphrase with overlapping sources skips the LLM
+        keys = source_keys(docs)
+        with stage("answer_cache", timings):
+            cached = answer_cache.lookup(qvec, keys, k)
+        if cached:
+            logger.info("/ask: semantic answer cache hit")
+            return {**cached, "query": body.question}
 
-        sources = [
-            {
-                "label":   f"[{i+1}]",
-                "title":   d.metadata.get("title"),
-                "url":     d.metadata.get("url"),
-                "section": d.metadata.get("section", "fulltext"),
-            }
-            for i, d in enumerate(ctx_docs)
-        ]
+        # 3) LLM path on the packed context; concurrent identical (question, k) requests share one call
+        context = _pack(docs, timings)
+        t0 = time.perf_counter()
+        try:
+            result = await flights.do(
+                ("ask", normalize_question(body.question), k),
+                lambda: _generate(body.question, k, context, top),
+            )
+        except LLMUnavailable as e:
+            logger.warning("/ask: LLM skipped (%s); falling back", e.reason)
+            return _retrieval_only_answer(FAILED_PREFIX, e.reason)
+        except Exception as e:
+            logger.exception("/ask: LLM failed; falling back. %s", e)
+            return _retrieval_only_answer(FAILED_PREFIX, "llm_error")
+        finally:
+            timings["llm"] = time.perf_counter() - t0  # includes waiting on a coalesced call
 
-        return {"query": body.question, "k": k, "answer": answer_text, "sources": sources}
+        # If for some reason there’s no answer, still return snippets
+        if result is None:
+            logger.warning("/ask: empty answer_text; falling back to retrieval-only text synthesis")
+            return _retrieval_only_answer(EMPTY_PREFIX, "empty")
 
-    except Exception as e:
-        logger.exception("/ask: LLM failed; falling back. %s", e)
-        return _retrieval_only_answer("LLM unavailable (quota/error). Showing retrieval-only synthesis:")
\ No newline at end of file
+        answer_cache.store(qvec, keys, k, result)
+        return {**result, "query": body.question}
+    finally:
+        response.headers["Server-Timing"] = timings.server_timing()
@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set
+
+import numpy as np
+from langchain_core.documents import Document
+
+MMR_SECTION_BONUS = float(os.getenv("MMR_SECTION_BONUS", "0.05"))  # added to a preferred section's MMR score
+LOAD_PAGE = 5000
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def section_scope(filter) -> Optional[List[str]]:
+    """Sections named by a `{"section": {"$in": [...]}}` / `{"section": "x"}` filter; None if there is no filter.
+
+    Raises ValueError for filters the index can't push down.
+    """
+    if not filter:
+        return None
+    if set(filter) != {"section"}:
+        raise ValueError(f"unsupported filter {filter!r}")
+    cond = filter["section"]
+    if isinstance(cond, str):
+        return [cond]
+    if isinstance(cond, dict) and set(cond) == {"$in"}:
+        return list(cond["$in"])
+    if isinstance(cond, dict) and set(cond) == {"$eq"}:
+        return [cond["$eq"]]
+    raise ValueError(f"unsupported filter {filter!r}")
+
+
+class Candidates(NamedTuple):
+    refs: List  # per-index handle for each candidate, nearest first
+    vectors: np.ndarray  # (n, dim) unit vectors
+    bonus: np.ndarray  # (n,) section preference
+
+
+class _Section:
+    __slots__ = ("vectors", "ids", "texts", "metas")
+
+    def __init__(self, vectors: np.ndarray, ids: List[str], texts: List[str], metas: List[dict]):
+        self.vectors = vectors  # (n, dim) float32, unit length
+        self.ids = ids
+        self.texts = texts
+        self.metas = metas
+
+
+def _normalize(m: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(m, axis=-1, keepdims=True)
+    return m / np.where(norms == 0, 1, norms)
+
+
+def mmr_rank(query: np.ndarray, cands: np.ndarray, k: int, lambda_mult: float = 0.5,
+             bonus: Optional[np.ndarray] = None) -> List[int]:
+    """Maximal marginal relevance over unit vectors, as matrix ops; indices in selection order.
+
+    score = lambda * sim(query, c) + bonus(c) - (1 - lambda) * max sim(c, selected)
+    """
+    n = len(cands)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    rel = lambda_mult * (cands @ query)
+    if bonus is not None:
+        rel = rel + bonus
+    pair = cands @ cands.T  # one (n, n) product instead of a similarity call per step
+    redundancy = np.zeros(n, dtype=np.float32)
+    taken = np.zeros(n, dtype=bool)
+    picked = []
+    for _ in range(k):
+        scores = np.where(taken, -np.inf, rel - (1 - lambda_mult) * redundancy)
+        j = int(np.argmax(scores))
+        picked.append(j)
+        taken[j] = True
+        np.maximum(redundancy, pair[j], out=redundancy)
+    return picked
+
+
+class Reloading:
+    """`refresh()` for indexes that load a whole version at once (`_load`).
+
+    The first load blocks. When `version()` moves later, the new version loads on
+    a background thread while the loaded one keeps serving; searches already
+    running finish on the arrays they started with.
+    """
+
+    version = None
+    _loaded = False
+    _loaded_version = None
+    _reloading = False
+
+    def refresh(self):
+        v = self.version() if self.version else None
+        if self._loaded and v == self._loaded_version:
+            return
+        with self._lock:
+            if self._loaded and v == self._loaded_version:
+                return
+            if not self._loaded:
+                self._load()
+                self._loaded, self._loaded_version = True, v
+                return
+            if self._reloading:
+                return
+            self._reloading = True
+        threading.Thread(target=self._reload, args=(v,), name="index-reload", daemon=True).start()
+
+    def _reload(self, v):
+        try:
+            self._load()
+        except Exception as e:
+            logger.error("Index reload failed, still serving the previous version: %s", e)
+        finally:
+            self._loaded_version = v  # a failed version is retried when the index moves again
+            self._reloading = False
+
+    def served_version(self):
+        """Version of the data searches currently see (QueryCache.track)."""
+        return self._loaded_version
+
+
+class SectionIndex(Reloading):
+    """The Chroma collection held in memory as one unit-vector matrix per section.
+
+    A section filter only selects which matrices to scan, so it costs nothing at
+    query time; candidates from every scanned section go through one vectorized
+    MMR, with preferred sections getting a score bonus instead of a re-sort.
+    Reloads itself when `version()` (e.g. QueryCache.version.current) changes.
+    `collection` is anything with Chroma's `get`, or a function returning one
+    (VersionedChroma.latest), so a reload reads the version that is now live.
+    """
+
+    def __init__(self, collection, preferred: Iterable[str] = (), bonus: float = MMR_SECTION_BONUS,
+                 version=None):
+        self.collection = collection
+        self.preferred: Set[str] = {s.lower() for s in preferred}
+        self.bonus = bonus
+        self.version = version
+        self._sections: Dict[str, _Section] = {}
+        self._lock = threading.Lock()
+        self.size = 0
+
+    def _load(self):
+        source = self.collection() if callable(self.collection) else self.collection
+        rows: Dict[str, list] = {}
+        offset = 0
+        while True:
+            got = source.get(
+                include=["embeddings", "metadatas", "documents"], limit=LOAD_PAGE, offset=offset,
+            )
+            for cid, vec, meta, text in zip(got["ids"], got["embeddings"], got["metadatas"], got["documents"]):
+                if text is None:
+                    continue
+                meta = meta or {}
+                rows.setdefault(meta.get("section") or "fulltext", []).append((cid, vec, text, meta))
+            if len(got["ids"]) < LOAD_PAGE:
+                break
+            offset += LOAD_PAGE
+        sections = {}
+        for name, items in rows.items():
+            vectors = _normalize(np.asarray([r[1] for r in items], dtype=np.float32))
+            sections[name] = _Section(vectors, [r[0] for r in items], [r[2] for r in items], [r[3] for r in items])
+        self._sections = sections
+        self.size = sum(len(s.ids) for s in sections.values())
+
+    def search(self, qvec: Sequence[float], k: int, fetch_k: int, lambda_mult: float = 0.5,
+               sections: Optional[Sequence[str]] = None) -> List[Document]:
+        return self.search_many([qvec], k, fetch_k, lambda_mult, sections)[0]
+
+    def search_many(self, qvecs: Sequence[Sequence[float]], k: int, fetch_k: int, lambda_mult: float = 0.5,
+                    sections: Optional[Sequence[str]] = None) -> List[List[Document]]:
+        found = self.candidates_many(qvecs, fetch_k, sections)
+        return [self.select(q, c, k, lambda_mult) for q, c in zip(qvecs, found)]
+
+    def candidates_many(self, qvecs: Sequence[Sequence[float]], fetch_k: int,
+                        sections: Optional[Sequence[str]] = None) -> List[Candidates]:
+        """The fetch_k nearest chunks per query; each section scan is one matrix product for all queries."""
+        self.refresh()
+        index = self._sections
+        scope = [index[s] for s in (index if sections is None else sections) if s in index]
+        if len(qvecs) == 0:
+            return []
+        if not scope or fetch_k <= 0:
+            return [Candidates([], np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+                    for _ in qvecs]
+
+        queries = _normalize(np.asarray(qvecs, dtype=np.float32))
+        scores = np.concatenate([queries @ s.vectors.T for s in scope], axis=1)  # (queries, scanned chunks)
+        n = min(fetch_k, scores.shape[1])
+        out = []
+        for row in scores:
+            top = np.argpartition(-row, n - 1)[:n]
+            top = top[np.argsort(-row[top])]
+            refs = list(zip(*self._locate(scope, top)))
+            refs = [(scope[o], r) for o, r in refs]
+            out.append(Candidates(
+                refs,
+                np.stack([sec.vectors[r] for sec, r in refs]),
+                np.asarray([
+                    self.bonus if (sec.metas[r].get("section") or "").lower() in self.preferred else 0.0
+                    for sec, r in refs
+                ], dtype=np.float32),
+            ))
+        return out
+
+    def select(self, qvec: Sequence[float], cands: Candidates, k: int,
+               lambda_mult: float = 0.5) -> List[Document]:
+        """MMR over the candidates with the section bonus folded in; documents in selection order."""
+        if not cands.refs:
+            return []
+        q = _normalize(np.asarray(qvec, dtype=np.float32))
+        picked = mmr_rank(q, cands.vectors, k, lambda_mult, cands.bonus)
+        return self.documents([cands.refs[j] for j in picked])
+
+    @staticmethod
+    def documents(refs) -> List[Document]:
+        """Documents for candidate refs (ShardedIndex builds them after merging shards)."""
+        return [Document(page_content=sec.texts[r], metadata=dict(sec.metas[r]), id=sec.ids[r]) for sec, r in refs]
+
+    @staticmethod
+    def _locate(scope: List[_Section], flat: np.ndarray):
+        """Map indices into the concatenated section scores back to (section, row)."""
+        bounds = np.cumsum([len(s.ids) for s in scope])
+        owners = np.searchsorted(bounds, flat, side="right")
+        rows = flat - np.concatenate([[0], bounds[:-1]])[owners]
+        return owners.tolist(), rows.tolist()
+
+    def stats(self) -> dict:
+        return {
+            "chunks": self.size,
+            "sections": {name: len(s.ids) for name, s in self._sections.items()},
+        }
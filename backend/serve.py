@@ -0,0 +1,158 @@
+import gc
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from typing import Tuple
+
+# Preload-and-fork launcher: the parent imports rag_service once (embedding model, read-only index,
+# caches), then forks WORKERS uvicorn workers that share those pages copy-on-write. A plain
+# `uvicorn --workers N` imports everything again in every worker. Runs with rag_service.py's default
+# VECTOR_BACKEND (numpy); VECTOR_BACKEND=chroma needs uvicorn instead.
+HOST = os.getenv("HOST", "127.0.0.1")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WORKERS", str(min(4, os.cpu_count() or 1))))
+READY_TIMEOUT_S = float(os.getenv("READY_TIMEOUT_S", "120"))
+# Chroma's SQLite and HNSW handles must not cross fork(); the engines serve from plain arrays / mapped files
+# (numpy loads through Chroma, then rag_service closes the client before we fork)
+FORK_SAFE_BACKENDS = ("numpy", "mmap", "faiss")
+
+
+def memory_mb(pid: int) -> dict:
+    """RSS, and the part of it no other process shares (Linux /proc/<pid>/smaps_rollup)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1]) / 1024
+    except OSError:
+        return {}
+    return {"rss": fields.get("Rss", 0.0), "private": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)}
+
+
+def listen() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app_module, sock: socket.socket, ready_fd: int):
+    import uvicorn
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        app_module.warm_up()  # one retrieval in this process before it takes traffic
+        os.write(ready_fd, b"r")
+    except Exception as e:
+        print(f"❌ Worker {os.getpid()} warm-up failed: {e}", flush=True)
+        os._exit(1)
+    os.close(ready_fd)
+    config = uvicorn.Config(app_module.app, log_level=os.getenv("LOG_LEVEL", "info"))
+    uvicorn.Server(config).run(sockets=[sock])
+    os._exit(0)
+
+
+def spawn(app_module, sock: socket.socket) -> Tuple[int, int]:
+    ready_r, ready_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(ready_r)
+        run_worker(app_module, sock, ready_w)
+    os.close(ready_w)
+    return pid, ready_r
+
+
+def wait_ready(pipes: dict) -> list:
+    """Pids whose warm-up finished within READY_TIMEOUT_S."""
+    ready, pending = [], dict(pipes)
+    deadline = time.monotonic() + READY_TIMEOUT_S
+    while pending and time.monotonic() < deadline:
+        readable, _, _ = select.select(list(pending.values()), [], [], deadline - time.monotonic())
+        for fd in readable:
+            pid = next(p for p, f in pending.items() if f == fd)
+            if os.read(fd, 1):
+                ready.append(pid)
+            os.close(fd)
+            del pending[pid]
+    for fd in pending.values():
+        os.close(fd)
+    return ready
+
+
+def main():
+    backend = os.getenv("VECTOR_BACKEND", "numpy")  # rag_service.py's default
+    if backend not in FORK_SAFE_BACKENDS:
+        sys.exit(f"❌ VECTOR_BACKEND={backend} cannot be preloaded; use one of {', '.join(FORK_SAFE_BACKENDS)} "
+                 f"or run uvicorn directly")
+    sock = listen()  # bind first: a taken port fails fast, before the model loads
+
+    t0 = time.perf_counter()
+    import rag_service
+    load_s = time.perf_counter() - t0
+    parent = memory_mb(os.getpid())
+    print(f"📦 Loaded model and {backend} index in {load_s:.1f}s"
+          + (f" ({parent['rss']:.0f} MB RSS)" if parent else ""), flush=True)
+
+    # objects allocated so far are never scanned by the collector, so collections in the
+    # workers do not write to (and copy) the pages they share with the parent
+    gc.collect()
+    gc.freeze()
+
+    pipes = dict(spawn(rag_service, sock) for _ in range(WORKERS))
+    t1 = time.perf_counter()
+    ready = wait_ready(pipes)
+    if not ready:
+        for pid in pipes:
+            os.kill(pid, signal.SIGTERM)
+        sys.exit(f"❌ No worker became ready within {READY_TIMEOUT_S:.0f}s")
+    print(f"✅ {len(ready)}/{WORKERS} workers ready on http://{HOST}:{PORT} in {time.perf_counter() - t1:.1f}s "
+          f"(GET /ready per worker)", flush=True)
+    for pid in ready:
+        mem = memory_mb(pid)
+        if mem:
+            print(f"   worker {pid}: {mem['rss']:.0f} MB RSS, {mem['private']:.0f} MB private "
+                  f"(the rest is shared with the parent)", flush=True)
+
+    workers = set(pipes)
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        workers.discard(pid)
+        if not stopping:
+            # a new worker is another cheap fork of the preloaded parent
+            print(f"⚠️ Worker {pid} exited ({status}); starting a replacement", flush=True)
+            time.sleep(1)  # no tight respawn loop when workers keep failing
+            new_pid, fd = spawn(rag_service, sock)
+            workers.add(new_pid)
+            if not wait_ready({new_pid: fd}):
+                print(f"⚠️ Replacement worker {new_pid} did not become ready", flush=True)
+    print("👋 All workers stopped", flush=True)
+
+
+if __name__ == "__main__":
+    main()
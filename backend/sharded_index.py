@@ -0,0 +1,327 @@
+import hashlib
+import heapq
+import json
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from batch_search import query_candidates
+from index_versions import resolve
+from rag_pipeline import Timings, stage
+from section_index import Candidates, mmr_rank, _normalize, MMR_SECTION_BONUS
+
+logger = logging.getLogger("uvicorn.error")
+
+# Sharded layout: embed_local.py splits the corpus into collections `<COLLECTION_NAME>-<shard>` and lists
+# them in <index version>/shards.json; export_index.py writes one mmap directory per shard next to it.
+# Without shards.json the index is one collection, served as before. Each version has its own layout:
+# LayoutFollower re-reads it when the served version changes.
+SHARDS = int(os.getenv("SHARDS", "1"))  # hash shards; 1 = unsharded
+SHARD_BY = os.getenv("SHARD_BY", "hash")  # "hash" (of the document URL) or "section" (one shard per section)
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))  # fan-out threads; 0 = one per shard
+SHARDS_FILE = "shards.json"
+
+
+def layout_keys(by: str = SHARD_BY, count: int = SHARDS, sections: Iterable[str] = ()) -> List[str]:
+    """Shard names for a build; empty for an unsharded index."""
+    if by == "section":
+        return sorted({s.lower() for s in sections})
+    if by != "hash":
+        raise ValueError(f"SHARD_BY must be 'hash' or 'section', not {by!r}")
+    return [f"s{i}" for i in range(count)] if count > 1 else []
+
+
+def shard_key(url: str, section: str, by: str = SHARD_BY, count: int = SHARDS) -> str:
+    """Shard of a chunk; every chunk of one document lands in the same hash shard."""
+    if by == "section":
+        return (section or "fulltext").lower()
+    return f"s{int(hashlib.sha1(url.encode('utf-8')).hexdigest(), 16) % count}"
+
+
+def shard_collection(collection: str, key: str) -> str:
+    return f"{collection}-{key}"
+
+
+def read_layout(index_dir) -> Optional[dict]:
+    """`{"by": ..., "shards": [...]}` of a sharded index directory, or None."""
+    try:
+        return json.loads((Path(index_dir) / SHARDS_FILE).read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+
+
+def write_layout(index_dir, by: str, keys: Sequence[str]):
+    path = Path(index_dir) / SHARDS_FILE
+    if keys:
+        path.write_text(json.dumps({"by": by, "shards": list(keys)}, indent=2), encoding="utf-8")
+    elif path.exists():
+        path.unlink()
+
+
+class ChromaShard:
+    """One Chroma collection behind the engine interface, so Chroma shards can be fanned out too."""
+
+    def __init__(self, store: Callable[[], Any], preferred: Iterable[str] = (), bonus: float = MMR_SECTION_BONUS):
+        self.store = store  # e.g. lambda: vs.collection(name): follows the served index version
+        self.preferred = {s.lower() for s in preferred}
+        self.bonus = bonus
+
+    def refresh(self):
+        self.store()
+
+    def candidates_many(self, qvecs: Sequence[Sequence[float]], fetch_k: int,
+                        sections: Optional[Sequence[str]] = None) -> List[Candidates]:
+        if (sections is not None and not sections) or fetch_k <= 0:
+            return [Candidates([], np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+                    for _ in qvecs]
+        flt = None if sections is None else {"section": {"$in": list(sections)}}
+        out = []
+        for docs, embs in query_candidates(self.store(), qvecs, fetch_k, flt):
+            out.append(Candidates(
+                docs,
+                _normalize(np.asarray(embs, dtype=np.float32)) if docs else np.zeros((0, 0), dtype=np.float32),
+                np.asarray([
+                    self.bonus if (d.metadata.get("section") or "").lower() in self.preferred else 0.0 for d in docs
+                ], dtype=np.float32),
+            ))
+        return out
+
+    @staticmethod
+    def documents(refs) -> List[Document]:
+        return list(refs)
+
+    def stats(self) -> dict:
+        return {"chunks": self.store()._collection.count()}
+
+
+class ShardedIndex:
+    """Searches every shard in parallel and merges their candidates before one MMR.
+
+    Each shard (SectionIndex, MmapIndex or ChromaShard) returns its own fetch_k
+    nearest chunks; a heap keeps the fetch_k best of those by similarity, which
+    are the candidates one unsharded index would have returned. Each shard's
+    latency is a `shard_<name>` stage. Section shards outside a section filter
+    are not searched at all.
+    """
+
+    def __init__(self, shards: Dict[str, Any], by: str = SHARD_BY, workers: int = SHARD_WORKERS):
+        self.shards = shards
+        self.by = by
+        self.workers = workers or len(shards)
+        self._start()
+        if hasattr(os, "register_at_fork"):
+            # pool threads do not survive fork(); a preforked worker (serve.py) gets its own
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._start())
+
+    def _start(self):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, self.workers), thread_name_prefix="shard")
+
+    def refresh(self):
+        # first loads run side by side too
+        list(self._pool.map(lambda shard: shard.refresh(), self.shards.values()))
+
+    def served_version(self):
+        return tuple(getattr(s, "served_version", lambda: None)() for s in self.shards.values())
+
+    def _scope(self, sections: Optional[Sequence[str]]) -> Dict[str, Any]:
+        if self.by != "section" or sections is None:
+            return self.shards
+        wanted = {s.lower() for s in sections}
+        return {name: shard for name, shard in self.shards.items() if name in wanted}
+
+    def candidates_many(self, qvecs: Sequence[Sequence[float]], fetch_k: int,
+                        sections: Optional[Sequence[str]] = None,
+                        timings: Optional[Timings] = None) -> List[Candidates]:
+        if len(qvecs) == 0:
+            return []
+
+        def search(name: str, shard):
+            with stage(f"shard_{name}", timings):
+                return name, shard.candidates_many(qvecs, fetch_k, sections)
+
+        futures = [self._pool.submit(search, name, shard) for name, shard in self._scope(sections).items()]
+        found = [f.result() for f in futures]
+        queries = _normalize(np.asarray(qvecs, dtype=np.float32))
+        return [self._merge(q, [(name, per_query[i]) for name, per_query in found], fetch_k)
+                for i, q in enumerate(queries)]
+
+    @staticmethod
+    def _merge(q: np.ndarray, per_shard, fetch_k: int) -> Candidates:
+        """The fetch_k most similar candidates over all shards; refs become (shard name, shard ref)."""
+        scored = []
+        for name, cands in per_shard:
+            if cands.refs:
+                scored.extend((s, name, j, cands) for j, s in enumerate((cands.vectors @ q).tolist()))
+        best = heapq.nlargest(fetch_k, scored, key=lambda t: t[0])
+        if not best:
+            return Candidates([], np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.float32))
+        return Candidates(
+            [(name, cands.refs[j]) for _, name, j, cands in best],
+            np.stack([cands.vectors[j] for _, _, j, cands in best]),
+            np.asarray([cands.bonus[j] for _, _, j, cands in best], dtype=np.float32),
+        )
+
+    def select(self, qvec: Sequence[float], cands: Candidates, k: int, lambda_mult: float = 0.5) -> List[Document]:
+        if not cands.refs:
+            return []
+        q = _normalize(np.asarray(qvec, dtype=np.float32))
+        picked = [cands.refs[j] for j in mmr_rank(q, cands.vectors, k, lambda_mult, cands.bonus)]
+        return [self.shards[name].documents([ref])[0] for name, ref in picked]
+
+    def search(self, qvec: Sequence[float], k: int, fetch_k: int, lambda_mult: float = 0.5,
+               sections: Optional[Sequence[str]] = None) -> List[Document]:
+        return self.search_many([qvec], k, fetch_k, lambda_mult, sections)[0]
+
+    def search_many(self, qvecs: Sequence[Sequence[float]], k: int, fetch_k: int, lambda_mult: float = 0.5,
+                    sections: Optional[Sequence[str]] = None) -> List[List[Document]]:
+        found = self.candidates_many(qvecs, fetch_k, sections)
+        return [self.select(q, c, k, lambda_mult) for q, c in zip(qvecs, found)]
+
+    def stats(self) -> dict:
+        shards = {name: shard.stats() for name, shard in self.shards.items()}
+        return {
+            "by": self.by,
+            "workers": self.workers,
+            "chunks": sum(s.get("chunks", 0) for s in shards.values()),
+            "shards": shards,
+        }
+
+
+def open_sharded(layout: dict, backend: str, vs=None, collection: str = "", mmap_dir: str = "",
+                 preferred: Iterable[str] = (), version=None) -> ShardedIndex:
+    """ShardedIndex over the shards in `layout`, each searched like VECTOR_BACKEND=`backend` would."""
+
+    def open_shard(key: str):
+        name = shard_collection(collection, key)
+        if backend == "chroma":
+            return ChromaShard(lambda: vs.collection(name), preferred)
+        if backend == "numpy":
+            from section_index import SectionIndex
+            return SectionIndex(lambda: vs.collection(name, latest=True), preferred, version=version)
+        from mmap_index import MmapIndex
+        return MmapIndex(mmap_dir, preferred, use_faiss=backend == "faiss", version=version, shard=key)
+
+    return ShardedIndex({key: open_shard(key) for key in layout["shards"]}, by=layout.get("by", SHARD_BY))
+
+
+class _Pin:
+    """A version callable for one engine; LayoutFollower moves it while that engine's layout is served."""
+
+    def __init__(self, v):
+        self.v = v
+
+    def __call__(self):
+        return self.v
+
+
+class LayoutFollower:
+    """Serves the engine for the shard layout of the index version being served.
+
+    shards.json is re-read whenever `version()` changes. An unchanged layout keeps
+    its engine, whose shards then reload the new version as before. A changed one
+    gets a new engine from `build(layout, version)` (a ShardedIndex, an unsharded
+    engine, or None to search Chroma itself), which takes over once it has loaded;
+    until then the old engine keeps serving the version it had.
+    """
+
+    def __init__(self, build: Callable[[Optional[dict], Callable[[], Any]], Any],
+                 version: Callable[[], Any], directory: Callable[[], Any], background: bool = True):
+        self.build = build
+        self.version = version
+        self.directory = directory  # the served version's directory, holding its shards.json
+        self.background = background  # False when building an engine is cheap (Chroma shards)
+        self._lock = threading.Lock()
+        self._switching = False
+        self._generation = 0
+        self._seen = version()
+        self.layout = read_layout(directory())
+        self._pin = _Pin(self._seen)
+        self.engine = build(self.layout, self._pin)
+
+    def current(self):
+        """The engine to search now (None: search Chroma)."""
+        v = self.version()
+        if v != self._seen:
+            with self._lock:
+                if v != self._seen and not self._switching:
+                    self._seen = v
+                    layout = read_layout(self.directory())
+                    if layout == self.layout:
+                        self._pin.v = v
+                    elif self.background:
+                        self._switching = True
+                        threading.Thread(target=self._switch, args=(layout, v), name="index-layout",
+                                         daemon=True).start()
+                    else:
+                        self._switching = True
+                        self._switch(layout, v)
+        return self.engine
+
+    def _switch(self, layout: Optional[dict], v):
+        try:
+            pin = _Pin(v)
+            engine = self.build(layout, pin)
+            if engine is not None:
+                engine.refresh()
+            self.layout, self._pin, self.engine = layout, pin, engine
+            self._generation += 1
+            logger.info("Index layout changed to %s", layout["shards"] if layout else "unsharded")
+        except Exception as e:
+            # a failed layout is retried when the index moves again
+            logger.error("Could not open the new index layout, still serving the previous one: %s", e)
+        finally:
+            self._switching = False
+
+    def refresh(self):
+        engine = self.current()
+        if engine is not None:
+            engine.refresh()
+
+    def served_version(self):
+        engine = self.engine
+        return self._generation, getattr(engine, "served_version", lambda: None)()
+
+    # EngineRetriever; only built for backends whose every layout has an engine
+    def search(self, *args, **kwargs) -> List[Document]:
+        return self.current().search(*args, **kwargs)
+
+    def search_many(self, *args, **kwargs) -> List[List[Document]]:
+        return self.current().search_many(*args, **kwargs)
+
+    def stats(self) -> Optional[dict]:
+        engine = self.engine
+        return engine.stats() if engine is not None else None
+
+
+def open_engine(backend: str, vs=None, index_dir: str = "", collection: str = "", mmap_dir: str = "",
+                preferred: Iterable[str] = (), version=None) -> LayoutFollower:
+    """The engine for VECTOR_BACKEND=`backend`, following the shard layout of the served index version.
+
+    Chroma follows the directory `vs` serves from (it switches versions itself);
+    the other backends follow `version`, e.g. QueryCache.version.current.
+    """
+
+    def build(layout: Optional[dict], pinned):
+        if layout:
+            return open_sharded(layout, backend, vs=vs, collection=collection, mmap_dir=mmap_dir,
+                                preferred=preferred, version=pinned)
+        if backend == "numpy":
+            from section_index import SectionIndex
+            return SectionIndex(vs.latest, preferred, version=pinned)
+        if backend in ("mmap", "faiss"):
+            from mmap_index import MmapIndex
+            return MmapIndex(mmap_dir, preferred, use_faiss=backend == "faiss", version=pinned)
+        return None
+
+    if backend == "chroma":
+        return LayoutFollower(build, vs.served_version, vs.served_version, background=False)
+    root = mmap_dir if backend in ("mmap", "faiss") else index_dir
+    return LayoutFollower(build, version, lambda: resolve(root))
@@ -0,0 +1,34 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Coalesce concurrent async calls: callers with the same key share one in-flight run.
+
+    The shared run is shielded, so one caller disconnecting does not cancel the
+    work the others are waiting on. The key is released as soon as the run
+    finishes; later callers start a fresh run (caching is the caches' job).
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(fn())
+            self._inflight[key] = fut
+            self.started += 1
+
+            def release(done, key=key):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+            fut.add_done_callback(release)
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(fut)
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "started": self.started, "coalesced": self.coalesced}
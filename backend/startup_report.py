@@ -0,0 +1,81 @@
+# Cold-start cost of each Vercel function, broken down per imported package and load phase.
+# Every function is imported in a fresh interpreter (`python -X importtime`), as on a cold start,
+# then its first request's loads run. Paths resolve from the repo root, as in the deployment.
+from pathlib import Path
+from collections import defaultdict
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = Path(__file__).resolve().parents[1]
+FUNCTIONS_DIR = ROOT / "app" / "api" / "backend"
+TOP = int(os.getenv("STARTUP_TOP", "12"))  # packages listed per function
+# what the first request of each function loads after the import
+WARM = {
+    "health": "",
+    "search": "shared.get_pipeline()",
+    "search_batch": "shared.get_pipeline()",
+    "ask": "shared.get_pipeline(); shared.get_qa_chain(); shared.OPENAI_API_KEY and shared.get_packer()",
+}
+
+PROBE = """
+import json, sys, time
+sys.path.insert(0, {functions!r})
+t0 = time.perf_counter()
+import {name}
+import shared
+imported = time.perf_counter() - t0
+{warm}
+print(json.dumps({{"import_s": imported, "total_s": time.perf_counter() - t0, **shared.startup_report()}}))
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Self time per top-level package, in seconds, from `-X importtime` output."""
+    per_package = defaultdict(float)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, _cumulative, name = line[len("import time:"):].split("|")
+            per_package[name.strip().split(".")[0]] += int(self_us) / 1e6
+        except ValueError:
+            continue
+    return dict(per_package)
+
+
+def probe(name: str) -> dict:
+    code = PROBE.format(functions=str(FUNCTIONS_DIR), name=name, warm=WARM.get(name, "") or "pass")
+    t0 = time.perf_counter()
+    done = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - t0
+    if done.returncode != 0:
+        tail = done.stderr.strip().splitlines()[-1:] or ["?"]
+        return {"error": tail[0], "wall_s": wall}
+    result = json.loads(done.stdout.strip().splitlines()[-1])
+    result["packages"] = parse_importtime(done.stderr)
+    result["wall_s"] = wall
+    return result
+
+
+def main():
+    names = sys.argv[1:] or list(WARM)
+    for name in names:
+        r = probe(name)
+        if "error" in r:
+            print(f"❌ {name}: {r['error']}")
+            continue
+        print(f"\n🧊 {name}: {r['total_s']:.2f}s to first request "
+              f"(imports {r['import_s']:.2f}s, process {r['wall_s']:.2f}s)")
+        for pkg, sec in sorted(r["packages"].items(), key=lambda kv: kv[1], reverse=True)[:TOP]:
+            print(f"   {pkg:<28} {sec * 1000:8.1f} ms")
+        for phase_name, ms in r["phases_ms"].items():
+            print(f"   ⏱️ {phase_name:<25} {ms:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the backend is a directory of flat scripts that import each other by module name
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
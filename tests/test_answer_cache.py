@@ -0,0 +1,27 @@
+from answer_cache import SemanticAnswerCache
+
+SOURCES = frozenset({("https://example.org/a", "results")})
+
+
+def test_paraphrase_hits_until_index_version_changes():
+    version = [1]
+    cache = SemanticAnswerCache(threshold=0.9, version=lambda: version[0])
+    cache.store([1.0, 0.0, 0.0], SOURCES, 5, {"answer": "bone loss"})
+
+    assert cache.lookup([0.99, 0.05, 0.0], SOURCES, 5) == {"answer": "bone loss"}
+    assert cache.lookup([0.99, 0.05, 0.0], SOURCES, 8) is None  # different k
+
+    version[0] = 2  # a rebuilt index went live
+    assert cache.lookup([1.0, 0.0, 0.0], SOURCES, 5) is None
+    assert cache.stats()["size"] == 0
+    assert cache.stats()["invalidations"] == 1
+
+    cache.store([1.0, 0.0, 0.0], SOURCES, 5, {"answer": "muscle atrophy"})
+    assert cache.lookup([1.0, 0.0, 0.0], SOURCES, 5) == {"answer": "muscle atrophy"}
+
+
+def test_low_source_overlap_misses():
+    cache = SemanticAnswerCache(threshold=0.9, min_overlap=0.5)
+    cache.store([0.0, 1.0], SOURCES, 5, {"answer": "x"})
+    other = frozenset({("https://example.org/b", "results"), ("https://example.org/c", "fulltext")})
+    assert cache.lookup([0.0, 1.0], other, 5) is None
@@ -0,0 +1,94 @@
+import hashlib
+import json
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("langchain.text_splitter")
+
+import embed_local  # noqa: E402
+
+BONE = " ".join(["Hindlimb unloading reduced trabecular bone volume in mice over four weeks."] * 4)
+ROOTS = " ".join(["Arabidopsis roots showed altered gravitropism aboard the ISS."] * 4)
+MUSCLE = " ".join(["Soleus muscle fibres atrophied after thirty days of spaceflight."] * 4)
+
+
+class HashEncoder:
+    """Stands in for the sentence-transformers model: deterministic vectors, and a log of what was encoded."""
+
+    encoded = []
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_sentence_embedding_dimension(self):
+        return 8
+
+    def encode(self, texts, batch_size=32):
+        HashEncoder.encoded.extend(texts)
+        return [[b / 255 for b in hashlib.sha1(t.encode()).digest()[:8]] for t in texts]
+
+
+def record(url, text, section="results"):
+    return {"url": url, "title": url, "section": section, "text": text}
+
+
+@pytest.fixture
+def build(tmp_path, monkeypatch):
+    index = tmp_path / "index"
+    monkeypatch.setattr(embed_local, "IN", tmp_path / "harvested.jsonl")
+    monkeypatch.setattr(embed_local, "INDEX_DIR", str(index))
+    monkeypatch.setattr(embed_local, "SentenceTransformer", HashEncoder)
+    monkeypatch.setattr(embed_local, "open_cache", lambda model: None)  # count every encode
+    monkeypatch.setattr(embed_local, "ENCODE_PROCS", 1)
+    monkeypatch.setattr(embed_local, "LEXICAL", False)
+
+    def run(records, prune=True):
+        """Build from `records`; returns (texts encoded this run, texts in the collection)."""
+        monkeypatch.setattr(embed_local, "PRUNE", prune)
+        embed_local.IN.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+        HashEncoder.encoded = []
+        embed_local.main()
+        coll = chromadb.PersistentClient(path=str(index)).get_collection(embed_local.COLL)
+        return sorted(HashEncoder.encoded), sorted(coll.get(include=["documents"])["documents"])
+
+    return run
+
+
+def test_rebuild_embeds_only_changed_chunks_and_prunes_the_rest(build):
+    encoded, stored = build([record("a", BONE), record("b", ROOTS), record("c", MUSCLE)])
+    assert len(encoded) == 3
+    assert len(stored) == 3
+
+    # same corpus again: nothing to embed
+    encoded, stored_again = build([record("a", BONE), record("b", ROOTS), record("c", MUSCLE)])
+    assert encoded == []
+    assert stored_again == stored
+
+    # b changed, c is gone
+    changed = ROOTS.replace("ISS", "Tiangong")
+    encoded, stored = build([record("a", BONE), record("b", changed)])
+    assert encoded == [changed]
+    assert stored == sorted([BONE, changed])
+
+
+def test_prune_off_keeps_vanished_chunks(build):
+    build([record("a", BONE), record("c", MUSCLE)])
+    encoded, stored = build([record("a", BONE)], prune=False)
+    assert encoded == []
+    assert stored == sorted([BONE, MUSCLE])
+
+
+def test_duplicate_records_and_dropped_sections_are_skipped(build):
+    encoded, stored = build([record("a", BONE), record("a", BONE), record("m", ROOTS, section="methods")])
+    assert encoded == [BONE]
+    assert stored == [BONE]
+
+
+def test_chunk_id_is_stable_and_positional():
+    first = embed_local.chunk_id("u", "results", 0, "text")
+    assert first == embed_local.chunk_id("u", "results", 0, "text")
+    assert first != embed_local.chunk_id("u", "results", 120, "text")
+    assert first != embed_local.chunk_id("u", "discussion", 0, "text")
+    assert first != embed_local.chunk_id("u", "results", 0, "text!")
@@ -0,0 +1,87 @@
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import harvest
+from crawl_manifest import CrawlManifest
+
+SECTION = "<h2>Results</h2><p>" + "Microgravity reduced bone density in mice. " * 20 + "</p>"
+
+
+class EtagServer(BaseHTTPRequestHandler):
+    """Pages /0../n with a fixed ETag; counts full (200) and conditional (304) answers."""
+
+    log = []
+
+    def do_GET(self):
+        etag = f'"v1-{self.path}"'
+        if self.headers.get("If-None-Match") == etag:
+            EtagServer.log.append((self.path, 304))
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        EtagServer.log.append((self.path, 200))
+        body = f"<html><body><h1>Paper {self.path}</h1>{SECTION}</body></html>".encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EtagServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [f"{base}/{i}" for i in range(3)]
+    (tmp_path / "papers.csv").write_text("Title,Link\n" + "".join(f"Paper {i},{u}\n" for i, u in enumerate(urls)))
+    monkeypatch.setattr(harvest, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(harvest, "OUT_PATH", tmp_path / "harvested.jsonl")
+    monkeypatch.setattr(harvest, "CSV_GLOB", str(tmp_path / "*.csv"))
+    monkeypatch.setattr(harvest, "CACHE_DIR", tmp_path / "html-cache")
+    monkeypatch.setattr(harvest, "MANIFEST_PATH", tmp_path / "manifest.sqlite")
+    monkeypatch.setattr(harvest, "PARSE_WORKERS", 1)
+    EtagServer.log = []
+    yield urls
+    server.shutdown()
+
+
+def run(monkeypatch, *args):
+    monkeypatch.setattr(sys, "argv", ["harvest.py", *args])
+    EtagServer.log = []
+    harvest.main()
+    return sorted(code for _, code in EtagServer.log)
+
+
+def statuses(urls):
+    manifest = CrawlManifest(harvest.MANIFEST_PATH)
+    try:
+        return [manifest.page_status(harvest.url_key(u, "")) for u in urls]
+    finally:
+        manifest.close()
+
+
+def test_refresh_revalidates_every_time(site, monkeypatch):
+    assert run(monkeypatch) == [200, 200, 200]
+    records = harvest.OUT_PATH.read_text()
+    assert records.count("\n") == 3
+
+    # the first refresh revalidates "ok" pages, the second the "not_modified" ones the first left behind
+    for _ in range(2):
+        assert run(monkeypatch, "--refresh") == [304, 304, 304]
+        assert statuses(site) == ["not_modified"] * 3
+        assert harvest.OUT_PATH.read_text() == records
+
+
+def test_plain_run_skips_harvested_pages(site, monkeypatch):
+    run(monkeypatch)
+    run(monkeypatch, "--refresh")
+    assert run(monkeypatch) == []
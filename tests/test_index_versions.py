@@ -0,0 +1,40 @@
+import itertools
+
+import pytest
+
+import index_versions as iv
+
+
+@pytest.fixture(autouse=True)
+def build_times(monkeypatch):
+    """One build per 'second', so version names differ and sort in build order."""
+    tick = itertools.count()
+    monkeypatch.setattr(iv.time, "strftime", lambda fmt: f"20250101T{next(tick):06d}")
+
+
+def test_seeded_version_is_an_independent_copy(tmp_path):
+    root = tmp_path / "index"
+    first = iv.new_version(root)
+    (first / "chroma.sqlite3").write_bytes(b"v1")
+    iv.publish(root, first)
+    assert iv.resolve(root) == first
+
+    second = iv.new_version(root, seed=iv.resolve(root))
+    assert not (second / iv.PUBLISHED).exists()
+    (second / "chroma.sqlite3").write_bytes(b"v2")  # updated in place, as Chroma does
+    assert (first / "chroma.sqlite3").read_bytes() == b"v1"
+
+    iv.publish(root, second)
+    assert iv.current_version(root) == second.name
+
+
+def test_gc_keeps_live_version(tmp_path):
+    root = tmp_path / "index"
+    built = []
+    for _ in range(3):
+        v = iv.new_version(root)
+        iv.publish(root, v)
+        built.append(v.name)
+    assert iv.collect_garbage(root, keep=1, grace_s=0) == built[:2]
+    assert iv.versions(root) == [built[2]]
+    assert iv.current_version(root) == built[2]
@@ -0,0 +1,56 @@
+from langchain_core.documents import Document
+
+from lexical_index import LexicalIndex, fuse, tokenize, write_lexical
+
+
+def doc(cid, text=""):
+    return Document(id=cid, page_content=text or cid)
+
+
+def ids(docs):
+    return [d.id for d in docs]
+
+
+def test_fuse_rewards_agreement():
+    dense = [doc("a"), doc("b"), doc("c")]
+    lexical = [doc("c"), doc("d"), doc("a")]
+    # a and c each rank first in one list and third in the other: they tie, ahead of b and d
+    fused = ids(fuse([dense, lexical], k=4, rrf_k=60))
+    assert set(fused[:2]) == {"a", "c"}
+    assert fused[2:] == ["b", "d"]
+
+
+def test_fuse_dedups_and_truncates():
+    fused = fuse([[doc("a"), doc("b")], [doc("b"), doc("a")], [doc("b")]], k=1)
+    assert ids(fused) == ["b"]
+    assert len(fuse([[doc("a")], []], k=5)) == 1
+
+
+def test_fuse_depth_matters():
+    # a chunk the dense side ranks 5th still wins when BM25 ranks it first and nothing else agrees
+    dense = [doc(f"d{i}") for i in range(4)] + [doc("x")]
+    lexical = [doc("x")] + [doc(f"l{i}") for i in range(4)]
+    assert ids(fuse([dense, lexical], k=1)) == ["x"]
+    # fused from a list cut at k=4, it is lost
+    assert "x" not in ids(fuse([dense[:4], lexical[:4]], k=1))
+
+
+def test_tokenize_keeps_identifiers_whole():
+    assert tokenize("The RR-1 mission and p53") == ["rr-1", "rr", "1", "mission", "p53"]
+
+
+def test_bm25_finds_exact_terms(tmp_path):
+    texts = [
+        "Mice flown on RR-1 lost trabecular bone.",
+        "Arabidopsis roots grew in microgravity.",
+        "Bone density of astronauts after long missions.",
+    ]
+    metas = [{"url": f"u{i}", "section": "results", "title": f"t{i}"} for i in range(3)]
+    write_lexical(tmp_path / "lexical", [f"c{i}" for i in range(3)], texts, metas)
+
+    index = LexicalIndex(str(tmp_path))
+    assert index.available()
+    hits = index.search("RR-1 bone", k=2)
+    assert [d.metadata["url"] for d in hits] == ["u0", "u2"]
+    assert index.search("arabidopsis", k=3)[0].metadata["url"] == "u1"
+    assert index.search("zebrafish", k=3) == []
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from llm_guard import CircuitBreaker, CircuitOpen, LLMGuard, LLMTimeout
+
+
+def trickle(n, delay):
+    for i in range(n):
+        time.sleep(delay)
+        yield f"t{i} "
+
+
+def test_stream_passes_chunks_through():
+    guard = LLMGuard(deadline=5)
+    assert list(guard.stream(trickle(3, 0))) == ["t0 ", "t1 ", "t2 "]
+    assert guard.stats()["state"] == "closed"
+    assert guard.in_flight == 0
+
+
+def test_stream_deadline_covers_the_whole_stream():
+    guard = LLMGuard(deadline=0.3, breaker=CircuitBreaker(failures=1, cooldown=60))
+    got = []
+    start = time.monotonic()
+    with pytest.raises(LLMTimeout):
+        for chunk in guard.stream(trickle(100, 0.05)):  # every read is quick, the stream is not
+            got.append(chunk)
+    assert time.monotonic() - start < 1.0
+    assert 0 < len(got) < 100
+    assert guard.timeouts == 1
+    assert guard.in_flight == 0
+    assert guard.stats()["state"] == "open"
+    with pytest.raises(CircuitOpen):
+        list(guard.stream(trickle(1, 0)))
+
+
+def test_stream_error_counts_as_failure():
+    def broken():
+        yield "partial"
+        raise RuntimeError("quota")
+
+    guard = LLMGuard(deadline=5)
+    with pytest.raises(RuntimeError):
+        list(guard.stream(broken()))
+    assert guard.breaker.consecutive == 1
@@ -0,0 +1,60 @@
+from langchain_core.documents import Document
+
+from query_cache import IndexVersion, QueryCache
+
+
+def docs(*texts):
+    return [Document(page_content=t) for t in texts]
+
+
+def test_index_version_follows_writes_and_pointer(tmp_path):
+    (tmp_path / "chroma.sqlite3").write_bytes(b"x")
+    version = IndexVersion(str(tmp_path), interval=0)
+    before = version.current()
+    assert version.current() == before
+
+    (tmp_path / "chroma.sqlite3").write_bytes(b"xy")  # a build wrote to the index
+    after_write = version.current()
+    assert after_write != before
+
+    (tmp_path / "CURRENT").write_text("v-2", encoding="utf-8")  # a new version went live
+    assert version.current() != after_write
+
+
+def test_results_dropped_when_index_changes(tmp_path):
+    (tmp_path / "chroma.sqlite3").write_bytes(b"x")
+    cache = QueryCache(str(tmp_path))
+    cache.version.interval = 0
+    calls = []
+
+    def search():
+        calls.append(1)
+        return docs(f"run {len(calls)}")
+
+    assert cache.documents(("q", 4), search)[0].page_content == "run 1"
+    assert cache.documents(("q", 4), search)[0].page_content == "run 1"
+    assert len(calls) == 1
+
+    (tmp_path / "chroma.sqlite3").write_bytes(b"xy")
+    assert cache.documents(("q", 4), search)[0].page_content == "run 2"
+    assert cache.invalidations == 1
+
+
+def test_tracked_served_version_invalidates(tmp_path):
+    served = ["v-1"]
+    cache = QueryCache(str(tmp_path))
+    cache.track(lambda: served[0])
+    cache.put_documents(("q", 4), docs("old"))
+    assert cache.get_documents(("q", 4))[0].page_content == "old"
+
+    served[0] = "v-2"  # an engine finished loading the next version in the background
+    assert cache.get_documents(("q", 4)) is None
+    assert cache.invalidations == 1
+
+
+def test_cached_documents_are_copies(tmp_path):
+    cache = QueryCache(str(tmp_path))
+    cache.put_documents(("q", 4), docs("a", "b"))
+    got = cache.get_documents(("q", 4))
+    got.pop()
+    assert len(cache.get_documents(("q", 4))) == 2